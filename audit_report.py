@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+
+"""Report space use and audit coverage from integrity_audit.py state
+
+Answers questions people otherwise run du for, from the per-directory
+totals integrity_audit.py stores in its --cache file after every full
+walk that is not read-only, without touching the audited filesystem:
+
+    largest  directories using the most bytes, subtrees included
+    growth   directories that grew the most since the previous full walk
+    stale    directories whose files were all read least recently, never
+             if some were only ever checked against the inode cache
+
+Copyright:
+
+    audit_report.py Report space use and audit coverage
+    Copyright (C) 2016  William Brazelton, Alex Hyer, Christopher Thornton
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sqlite3
+import sys
+from time import localtime, strftime
+
+from integrity_audit import DirectoryStats
+
+__author__ = 'Alex Hyer'
+__email__ = 'theonehyer@gmail.com'
+__license__ = 'GPLv3'
+__maintainer__ = 'Alex Hyer'
+__status__ = 'Production'
+__version__ = '0.1.0'
+
+# ORDER BY clause of DirectoryStats.query for each report
+ORDERS = {
+    'largest': 'bytes DESC',
+    'growth': 'growth DESC',
+    'stale': 'verified ASC'
+}
+
+
+def human_size(size):
+    """Format bytes like du -h
+
+    Args:
+        size (int): number of bytes, may be negative
+
+    Returns:
+        str: size in the largest unit it is at least one of
+
+    Examples:
+        >>> human_size(512)
+        '512B'
+        >>> human_size(1536)
+        '1.5K'
+        >>> human_size(-3 * 1024 ** 4)
+        '-3.0T'
+    """
+
+    value = float(abs(size))
+    for unit in ['B', 'K', 'M', 'G', 'T', 'P']:
+        if value < 1024 or unit == 'P':
+            break
+        value /= 1024
+
+    sign = '-' if size < 0 else ''
+    if unit == 'B':
+        return '{0}{1}B'.format(sign, str(int(value)))
+    return '{0}{1:.1f}{2}'.format(sign, value, unit)
+
+
+def main(args):
+    """Control program flow
+
+    Arguments:
+        args (ArgumentParser): args to control program options
+    """
+
+    if os.path.isfile(args.cache) is False:
+        print('State file does not exist: {0}'.format(args.cache),
+              file=sys.stderr)
+        return 1
+
+    try:
+        stats = DirectoryStats(args.cache)
+        rows = stats.query(os.path.abspath(args.directory),
+                           ORDERS[args.report], args.number, args.depth)
+        stats.close()
+    except sqlite3.Error as error:
+        print('Cannot read state file {0}: {1}'.format(args.cache, error),
+              file=sys.stderr)
+        return 1
+
+    for path, size, files, newest, verified, growth in rows:
+        if args.report == 'growth':
+            value = ('+' if growth > 0 else '') + human_size(growth)
+        else:
+            value = human_size(size)
+        # Directories with cached files may never have been read in full
+        when = strftime('%Y-%m-%d %H:%M', localtime(verified)) \
+            if verified > 0 else 'never'
+        args.output.write('{0:>8}  {1:>9}  {2:<16}  {3}{4}'
+                          .format(value, str(files), when, path,
+                                  os.linesep))
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('report',
+                        type=str,
+                        choices=sorted(ORDERS.keys()),
+                        help='report to print, columns are bytes (or growth '
+                             'since previous walk), files, time every file '
+                             'was last read and path')
+    parser.add_argument('directory', metavar='dir',
+                        type=str,
+                        nargs='?',
+                        default=os.path.sep,
+                        help='only report directories in this directory '
+                             '[default: all]')
+    parser.add_argument('-c', '--cache',
+                        type=str,
+                        required=True,
+                        metavar='FILE',
+                        help='SQLite file given to integrity_audit.py '
+                             '--cache')
+    parser.add_argument('-d', '--depth',
+                        type=int,
+                        default=None,
+                        help='only report directories at most this many '
+                             'levels below dir')
+    parser.add_argument('-n', '--number',
+                        type=int,
+                        default=20,
+                        help='number of directories to report')
+    parser.add_argument('-o', '--output',
+                        type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='file to write report to [default: stdout]')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,355 @@
+#! /usr/bin/env python
+
+"""Record paths changed in audited trees for integrity_audit.py --dirty
+
+Watches every directory of the given trees with Linux inotify and adds
+the paths of files that are written, truncated, touched, created, moved
+or deleted to the dirty list in an integrity_audit.py --cache file.
+Directories that are created or moved into a tree are added as a whole
+and watched too. If the kernel drops events, or a directory cannot be
+watched, the affected trees are added as a whole so the next audit walks
+them.
+
+Changes to checksum files and chunk manifests are ignored so the audit
+does not dirty every directory it writes to. Paths are written in batches
+and each path is stored once no matter how often it changes.
+
+Run one watcher per machine, e.g. from a service manager, then audit with:
+
+    integrity_audit.py -r -w -c STATE_FILE DIR
+
+Copyright:
+
+    audit_watch.py Record paths changed in audited trees
+    Copyright (C) 2016  William Brazelton, Alex Hyer, Christopher Thornton
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import logging
+import logging.handlers
+import os
+import select
+import signal
+import sqlite3
+import struct
+import sys
+from time import time
+
+from integrity_audit import ALGORITHMS, DirtyList, FAST_ALGORITHMS
+
+__author__ = 'Alex Hyer'
+__email__ = 'theonehyer@gmail.com'
+__license__ = 'GPLv3'
+__maintainer__ = 'Alex Hyer'
+__status__ = 'Production'
+__version__ = '0.1.0'
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# IN_MODIFY catches truncate(2) and writes through mmap, which may never be
+# followed by a close, and IN_ATTRIB catches mtimes set with touch
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW
+
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, len of struct inotify_event
+
+# Names of files integrity_audit.py writes, changes to them are ignored
+CHECKSUM_NAMES = set([algorithm + suffix
+                      for algorithm in ALGORITHMS
+                      for suffix in ['sums', 'chunks']] +
+                     [fast + 'sums' for fast in FAST_ALGORITHMS])
+
+# Seconds between writes of changed paths to dirty list
+FLUSH_INTERVAL = 2.0
+
+
+class Watcher(object):
+    """Watch directory trees with inotify and collect changed paths
+
+    Attributes:
+        hidden (bool): watch hidden directories if True
+
+        logger (Logger): logging class to log messages
+
+        changed (set): paths changed since last call to pop()
+
+        _fd (int): inotify file descriptor
+
+        _libc (CDLL): C library providing inotify functions
+
+        _watches (dict): maps watch descriptor to directory path
+
+        _roots (list): paths of watched trees
+    """
+
+    def __init__(self, hidden, logger):
+        """Create inotify instance
+
+        Raises:
+            OSError: if inotify is not available
+        """
+
+        self.hidden = hidden
+        self.logger = logger
+        self.changed = set()
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._watches = {}
+        self._roots = []
+
+    def __len__(self):
+        return len(self._watches)
+
+    def _add_watch(self, path):
+        """Watch a single directory, return False if it cannot be"""
+
+        encoded = path if isinstance(path, bytes) \
+            else path.encode(sys.getfilesystemencoding(), 'surrogateescape')
+        wd = self._libc.inotify_add_watch(self._fd, encoded, WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                self.logger.error('Out of inotify watches, raise '
+                                  'fs.inotify.max_user_watches: {0}'
+                                  .format(path))
+            elif error != errno.ENOENT:
+                self.logger.error('Cannot watch directory {0}: {1}'
+                                  .format(path, os.strerror(error)))
+            return False
+        self._watches[wd] = path
+        return True
+
+    def add_tree(self, top):
+        """Watch top and every directory below it
+
+        Directories that cannot be watched are marked changed so the next
+        audit walks them.
+
+        Args:
+            top (str): path of directory tree to watch
+        """
+
+        for root, dir_names, file_names in os.walk(top):
+            if self.hidden is False:
+                dir_names[:] = [name for name in dir_names
+                                if name[0] != '.']
+            if self._add_watch(root) is False:
+                self.changed.add(root)
+                dir_names[:] = []
+
+    def close(self):
+        """Close inotify instance, removing all watches"""
+
+        os.close(self._fd)
+
+    def fileno(self):
+        """Return inotify file descriptor for use with select"""
+
+        return self._fd
+
+    def read(self):
+        """Read pending events and record paths they changed"""
+
+        data = os.read(self._fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning('Events were dropped, marking all '
+                                    'trees changed')
+                self.changed.update(self._roots)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+
+            if not isinstance(directory, bytes):
+                name = name.decode(sys.getfilesystemencoding(),
+                                   'surrogateescape')
+            # Checksum files and the temporary files they are replaced with
+            # are written by audits, not changed data
+            if name in CHECKSUM_NAMES or (name[:1] == '.' and
+                                          name[1:].rsplit('.', 1)[0]
+                                          in CHECKSUM_NAMES):
+                continue
+            if self.hidden is False and name[:1] in ('.', b'.'):
+                continue
+
+            path = os.path.join(directory, name)
+
+            # Removed directories take their checksum files with them
+            if mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+                continue
+
+            self.changed.add(path)
+
+            # Watch new directories, files in them may predate the watch
+            if mask & IN_ISDIR:
+                self.add_tree(path)
+
+    def pop(self):
+        """Return and forget changed paths"""
+
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+    def watch(self, top):
+        """Watch a directory tree and remember it as a root"""
+
+        self._roots.append(top)
+        self.add_tree(top)
+
+
+def main(args):
+    """Control program flow
+
+    Arguments:
+        args (ArgumentParser): args to control program options
+    """
+
+    # Setup logging
+    log_level = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        'critical': logging.CRITICAL
+    }
+
+    logger = logging.getLogger('audit_watch')
+    logger.setLevel(log_level[args.log_level])
+    if args.log == 'syslog':
+        handler = logging.handlers.SysLogHandler(address='/dev/log')
+        formatter = logging.Formatter(
+            '%(name)s - %(levelname)s: %(message)s')
+    else:
+        handler = logging.FileHandler(filename=args.log)
+        formatter = logging.Formatter(
+            '%(asctime)s %(name)s - %(levelname)s: %(message)s')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    logger.info('Starting audit_watch')
+    logger.info('Command: {0}'.format(' '.join(sys.argv)))
+    logger.info('State File: {0}'.format(os.path.abspath(args.cache)))
+
+    # Exit cleanly, writing collected paths, when asked to stop
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    dirty = DirtyList(args.cache)
+    watcher = Watcher(args.hidden, logger)
+
+    for directory in args.directories:
+        top = os.path.abspath(directory)
+        logger.info('Watching directory tree: {0}'.format(top))
+        watcher.watch(top)
+
+    logger.info('Watching {0} directories'
+                .format(str(len(watcher))))
+
+    flushed = time()
+    try:
+        while True:
+            ready = select.select([watcher], [], [], FLUSH_INTERVAL)[0]
+            if ready:
+                watcher.read()
+            if watcher.changed and time() - flushed >= FLUSH_INTERVAL:
+                paths = watcher.pop()
+                try:
+                    dirty.add(paths)
+                except sqlite3.Error as error:
+                    logger.error('Cannot write dirty list {0}: {1}'
+                                 .format(args.cache, error))
+                    watcher.changed.update(paths)
+                else:
+                    logger.debug('Recorded {0} changed paths'
+                                 .format(str(len(paths))))
+                flushed = time()
+    except (KeyboardInterrupt, SystemExit):
+        dirty.add(watcher.pop())
+        logger.info('Exiting audit_watch')
+    finally:
+        watcher.close()
+        dirty.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('directories', metavar='dir',
+                        type=str,
+                        nargs='+',
+                        help='directory trees to watch')
+    parser.add_argument('-c', '--cache',
+                        type=str,
+                        required=True,
+                        metavar='FILE',
+                        help='SQLite file given to integrity_audit.py '
+                             '--cache to record changed paths in')
+    parser.add_argument('-d', '--hidden',
+                        action='store_true',
+                        help='watch hidden directories and files')
+    parser.add_argument('-l', '--log',
+                        type=str,
+                        default='syslog',
+                        help='log file to write output')
+    parser.add_argument('-o', '--log_level',
+                        type=str,
+                        default='info',
+                        choices=['debug', 'info', 'warning', 'error',
+                                 'critical'],
+                        help='minimum level to log messages at')
+    args = parser.parse_args()
+
+    main(args)
+
+    sys.exit(0)
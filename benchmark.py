@@ -0,0 +1,491 @@
+#! /usr/bin/env python
+
+"""Benchmark performance-critical code of the lab's system tools
+
+Each subcommand builds synthetic data in memory or in a temporary tree,
+or reads a given tree, and reports timings and memory use so changes can
+be compared on the same machine.
+
+Copyright:
+
+    benchmark.py Benchmark the lab's system tools
+    Copyright (C) 2016  William Brazelton, Alex Hyer, Christopher Thornton
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import resource
+import shutil
+from subprocess import call, Popen
+import sys
+import tempfile
+from time import sleep, time
+
+import integrity_audit
+import utils as utils_db
+
+try:
+    range = xrange
+except NameError:  # Python 3
+    pass
+
+__author__ = 'Alex Hyer'
+__email__ = 'theonehyer@gmail.com'
+__license__ = 'GPLv3'
+__maintainer__ = 'Alex Hyer'
+__status__ = 'Production'
+__version__ = '0.1.0'
+
+
+def cpu_time():
+    """Return user plus system CPU seconds used by this process"""
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def digest(args):
+    """Measure CPU cost per GB of each checksum and fast digest
+
+    Hashes an in-memory buffer so disk speed does not hide CPU cost, in
+    blocks of the size integrity_audit.py reads.
+
+    Args:
+        args (Namespace): parsed arguments of the digest subcommand
+    """
+
+    block = os.urandom(integrity_audit.READ_SIZE)
+    blocks = args.size * 1048576 // len(block)
+
+    tiers = [('checksum', name, getattr(hashlib, name))
+             for name in args.algorithms]
+    tiers += [('fast', name, integrity_audit.FAST_ALGORITHMS[name])
+              for name in sorted(integrity_audit.FAST_ALGORITHMS)
+              if integrity_audit.FAST_ALGORITHMS[name] is not None]
+
+    print('{0:<8}  {1:<8}  {2:>10}  {3:>10}'.format('Tier', 'Digest',
+                                                    'CPU s/GB', 'MB/s'))
+    for tier, name, hasher in tiers:
+        hash_object = hasher()
+        start = cpu_time()
+        for count in range(blocks):
+            hash_object.update(block)
+        hash_object.hexdigest()
+        elapsed = max(cpu_time() - start, 1e-6)
+
+        size = blocks * len(block)
+        print('{0:<8}  {1:<8}  {2:>10.2f}  {3:>10.0f}'
+              .format(tier, name, elapsed / size * 1073741824,
+                      size / elapsed / 1048576))
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Return peak resident set size in bytes
+
+    Args:
+        who (int): resource.RUSAGE_SELF for this process or
+                   resource.RUSAGE_CHILDREN for the largest waited-for
+                   child process
+
+    Returns:
+        int: peak resident set size in bytes
+    """
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(who).ru_maxrss * scale
+
+
+def records(args):
+    """Measure peak memory of integrity_audit.py walking a synthetic tree
+
+    Small files are written to a temporary tree, which integrity_audit.py
+    then audits in a child process so the whole walk, its records and its
+    workers are measured. An audit of an empty directory is run first and
+    its peak subtracted to discount the interpreter and imports.
+
+    Args:
+        args (Namespace): parsed arguments of the records subcommand
+    """
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'integrity_audit.py')
+    top = tempfile.mkdtemp(dir=args.directory)
+    try:
+        empty = os.path.join(top, 'empty')
+        tree = os.path.join(top, 'tree')
+        os.mkdir(empty)
+        for index in range(args.files):
+            if index % args.per_directory == 0:
+                directory = os.path.join(tree, 'run_{0:06d}'
+                                         .format(index // args.per_directory))
+                os.makedirs(directory)
+            with open(os.path.join(directory, 'sample_{0:09d}_R1.fastq'
+                                   .format(index)), 'w') as out_h:
+                out_h.write(str(index) + '\n')
+
+        null = open(os.devnull, 'w')
+        try:
+            usage = {}
+            for name, path in [('baseline', empty), ('walk', tree)]:
+                command = [args.interpreter, script, '-r', '-a',
+                           args.algorithm, '-l', os.devnull, '-t',
+                           args.threads, path]
+                start = time()
+                status = call(command, stdout=null)
+                elapsed = time() - start
+                if status != 0:
+                    print('integrity_audit.py exited with status {0}'
+                          .format(str(status)), file=sys.stderr)
+                    sys.exit(1)
+                # Peak of children is the largest of all runs so far, and
+                # the walk is larger than the baseline
+                usage[name] = (elapsed, peak_rss(resource.RUSAGE_CHILDREN))
+        finally:
+            null.close()
+    finally:
+        shutil.rmtree(top)
+
+    elapsed, peak = usage['walk']
+    used = peak - usage['baseline'][1]
+
+    print('Files:                      {0}'.format(str(args.files)))
+    print('Walk time:                  {0:.2f} s'.format(elapsed))
+    print('Baseline peak RSS:          {0:.1f} MB'
+          .format(usage['baseline'][1] / 1048576))
+    print('Walk peak RSS:              {0:.1f} MB'.format(peak / 1048576))
+    print('Bytes per file:             {0:.0f}'.format(used / args.files))
+    print('Peak RSS per million files: {0:.1f} MB'
+          .format(used / args.files * 1000000 / 1048576))
+
+
+def reconcile(args):
+    """Time integrity_audit.reconcile_checksums on single huge directories
+
+    One percent of files are changed, one percent are new, and one
+    percent of stored checksums are for files that no longer exist.
+
+    Args:
+        args (Namespace): parsed arguments of the reconcile subcommand
+    """
+
+    checksum = hashlib.new(args.algorithm).hexdigest()
+    changed = checksum[::-1]
+
+    print('{0:>10}  {1:>10}  {2:>14}'.format('Entries', 'Seconds',
+                                              'ns per entry'))
+    for entries in args.entries:
+        stored = {}
+        files = []
+        for index in range(entries):
+            name = 'sample_{0:09d}_R1.fastq.gz'.format(index)
+            if index % 100 != 0:
+                stored[name] = checksum
+            if index % 100 == 1:
+                files.append((name, changed, 1480000000.0))
+            elif index % 100 != 2:
+                files.append((name, checksum, 1480000000.0))
+
+        start = time()
+        integrity_audit.reconcile_checksums(stored, files)
+        elapsed = time() - start
+
+        print('{0:>10}  {1:>10.3f}  {2:>14.0f}'
+              .format(str(entries), elapsed, elapsed / entries * 1e9))
+
+
+def runtime(args):
+    """Time integrity_audit.py verifying one tree under each interpreter
+
+    The tree must already have checksum files. Audits run read-only so
+    every interpreter verifies the same checksums, and the best of the
+    repeated runs is reported to discount a cold page cache.
+
+    Args:
+        args (Namespace): parsed arguments of the runtime subcommand
+    """
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'integrity_audit.py')
+    command = [script, '-r', '-n', '-a', args.algorithm, '-l', os.devnull,
+               '-t', args.threads, args.directory]
+
+    print('{0:>10}  {1:>10}  {2}'.format('Wall s', 'CPU s', 'Interpreter'))
+    for interpreter in args.interpreters:
+        best = None
+        for run in range(args.repeat):
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time()
+            status = call([interpreter] + command)
+            elapsed = time() - start
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            if status != 0:
+                print('{0} exited with status {1}'
+                      .format(interpreter, str(status)), file=sys.stderr)
+                break
+            cpu = (after.ru_utime - before.ru_utime) + \
+                (after.ru_stime - before.ru_stime)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, cpu)
+
+        if best is not None:
+            print('{0:>10.2f}  {1:>10.2f}  {2}'
+                  .format(best[0], best[1], interpreter))
+
+
+def utils(args):
+    """Time utils.py invocations with and without its compiled cache
+
+    A synthetic catalog of programs in a temporary directory is queried
+    with each command, one entry edited, and names completed with
+    utils_complete.py. Cold runs delete the compiled caches first so the
+    JSON is parsed and the caches rebuilt, warm runs load the caches. The
+    queries are then answered by a utils.py daemon. Name lookups are timed
+    last, in this process against the catalog's index.
+
+    Args:
+        args (Namespace): parsed arguments of the utils subcommand
+    """
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'utils.py')
+    complete = os.path.join(os.path.dirname(script), 'utils_complete.py')
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'utils.json')
+    env = dict(os.environ, XDG_CACHE_HOME=directory)
+    catalog = {}
+    for number in range(args.entries):
+        catalog['program_{0:06d}'.format(number)] = {
+            'categories': ['category_{0}'.format(str(number % 50))],
+            'commands': ['prog{0}'.format(str(number)),
+                         'prog{0}-build'.format(str(number))],
+            'dependencies': ['program_{0:06d}'.format(number // 2)],
+            'description': 'Synthetic program number {0} for timing '
+                           'catalog lookups'.format(str(number)),
+            'installation method': 'source',
+            'previous versions': ['0.9(2016-01-01)'],
+            'version': '1.0'
+        }
+    with open(database, 'w') as out_h:
+        json.dump(catalog, out_h, sort_keys=True)
+
+    commands = [[script, 'show', '-b', database,
+                 'program_{0:06d}'.format(args.entries // 2)],
+                [script, 'list', '-b', database, '--categories'],
+                [script, 'rdeps', '-b', database, 'program_000005'],
+                [script, 'search', '-b', database,
+                 'prog{0}-build'.format(str(args.entries // 4))],
+                [script, 'edit', '-b', database,
+                 'program_{0:06d}'.format(args.entries // 3), '-e', '-v',
+                 '1.1'],
+                [complete, '-b', database, 'program_0001']]
+    null = open(os.devnull, 'w')
+
+    print('Entries: {0}'.format(str(args.entries)))
+    print('{0:<40}  {1:>10}  {2:>10}'.format('Command', 'Cold ms',
+                                              'Warm ms'))
+    try:
+        for command in commands:
+            times = {'cold': [], 'warm': []}
+            for run in range(args.repeat):
+                for state in ['cold', 'warm']:
+                    if state == 'cold':
+                        for name in os.listdir(directory):
+                            if name.endswith(('.cache', '.deps',
+                                              '.search', '.names')):
+                                os.remove(os.path.join(directory, name))
+                    start = time()
+                    call([args.interpreter] + command, stdout=null, env=env)
+                    times[state].append((time() - start) * 1000)
+            label = [os.path.basename(command[0])] + \
+                [argument for argument in command[1:]
+                 if argument not in ('-b', database)]
+            print('{0:<40}  {1:>10.1f}  {2:>10.1f}'
+                  .format(' '.join(label), sorted(times['cold'])
+                          [len(times['cold']) // 2],
+                          sorted(times['warm'])[len(times['warm']) // 2]))
+
+        daemon = Popen([args.interpreter, script, 'daemon', '-b', database],
+                       stdout=null, env=env)
+        try:
+            for wait in range(300):
+                if os.path.exists(database + '.sock'):
+                    break
+                sleep(0.1)
+            print('{0:<40}  {1:>10}'.format('Daemon query', 'ms'))
+            for command in commands[:4]:
+                times = []
+                for run in range(args.repeat + 1):
+                    start = time()
+                    call([args.interpreter] + command, stdout=null, env=env)
+                    times.append((time() - start) * 1000)
+                times = sorted(times[1:])
+                label = [os.path.basename(command[0])] + \
+                    [argument for argument in command[1:]
+                     if argument not in ('-b', database)]
+                print('{0:<40}  {1:>10.1f}'
+                      .format(' '.join(label), times[len(times) // 2]))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    finally:
+        null.close()
+        shutil.rmtree(directory)
+
+    index = utils_db.build_index(catalog)
+    lookups = [('exact', lambda name: index['folded'].get(name.lower())),
+               ('prefix', lambda name: utils_db.prefix_matches(name[:-2],
+                                                               index)),
+               ('did you mean', lambda name: utils_db.suggest(
+                   name[:4] + name[5:], index))]
+    names = sorted(catalog)[::max(1, len(catalog) // 1000)]
+    print('{0:<40}  {1:>10}'.format('Lookup', 'Mean us'))
+    for label, lookup in lookups:
+        start = time()
+        for name in names:
+            lookup(name)
+        print('{0:<40}  {1:>10.1f}'
+              .format(label, (time() - start) / len(names) * 1e6))
+
+
+def main():
+    """Parse arguments and run the requested benchmark"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(title='subcommands',
+                                       help='benchmark to run')
+
+    digest_parser = subparsers.add_parser('digest',
+                                          help='CPU cost per GB of '
+                                               'checksums and fast digests')
+    digest_parser.add_argument('-a', '--algorithms',
+                               type=str,
+                               default=['md5', 'sha1', 'sha256', 'sha512'],
+                               nargs='+',
+                               help='checksum algorithms to time')
+    digest_parser.add_argument('-s', '--size',
+                               type=int,
+                               default=1024,
+                               metavar='MB',
+                               help='data to hash with each digest')
+    digest_parser.set_defaults(func=digest)
+
+    records_parser = subparsers.add_parser('records',
+                                           help='peak memory of '
+                                                'integrity_audit.py walking '
+                                                'a synthetic tree')
+    records_parser.add_argument('-a', '--algorithm',
+                                type=str,
+                                default='sha512',
+                                help='hashing algorithm to audit with')
+    records_parser.add_argument('-d', '--directory',
+                                type=str,
+                                default=None,
+                                help='directory to create the tree in '
+                                     '[default: system temporary '
+                                     'directory]')
+    records_parser.add_argument('-i', '--interpreter',
+                                type=str,
+                                default=sys.executable,
+                                help='Python interpreter to run '
+                                     'integrity_audit.py with')
+    records_parser.add_argument('-n', '--files',
+                                type=int,
+                                default=100000,
+                                help='number of files in tree')
+    records_parser.add_argument('-p', '--per_directory',
+                                type=int,
+                                default=1000,
+                                help='files per directory')
+    records_parser.add_argument('-t', '--threads',
+                                type=str,
+                                default='auto',
+                                help='threads given to integrity_audit.py')
+    records_parser.set_defaults(func=records)
+
+    reconcile_parser = subparsers.add_parser('reconcile',
+                                             help='time reconciling '
+                                                  'checksum files of huge '
+                                                  'directories')
+    reconcile_parser.add_argument('-a', '--algorithm',
+                                  type=str,
+                                  default='sha512',
+                                  help='hashing algorithm sizing checksums')
+    reconcile_parser.add_argument('-n', '--entries',
+                                  type=int,
+                                  default=[10000, 100000, 1000000],
+                                  nargs='+',
+                                  help='numbers of entries per directory to '
+                                       'time')
+    reconcile_parser.set_defaults(func=reconcile)
+
+    runtime_parser = subparsers.add_parser('runtime',
+                                           help='time integrity_audit.py '
+                                                'under different Python '
+                                                'interpreters')
+    runtime_parser.add_argument('directory', metavar='dir',
+                                type=str,
+                                help='audited directory tree to verify')
+    runtime_parser.add_argument('-a', '--algorithm',
+                                type=str,
+                                default='sha512',
+                                help='algorithm of checksum files in tree')
+    runtime_parser.add_argument('-i', '--interpreters',
+                                type=str,
+                                default=['python2', 'python3'],
+                                nargs='+',
+                                help='Python interpreters to compare')
+    runtime_parser.add_argument('-n', '--repeat',
+                                type=int,
+                                default=3,
+                                help='runs per interpreter, best is reported')
+    runtime_parser.add_argument('-t', '--threads',
+                                type=str,
+                                default='auto',
+                                help='threads given to integrity_audit.py')
+    runtime_parser.set_defaults(func=runtime)
+
+    utils_parser = subparsers.add_parser('utils',
+                                         help='latency of utils.py with and '
+                                              'without its compiled cache')
+    utils_parser.add_argument('-i', '--interpreter',
+                              type=str,
+                              default=sys.executable,
+                              help='Python interpreter to run utils.py with')
+    utils_parser.add_argument('-n', '--entries',
+                              type=int,
+                              default=10000,
+                              help='programs in synthetic catalog')
+    utils_parser.add_argument('-r', '--repeat',
+                              type=int,
+                              default=5,
+                              help='runs per command, median is reported')
+    utils_parser.set_defaults(func=utils)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -25,16 +25,51 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
-from glob import iglob
+from array import array
+from binascii import hexlify, unhexlify
+from bisect import bisect_right
+from collections import deque, OrderedDict
+import fcntl
 import hashlib
+import io
 import logging
-from multiprocessing import cpu_count, Process, Queue
-from multiprocessing.managers import BaseManager
+import logging.handlers
+import multiprocessing
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import select
+import shutil
+import sqlite3
+import struct
 from subprocess import check_output
 import sys
+import tempfile
 from time import localtime, strftime, time
+import zlib
+
+# Daemons log through handlers main() sets up, which only forked children
+# inherit, so pin fork where Python 3 may default to spawn or forkserver
+try:
+    processes = multiprocessing.get_context('fork')
+except AttributeError:  # Python 2 always forks
+    processes = multiprocessing
+
+try:
+    range = xrange  # Avoid building lists of millions of file indices
+except NameError:  # Python 3
+    pass
+
+try:
+    string_types = basestring
+except NameError:  # Python 3
+    string_types = str
+
+try:
+    import xxhash
+except ImportError:  # Only needed for xxHash fast digests
+    xxhash = None
 
 __author__ = 'Alex Hyer'
 __credits__ = 'Christopher Thornton'
@@ -44,89 +79,788 @@ __maintainer__ = 'Alex Hyer'
 __status__ = 'Production'
 __version__ = '0.3.0'
 
+# Bytes hashed at each end of files to prefilter duplicate candidates
+DUPLICATE_SAMPLE = 4 * 1048576
 
-class Directory(object):
-    """A simple class to wrap and perform functions on files in a directory
+# Bytes read from a file at a time when hashing with hashlib
+READ_SIZE = 1048576
 
-    The methods of this class just access the attributes so as to work
-    with multiprocessing. Their function should be painfully obvious and
-    warrant no individual documentation (except size()).
+# Chunks verified by one daemon at a time when verifying a file's chunks
+VERIFY_CHUNKS = 16
+
+# Most daemons "--threads auto" keeps busy, enough to hide network latency
+AUTO_THREADS = 64
+
+# Extensions of gzip and BGZF files validated with --compressed
+COMPRESSED_EXTENSIONS = ('.gz', '.bgz', '.bam')
+
+# Threads each daemon decompresses BGZF blocks with, not processes as
+# daemons are daemonic and so cannot have children; zlib releases the GIL
+# while inflating, so threads decompress in parallel anyway
+INFLATE_THREADS = 4
+
+# BGZF blocks decompressed by a thread at a time
+INFLATE_BATCH = 64
+
+# Checksum algorithms, each has a GNU <algorithm>sum program and files
+# <algorithm>sums and <algorithm>chunks
+ALGORITHMS = ['md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512']
+
+# Fast digests --fast can store beside checksums, None if unavailable:
+# BLAKE2 needs Python 3.6+ and xxHash needs the xxhash package. Digests are
+# full size, so <name>sums files match what b2sum and the like output
+FAST_ALGORITHMS = {
+    'blake2b': getattr(hashlib, 'blake2b', None),
+    'xxh64': getattr(xxhash, 'xxh64', None),
+    'xxh128': getattr(xxhash, 'xxh3_128', None)
+}
+
+# Mode bits removed from new checksum files, which are written to temporary
+# files and renamed so an interrupted write cannot truncate them
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Empty block that ends every complete BGZF file
+BGZF_EOF = unhexlify(b'1f8b08040000000000ff060042430200'
+                     b'1b0003000000000000000000')
+
+
+class ArchiveValidator(object):
+    """Check that gzip and BGZF data fed to it decompresses cleanly
+
+    Data is fed in order as it is read for hashing, so validating a file
+    costs no extra read. Plain gzip is streamed through zlib, which checks
+    the CRC32 and length of every member. BGZF files, which include BAM
+    files and bgzip output, are independent gzip blocks, so they are split
+    into blocks and decompressed in batches by a thread pool; zlib
+    releases the GIL while inflating. BGZF files must end with the empty
+    EOF block, whose absence means the file was truncated.
+
+    Attributes:
+        error (str): first problem found, None if none found yet
+
+        _buffer (bytes): data fed but not yet validated
+
+        _decompressor (Decompress): zlib decompressor of plain gzip
+
+        _format (str): 'bgzf' or 'gzip' once the first header is read
+
+        _offset (int): offset in file of start of _buffer
+
+        _last (bytes): last BGZF block read
+
+        _batch (list): BGZF blocks not yet given to pool
+
+        _pending (deque): results of batches given to pool
+
+        _pool (ThreadPool): threads to decompress BGZF blocks with, None
+                            to decompress them in this thread
+    """
+
+    def __init__(self, pool=None):
+        self.error = None
+        self._buffer = b''
+        self._decompressor = None
+        self._format = None
+        self._offset = 0
+        self._last = b''
+        self._batch = []
+        self._pending = deque()
+        self._pool = pool
+
+    def _collect(self, limit=0):
+        """Wait for pending batches until at most limit are pending"""
+
+        while len(self._pending) > limit:
+            self._record(self._pending.popleft().get())
+
+    def _record(self, errors):
+        """Keep first error of a batch of decompressed blocks"""
+
+        for error in errors:
+            if error is not None and self.error is None:
+                self.error = error
+
+    def _submit(self):
+        """Decompress batch of BGZF blocks, in pool if there is one"""
+
+        if not self._batch:
+            return
+        if self._pool is None:
+            self._record([inflate_block(block) for block in self._batch])
+        else:
+            self._pending.append(self._pool.map_async(inflate_block,
+                                                      self._batch))
+            self._collect(2 * INFLATE_THREADS)
+        self._batch = []
+
+    def finish(self):
+        """Validate end of data and return first problem or None
+
+        Returns:
+            str: description of first problem found, None if data is valid
+
+        Examples:
+            >>> validator = ArchiveValidator()
+            >>> validator.update(BGZF_EOF)
+            >>> validator.finish() is None
+            True
+            >>> validator = ArchiveValidator()
+            >>> validator.update(BGZF_EOF[:20])
+            >>> validator.finish()
+            'file is truncated'
+            >>> validator = ArchiveValidator()
+            >>> validator.update(b'ACGT')
+            >>> validator.finish()
+            'not a gzip file'
+            >>> compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            >>> member = compressor.compress(b'ACGT' * 100)
+            >>> member += compressor.flush()
+            >>> validator = ArchiveValidator()
+            >>> validator.update(member[:10])
+            >>> validator.update(member[10:-1] + b'x')
+            >>> 'incorrect length check' in validator.finish()
+            True
+        """
+
+        if self._format == 'bgzf':
+            self._submit()
+            self._collect()
+            if self.error is None and self._buffer:
+                self.error = 'file is truncated'
+            elif self.error is None and self._last != BGZF_EOF:
+                self.error = 'BGZF EOF block is missing'
+        elif self._format == 'gzip':
+            # Python 2 cannot tell a complete member from a truncated one
+            if self.error is None and \
+                    getattr(self._decompressor, 'eof', True) is False:
+                self.error = 'file is truncated'
+        elif self.error is None:
+            self.error = 'file is truncated' if self._buffer \
+                else 'file is empty'
+        return self.error
+
+    def update(self, data):
+        """Validate next data of file
+
+        Args:
+            data (bytes): data read from file
+        """
+
+        if self.error is not None:
+            return
+
+        if self._format is None:
+            self._buffer += data
+            if self._buffer[:2] != b'\x1f\x8b'[:len(self._buffer)]:
+                self.error = 'not a gzip file'
+                return
+            if len(self._buffer) < 18:
+                return
+            size = bgzf_block_size(self._buffer)
+            if size == 0:  # Extra field is longer than data read so far
+                return
+            self._format = 'gzip' if size is None else 'bgzf'
+            data = self._buffer
+            self._buffer = b''
+            if self._format == 'gzip':
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        if self._format == 'gzip':
+            try:
+                while data:
+                    self._decompressor.decompress(data)
+                    data = self._decompressor.unused_data
+                    if data:  # Start of next member
+                        self._decompressor = zlib.decompressobj(
+                            16 + zlib.MAX_WBITS)
+            except zlib.error as error:
+                self.error = str(error)
+            return
+
+        # Split BGZF blocks without copying the whole buffer per block
+        self._buffer += data
+        offset = 0
+        while True:
+            size = bgzf_block_size(self._buffer, offset)
+            if size is None:
+                self.error = 'not a BGZF block at byte {0}'.format(
+                    str(self._offset + offset))
+                return
+            if size == 0 or len(self._buffer) - offset < size:
+                break
+            self._last = self._buffer[offset:offset + size]
+            self._batch.append(self._last)
+            offset += size
+            if len(self._batch) >= INFLATE_BATCH:
+                self._submit()
+        self._buffer = self._buffer[offset:]
+        self._offset += offset
+
+
+class FileRecords(object):
+    """Compact columnar store of the files found while walking a tree
+
+    Keeping a class per file, let alone a multiprocessing proxy per file,
+    costs kilobytes per file and exhausts memory on trees with tens of
+    millions of files. Instead, each attribute of every file is stored in
+    its own typed array and files are referred to by index. Each directory
+    path is stored once and files are assigned to directories by the index
+    of the first file in each directory, so files must be added one
+    directory at a time. Checksums are stored as raw bytes rather than hex.
+
+    Attributes:
+        digest_size (int): size of a checksum in bytes
+
+        fast_size (int): size of a fast digest in bytes, 0 if fast digests
+                         are not stored
+
+        _directories (list): str path of each directory
+
+        _starts (array): index of the first file of each directory
+
+        _names (list): str name of each file
+
+        _sizes (array): size of each file in bytes
+
+        _mtimes (array): mtime of each file in seconds since epoch
+
+        _devices (array): st_dev of each file
+
+        _inodes (array): st_ino of each file
+
+        _checksums (bytearray): digest_size bytes of checksum per file
+
+        _hashed (bytearray): 1 if a file's checksum is set, else 0
+
+        _fast (bytearray): fast_size bytes of fast digest per file
+
+        _fast_hashed (bytearray): 1 if a file's fast digest is set, else 0
+    """
+
+    def __init__(self, digest_size, fast_size=0):
+        """Initialize empty arrays"""
+
+        self.digest_size = digest_size
+        self.fast_size = fast_size
+        self._directories = []
+        self._starts = array('L')
+        self._names = []
+        self._sizes = array('l')
+        self._mtimes = array('d')
+        self._devices = array('L')
+        self._inodes = array('L')
+        self._checksums = bytearray()
+        self._hashed = bytearray()
+        self._fast = bytearray()
+        self._fast_hashed = bytearray()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add_directory(self, path):
+        """Add directory that subsequently added files belong to
+
+        Args:
+            path (str): absolute path to directory
+
+        Returns:
+            int: ID of directory
+        """
+
+        self._directories.append(path)
+        self._starts.append(len(self._names))
+        return len(self._directories) - 1
+
+    def add_file(self, name, size, mtime, device, inode):
+        """Add file to the last added directory
+
+        Args:
+            name (str): name of file
+
+            size (int): size of file in bytes
+
+            mtime (float): mtime of file in seconds since epoch
+
+            device (int): st_dev of file
+
+            inode (int): st_ino of file
+
+        Returns:
+            int: index of file
+
+        Examples:
+            >>> records = FileRecords(4)
+            >>> records.add_directory('/data')
+            0
+            >>> records.add_file('reads.fq', 10, 0.0, 1, 2)
+            0
+            >>> records.path(0)
+            '/data/reads.fq'
+            >>> records.checksum(0) is None
+            True
+            >>> records.set_checksum(0, 'deadbeef')
+            >>> records.checksum(0)
+            'deadbeef'
+        """
+
+        self._names.append(name)
+        self._sizes.append(size)
+        self._mtimes.append(mtime)
+        self._devices.append(device)
+        self._inodes.append(inode)
+        self._checksums.extend(bytearray(self.digest_size))
+        self._hashed.append(0)
+        if self.fast_size > 0:
+            self._fast.extend(bytearray(self.fast_size))
+            self._fast_hashed.append(0)
+        return len(self._names) - 1
+
+    def checksum(self, index):
+        """Return hex checksum of file or None if not calculated"""
+
+        if self._hashed[index] == 0:
+            return None
+        start = index * self.digest_size
+        return str(hexlify(self._checksums[start:start + self.digest_size])
+                   .decode('ascii'))
+
+    def device(self, index):
+        return self._devices[index]
+
+    def directories(self):
+        """Return number of directories"""
+
+        return len(self._directories)
+
+    def directory(self, directory):
+        """Return path of directory with given ID"""
+
+        return self._directories[directory]
+
+    def fast(self, index):
+        """Return hex fast digest of file or None if not calculated
+
+        Examples:
+            >>> records = FileRecords(4, 2)
+            >>> records.add_directory('/data')
+            0
+            >>> records.add_file('reads.fq', 10, 0.0, 1, 2)
+            0
+            >>> records.fast(0) is None
+            True
+            >>> records.set_fast(0, 'cafe')
+            >>> records.fast(0)
+            'cafe'
+        """
+
+        if self.fast_size == 0 or self._fast_hashed[index] == 0:
+            return None
+        start = index * self.fast_size
+        return str(hexlify(self._fast[start:start + self.fast_size])
+                   .decode('ascii'))
+
+    def files(self, directory):
+        """Return indices of files in directory with given ID"""
+
+        end = self._starts[directory + 1] \
+            if directory + 1 < len(self._starts) else len(self._names)
+        return range(self._starts[directory], end)
+
+    def inode(self, index):
+        return self._inodes[index]
+
+    def mtime(self, index):
+        return self._mtimes[index]
+
+    def name(self, index):
+        return self._names[index]
+
+    def path(self, index):
+        """Return absolute path of file"""
+
+        directory = bisect_right(self._starts, index) - 1
+        return os.path.join(self._directories[directory], self._names[index])
+
+    def set_checksum(self, index, checksum):
+        """Store hex checksum of file, None marks checksum as not calculated
+
+        Raises:
+            ValueError: if checksum is not a hex digest of digest_size bytes
+        """
+
+        if checksum is None:
+            self._hashed[index] = 0
+            return
+        digest = bytearray(unhexlify(checksum))
+        if len(digest) != self.digest_size:
+            raise ValueError('{0} is not a {1} byte checksum'
+                             .format(checksum, str(self.digest_size)))
+        start = index * self.digest_size
+        self._checksums[start:start + self.digest_size] = digest
+        self._hashed[index] = 1
+
+    def set_fast(self, index, digest):
+        """Store hex fast digest of file, None marks it as not calculated
+
+        Raises:
+            ValueError: if digest is not a hex digest of fast_size bytes
+        """
+
+        if digest is None:
+            self._fast_hashed[index] = 0
+            return
+        value = bytearray(unhexlify(digest))
+        if len(value) != self.fast_size:
+            raise ValueError('{0} is not a {1} byte fast digest'
+                             .format(digest, str(self.fast_size)))
+        start = index * self.fast_size
+        self._fast[start:start + self.fast_size] = value
+        self._fast_hashed[index] = 1
+
+    def size(self, index):
+        return self._sizes[index]
+
+    def total_size(self):
+        """Return size of all files in bytes"""
+
+        return sum(self._sizes)
+
+
+class InodeCache(object):
+    """Persistent SQLite store of checksums keyed on device and inode
+
+    Snapshot trees built with rsync --link-dest share most inodes with the
+    previous snapshot, so a checksum computed for an inode can be reused
+    for every path linking to it in later runs. A cached checksum is only
+    trusted while the inode's size and mtime are unchanged. ctime is
+    deliberately ignored as creating a hard link updates it.
+
+    Entries not seen for CACHE_RETENTION seconds are pruned on close() so
+    the cache does not grow forever as old snapshots are deleted. New rows
+    are written in batches of CACHE_BATCH and committed on close().
 
     Attributes:
-        _path (str): absolute path to directory
+        path (str): path to SQLite database storing cache
+
+        algorithm (str): hashing algorithm of cached checksums
 
-        _files (list): list of File classes for files in directory
+        _connection (Connection): sqlite3 connection to database
+
+        _rows (list): rows waiting to be written to database
+
+        _seen (float): time of this run in seconds since epoch
     """
 
-    def __init__(self, path, files):
-        """Initialize attributes to store directory data"""
+    CACHE_BATCH = 10000
+
+    CACHE_RETENTION = 30 * 24 * 60 * 60
+
+    def __init__(self, path, algorithm):
+        """Open database and create inodes table if it does not exist"""
+
+        self.path = path
+        self.algorithm = algorithm
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS inodes '
+                                 '(device INTEGER, inode INTEGER, '
+                                 'algorithm TEXT, size INTEGER, mtime REAL, '
+                                 'checksum TEXT, seen REAL, '
+                                 'PRIMARY KEY (device, inode, algorithm))')
+        self._connection.commit()
+        self._rows = []
+        self._seen = time()
+
+    @staticmethod
+    def _signed(number):
+        """Map unsigned 64-bit device and inode numbers into SQLite's range
+
+        Examples:
+            >>> InodeCache._signed(42)
+            42
+            >>> InodeCache._signed(2 ** 64 - 1) == -1
+            True
+        """
+
+        return number - 2 ** 64 if number >= 2 ** 63 else number
+
+    def _flush(self):
+        """Write waiting rows to database"""
+
+        self._connection.executemany('INSERT OR REPLACE INTO inodes VALUES '
+                                     '(?, ?, ?, ?, ?, ?, ?)', self._rows)
+        self._rows = []
+
+    def close(self):
+        """Write new and refreshed checksums, prune old ones, and close"""
+
+        self._flush()
+        self._connection.execute('DELETE FROM inodes WHERE seen < ?',
+                                 (self._seen - self.CACHE_RETENTION,))
+        self._connection.commit()
+        self._connection.close()
 
-        self._files = files
-        self._path = path
+    def get(self, device, inode, size, mtime):
+        """Return cached checksum of inode if size and mtime still match
 
-    def files(self):
-        return self._files
+        Args:
+            device (int): st_dev of file
+
+            inode (int): st_ino of file
 
-    def path(self):
-        return self._path
+            size (int): current size of file in bytes
 
-    def size(self):
-        """Calculate and return size of directory in bytes
+            mtime (float): current mtime of file in seconds since epoch
 
         Returns:
-            int: size of all files in directory
+            str: cached checksum, or None if not cached or stale
+        """
+
+        row = self._connection.execute(
+            'SELECT size, mtime, checksum FROM inodes WHERE device = ? AND '
+            'inode = ? AND algorithm = ?',
+            (self._signed(device), self._signed(inode), self.algorithm)
+        ).fetchone()
+
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        return str(row[2])
+
+    def set(self, device, inode, size, mtime, checksum):
+        """Queue checksum of inode to be written to cache
+
+        Args:
+            device (int): st_dev of file
+
+            inode (int): st_ino of file
+
+            size (int): size of file in bytes when checksum was calculated
+
+            mtime (float): mtime of file when checksum was calculated
+
+            checksum (str): checksum of file
         """
 
-        size = 0
-        for path in self._files:
-            size += path.size()
-        return size
+        self._rows.append((self._signed(device), self._signed(inode),
+                           self.algorithm, size, mtime, checksum, self._seen))
+        if len(self._rows) >= self.CACHE_BATCH:
+            self._flush()
 
 
-class File(object):
-    """A simple class to store file locations, checksums, mtimes, and sizes
+class DirtyList(object):
+    """Persistent SQLite list of paths changed since they were last audited
 
-    While the data stored in this class is accessible, and often initially
-    obtained via the python os library, storing these variables in memory
-    probably reduces access time as opposed to asking the OS every time.
-    Additionally, this class-based approach definitely simplifies the code.
+    audit_watch.py adds the paths of files and directories it sees change
+    and integrity_audit.py --dirty audits only those, clearing them once
+    audited. Paths are the primary key so each is stored once no matter
+    how often it changes. Directories are listed when their entire
+    subtree needs walking, e.g. after they are created or the watcher
+    loses events. The time of each tree's last full walk is also stored
+    so --dirty runs can fall back to one periodically.
 
-    The methods of this class just access the attributes so as to work
-    with multiprocessing. Their function should be painfully obvious and
-    warrant no individual documentation.
+    The list lives in the same database as InodeCache. The database is
+    switched to write-ahead logging so the watcher can add paths while an
+    audit reads them.
 
     Attributes:
-        _path (str): absolute path to file
+        path (str): path to SQLite database storing list
+
+        _connection (Connection): sqlite3 connection to database
+    """
+
+    def __init__(self, path):
+        """Open database and create dirty and walks tables if needed"""
+
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.text_factory = str  # Paths are bytes in Python 2
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS dirty '
+                                 '(path TEXT PRIMARY KEY, time REAL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS walks '
+                                 '(top TEXT PRIMARY KEY, time REAL)')
+        self._connection.commit()
+
+    @staticmethod
+    def _bounds(top):
+        """Return range of keys of paths below top
+
+        Examples:
+            >>> DirtyList._bounds('/data')
+            ('/data/', '/data0')
+        """
+
+        top = top.rstrip(os.path.sep)
+        return top + os.path.sep, top + chr(ord(os.path.sep) + 1)
+
+    def add(self, paths, when=None):
+        """Mark paths as changed
+
+        Args:
+            paths (iterable): absolute paths of changed files and
+                              directories whose subtree changed
+
+            when (float): time of change, defaults to now
+        """
+
+        when = time() if when is None else when
+        self._connection.executemany('INSERT OR REPLACE INTO dirty VALUES '
+                                     '(?, ?)',
+                                     [(path, when) for path in paths])
+        self._connection.commit()
+
+    def clear(self, top, before):
+        """Remove paths at or below top marked before a given time
+
+        Args:
+            top (str): absolute path of audited directory
 
-        _checksum (str): checksum of file
+            before (float): time audit started, paths marked since then
+                            changed during the audit and are kept
+        """
+
+        low, high = self._bounds(top)
+        self._connection.execute('DELETE FROM dirty WHERE (path = ? OR '
+                                 '(path >= ? AND path < ?)) AND time < ?',
+                                 (top.rstrip(os.path.sep), low, high,
+                                  before))
+        self._connection.commit()
+
+    def close(self):
+        """Close database"""
+
+        self._connection.close()
+
+    def last_walk(self, top):
+        """Return time top was last walked entirely, 0 if never"""
+
+        row = self._connection.execute('SELECT time FROM walks WHERE '
+                                       'top = ?', (top,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def paths(self, top):
+        """Return sorted list of changed paths at or below top"""
+
+        low, high = self._bounds(top)
+        return [row[0] for row in self._connection.execute(
+            'SELECT path FROM dirty WHERE path = ? OR (path >= ? AND '
+            'path < ?) ORDER BY path', (top.rstrip(os.path.sep), low, high))]
 
-        _mtime (int): time of last file modification in seconds since epoch
+    def walked(self, top, when):
+        """Record that top was walked entirely at a given time"""
 
-        _size (int): size fo file in bytes
+        self._connection.execute('INSERT OR REPLACE INTO walks VALUES '
+                                 '(?, ?)', (top, when))
+        self._connection.commit()
+
+
+class DirectoryStats(object):
+    """Persistent SQLite store of space used by each audited directory
+
+    Every full walk stores, for each directory, the bytes and number of
+    files in its subtree, the newest mtime among them, when every file in
+    it was last read and checked, and how many bytes the subtree grew by
+    since the previous full walk. A subtree with files whose checksums
+    were taken from the inode cache, or could not be read, keeps the time
+    it was last read in full, 0 if it never was. Indexes on these make
+    reports of the largest, fastest growing and least recently verified
+    directories instant, with no walk of the filesystem. Directories no
+    longer found are removed.
+
+    The store lives in the same database as InodeCache and DirtyList.
+
+    Attributes:
+        path (str): path to SQLite database storing statistics
+
+        _connection (Connection): sqlite3 connection to database
     """
 
-    def __init__(self, path, mtime, size):
-        """Initialize attributes to store file data"""
+    COLUMNS = ['path', 'bytes', 'files', 'newest', 'verified', 'growth']
+
+    def __init__(self, path):
+        """Open database and create directories table if it does not exist"""
 
-        self._path = path
-        self._mtime = mtime
-        self._size = size
-        self._checksum = None
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.text_factory = str  # Paths are bytes in Python 2
+        self._connection.execute('CREATE TABLE IF NOT EXISTS directories '
+                                 '(path TEXT PRIMARY KEY, depth INTEGER, '
+                                 'bytes INTEGER, files INTEGER, newest REAL, '
+                                 'verified REAL, growth INTEGER)')
+        for column in ['bytes', 'verified', 'growth']:
+            self._connection.execute('CREATE INDEX IF NOT EXISTS '
+                                     'directories_{0} ON directories ({0})'
+                                     .format(column))
+        self._connection.commit()
 
-    def checksum(self):
-        return self._checksum
+    def close(self):
+        """Close database"""
 
-    def mtime(self):
-        return self._mtime
+        self._connection.close()
 
-    def path(self):
-        return self._path
+    def query(self, top, order, limit, depth=None):
+        """Return statistics of directories below top in a given order
 
-    def set_checksum(self, checksum):
-        self._checksum = checksum
+        Args:
+            top (str): absolute path of directory to report on
+
+            order (str): SQL ORDER BY clause of columns in COLUMNS
+
+            limit (int): maximum number of directories to return
+
+            depth (int): if given, only directories at most depth levels
+                         below top are returned
+
+        Returns:
+            list: tuple of values of COLUMNS for each directory
+        """
+
+        top = top.rstrip(os.path.sep) or os.path.sep
+        low, high = DirtyList._bounds(top)
+        max_depth = -1
+        if depth is not None:
+            max_depth = depth + (top.count(os.path.sep)
+                                 if top != os.path.sep else 0)
+        return self._connection.execute(
+            'SELECT {0} FROM directories WHERE (path = ? OR (path >= ? AND '
+            'path < ?)) AND (? < 0 OR depth <= ?) ORDER BY {1} LIMIT ?'
+            .format(', '.join(self.COLUMNS), order),
+            (top, low, high, max_depth, max_depth, limit)).fetchall()
+
+    def update(self, top, stats, verified):
+        """Replace statistics of directories below top after a full walk
 
-    def size(self):
-        return self._size
+        Args:
+            top (str): absolute path of walked directory
+
+            stats (iterable): (path, bytes, files, newest, read) tuple for
+                              each directory found, totals include
+                              subtrees and read is True if every file in
+                              the subtree was read
+
+            verified (float): time walk started
+        """
+
+        stats = list(stats)
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, '
+            'COALESCE(?, (SELECT verified FROM directories WHERE path = ?), '
+            '0), ? - COALESCE((SELECT bytes FROM directories WHERE '
+            'path = ?), 0))',
+            [(path, path.count(os.path.sep), size, files, newest,
+              verified if read is True else None, path, size, path)
+             for path, size, files, newest, read in stats])
+
+        # Remove directories that no longer exist
+        found = set(stat[0] for stat in stats)
+        low, high = DirtyList._bounds(top)
+        gone = [row for row in self._connection.execute(
+            'SELECT path FROM directories WHERE path = ? OR (path >= ? AND '
+            'path < ?)', (top.rstrip(os.path.sep), low, high))
+            if row[0] not in found]
+        self._connection.executemany('DELETE FROM directories WHERE '
+                                     'path = ?', gone)
+        self._connection.commit()
 
 
 class RsyncRegexes(object):
@@ -197,13 +931,15 @@ class RsyncRegexes(object):
         regexes = []
 
         # Change single entry to list format for ease of use
-        if type(patterns) is unicode or type(patterns) is str:
+        if isinstance(patterns, string_types):
             patterns = [patterns]
 
         # Generate patterns
         for pattern in patterns:
 
             pattern = pattern.encode('unicode-escape')
+            if not isinstance(pattern, str):  # Python 3 returns bytes
+                pattern = pattern.decode('ascii')
 
             # Anchor pattern to base if stars with path.sep
             # This regex only anchors the pattern to the beginning of the
@@ -218,7 +954,7 @@ class RsyncRegexes(object):
             # rsync-esque manner because the walk function will not descend
             # into excluded directories.
             # rsync: if no path.sep (less last char) or '**', match end of path
-            temp = re.sub(os.path.sep + '\$?$', '', pattern)
+            temp = re.sub(os.path.sep + r'\$?$', '', pattern)
             if '**' not in temp and os.path.sep not in temp:
                 pattern += '$'
 
@@ -315,7 +1051,7 @@ class RsyncRegexes(object):
 
             # If pattern ends in path.sep, only match directories
             # rsync: patterns ending in path.sep only match non-link dirs
-            temp = re.sub('\$?$', '', regex.pattern)
+            temp = re.sub(r'\$?$', '', regex.pattern)
             if temp[-1] == os.path.sep and is_abs_dir is False:
                 continue
 
@@ -332,391 +1068,2051 @@ class RsyncRegexes(object):
         elif self.mode == 'include':
             return True  # Exclude path
 
-    def include(self, path, base=None):
-        """Test if path is included as per instance regexes
+    def include(self, path, base=None):
+        """Test if path is included as per instance regexes
+
+        Args:
+            path (str): path to match against self.regexes
+
+            base (str): if provided, removes base from beginning of path
+                        so regexes can't match base
+
+        Returns:
+            bool: True if path is to be included, else False
+                  This function will return the boolean appropriate for the
+                  instance's mode (self.mode).
+
+        Examples:
+            >>> r = RsyncRegexes('exclude', 'hello?world.py')
+            >>> r.include('hello_world.py')
+            False
+            >>> r.include('bye_world.py')
+            True
+            >>> r = RsyncRegexes('include', 'hello?world.py')
+            >>> r.include('hello_world.py')
+            True
+            >>> r.include('bye_world.py')
+            False
+        """
+
+        return not self.exclude(path, base=base)
+
+    def walk(self, path, hidden=False, base=None, **kwargs):
+        """Mimic os.walk but excludes dirs and files as per instance regexes
+
+        Args:
+            path (str): top directory to walk down from
+
+            hidden (bool): skip hidden files and directories if False, include
+                           them if True
+
+            base (str): directory patterns are relative to, defaults to path
+
+            **kwargs: arbitrary keyword arguments to pass to os.walk
+
+        Yields:
+            tuple: os.walk tuple mimic. Namely, first item is a str of
+                   root directory for current iteration, second item is a list
+                   of directories in root, and third item is a list of files
+                   is root. Only directory and file names not to be excluded
+                   are yielded. Un-yielded directories will not be further
+                   transversed.
+
+        Example:
+            >>> r = RsyncRegexes('include', 'hello?world.py')
+            >>> for root,  dirs, files in r.walk('/path/to/test/dir/'):
+            ...     print(root, dirs, files)
+            ('/', ['dir1', 'dir2'], ['file1', 'file2'])
+        """
+
+        # Ensure path ends with path.sep so base can be passed to exclude
+        if path[-1] != os.path.sep:
+            path += os.path.sep
+        if base is None:
+            base = path
+        elif base[-1] != os.path.sep:
+            base += os.path.sep
+
+        for root, dir_names, file_names in os.walk(path, topdown=True,
+                                                   **kwargs):
+
+            # Remove excluded directories
+            remove_dir = []
+            for _dir in dir_names:
+                m_dir = os.path.join(root, _dir) + os.path.sep
+                if self.exclude(m_dir, base=base) is True:
+                    remove_dir.append(_dir)
+                elif hidden is False and _dir[0] == '.':
+                    remove_dir.append(_dir)
+            dir_names[:] = list(set(dir_names) - set(remove_dir))
+
+            # Remove excluded files
+            remove_files = []
+            for _file in file_names:
+                m_file = os.path.join(root, _file)
+                if self.exclude(m_file, base=base) is True:
+                    remove_files.append(_file)
+                elif hidden is False and _file[0] == '.':
+                    remove_files.append(_file)
+            file_names[:] = list(set(file_names) - set(remove_files))
+
+            yield root, dir_names, file_names
+
+
+class ConcurrencyController(object):
+    """Hill-climb the number of busy daemons toward the best throughput
+
+    Throughput is observed over windows of a few seconds. While it keeps
+    improving concurrency is doubled (slow start), then stepped by one.
+    A step that lowers throughput is undone and later probes go the other
+    way; a step that leaves it unchanged is undone as well since extra
+    daemons that don't help only add latency. Once settled, a neighbouring
+    concurrency is probed every few windows so the controller follows the
+    workload as it moves between storage with different characteristics.
+
+    Attributes:
+        PROBE_WINDOWS (int): stable windows between probes once settled
+
+        TOLERANCE (float): fractional change in throughput considered
+                           noise rather than a real difference
+
+        WINDOW (float): minimum seconds of work per observation
+
+        minimum (int): fewest daemons to keep busy
+
+        maximum (int): most daemons to keep busy
+
+        concurrency (int): number of daemons to keep busy
+
+        best (int): concurrency with the best recent throughput
+
+        best_throughput (float): throughput observed at best
+
+        _direction (int): 1 to probe more daemons next, -1 for fewer
+
+        _slow_start (bool): True while doubling concurrency
+
+        _stable (int): windows observed since concurrency last changed
+
+    Examples:
+        >>> c = ConcurrencyController(1, 32, 2)
+        >>> [c.observe(t) for t in (10.0, 19.0, 37.0, 38.0, 38.0)]
+        [4, 8, 16, 8, 8]
+        >>> c.best
+        8
+    """
+
+    PROBE_WINDOWS = 6
+    TOLERANCE = 0.1
+    WINDOW = 5.0
+
+    def __init__(self, minimum, maximum, start):
+        """Initialize controller
+
+        Args:
+            minimum (int): fewest daemons to keep busy
+
+            maximum (int): most daemons to keep busy
+
+            start (int): number of daemons to keep busy initially
+        """
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.concurrency = max(minimum, min(maximum, start))
+        self.best = self.concurrency
+        self.best_throughput = 0.0
+        self._direction = 1
+        self._slow_start = True
+        self._stable = 0
+
+    def observe(self, throughput):
+        """Record throughput at current concurrency and pick the next one
+
+        Args:
+            throughput (float): work completed per second during window
+
+        Returns:
+            int: number of daemons to keep busy during next window
+        """
+
+        current = self.concurrency
+
+        if throughput > self.best_throughput * (1 + self.TOLERANCE):
+            # Keep climbing in the same direction
+            self.best = current
+            self.best_throughput = throughput
+            if self._slow_start is True:
+                current *= 2
+            else:
+                current += self._direction
+        elif current != self.best:
+            # Probe didn't help, return to best and try the other way next
+            self._slow_start = False
+            if throughput < self.best_throughput * (1 - self.TOLERANCE) \
+                    or current > self.best:
+                self._direction = 1 if current < self.best else -1
+                current = self.best
+            else:
+                self.best = current  # As fast with fewer daemons
+                self.best_throughput = throughput
+        else:
+            # Settled, follow drift in throughput and probe periodically
+            self._slow_start = False
+            self.best_throughput = throughput
+            self._stable += 1
+            if self._stable >= self.PROBE_WINDOWS:
+                current += self._direction
+
+        current = max(self.minimum, min(self.maximum, current))
+        if current == self.concurrency:
+            self._direction = -self._direction \
+                if current in (self.minimum, self.maximum) \
+                else self._direction
+        else:
+            self._stable = 0
+        self.concurrency = current
+        return current
+
+
+class DeviceScheduler(object):
+    """Dispatch files to supervised daemons without overloading any device
+
+    Pending files are grouped by the device (st_dev) they reside on and
+    handed to idle daemons one at a time, round-robin across devices. A
+    device never has more files being read at once than its limit, so
+    spinning disks are not thrashed by many concurrent readers while
+    faster devices and network mounts can still be read by many daemons.
+    Each daemon has its own inbox and reports back through its own pipe
+    when it finishes a file, which is what frees a slot on that file's
+    device. Daemons send their result for each file along with this
+    report and results are passed to a callback in the main process.
+
+    Daemons are supervised: one that dies, or that is still working on a
+    file after that file's deadline (e.g. a read stuck on a stale NFS
+    handle), is terminated and replaced by a new daemon. The file it was
+    working on is requeued up to RETRIES times before being given up on,
+    in which case no result is reported for it.
+
+    Pending files are bounded: put() waits for daemons to finish files
+    while more than BACKLOG files per daemon kept busy are pending, so a
+    walk cannot queue a whole tree faster than it is read.
+
+    Given a ConcurrencyController, the number of daemons kept busy is
+    adjusted every few seconds based on the throughput of files, measured
+    by the weight of each item, and more daemons are started as needed.
+
+    Attributes:
+        BACKLOG (int): files pending per daemon kept busy before put()
+                       waits for daemons to catch up
+
+        RETRIES (int): times a file is requeued after its daemon dies or
+                       hangs before it is given up on
+
+        SUPERVISE_INTERVAL (float): seconds between checks of daemons
+
+        limits (dict): maps st_dev to maximum number of concurrent readers
+                       on that device
+
+        default_limit (int): maximum number of concurrent readers on
+                             devices not present in limits
+
+        callback (function): called with each result daemons report
+
+        deadline (function): called with an item to get seconds a daemon
+                             may spend on it, None to never time out
+
+        label (function): called with an item to describe it in logs
+
+        logger (Logger): logging class to log messages
+
+        controller (ConcurrencyController): adjusts concurrency, None to
+                                            keep all daemons busy
+
+        weight (function): called with an item to get its size in bytes
+
+        concurrency (int): maximum number of daemons to keep busy
+
+        _pending (OrderedDict): maps st_dev to deque of (item, attempt)
+                                tuples to process
+
+        _active (dict): maps st_dev to number of files being read from it
+
+        _busy (dict): maps daemon number to (st_dev, item, attempt,
+                      deadline, start time) of file it is reading
+
+        _workers (OrderedDict): maps daemon number to tuple of its Process
+                                class, inbox Queue and the Connection it
+                                sends a tuple of its number and result
+                                through when finished with a file, numbers
+                                of replaced daemons are never reused
+
+        _checked (float): time daemons were last supervised
+
+        _waiting (bool): True while put() waits for pending files to drop
+                         below the backlog, files put meanwhile, e.g. by
+                         callback, do not wait
+
+        _window (list): start time, bytes and files completed, and seconds
+                        spent on those files in current controller window
+    """
+
+    BACKLOG = 16
+    RETRIES = 1
+    SUPERVISE_INTERVAL = 1.0
+
+    def __init__(self, target, args, threads, default_limit, limits=None,
+                 callback=None, deadline=None, label=str, logger=None,
+                 controller=None, weight=None):
+        """Start daemons running target
+
+        Args:
+            target (function): daemon function, called as
+                               target(inbox, done, number, *args)
+
+            args (tuple): additional arguments to pass to target
+
+            threads (int): number of daemons to start, ignored if
+                           controller is given
+
+            default_limit (int): max concurrent readers per device
+
+            limits (dict): maps st_dev to max concurrent readers for
+                           specific devices
+
+            callback (function): called with each result daemons report
+
+            deadline (function): called with an item to get seconds a
+                                 daemon may spend on it before it is
+                                 considered hung, None to never time out
+
+            label (function): called with an item to describe it in logs
+
+            logger (Logger): logging class to log messages
+
+            controller (ConcurrencyController): adjusts number of daemons
+                                                kept busy during run
+
+            weight (function): called with an item to get its size in
+                               bytes for measuring throughput
+        """
+
+        self.limits = limits if limits is not None else {}
+        self.default_limit = default_limit
+        self.callback = callback
+        self.deadline = deadline
+        self.label = label
+        self.logger = logger if logger is not None \
+            else logging.getLogger('integrity_audit')
+        self._target = target
+        self._args = tuple(args)
+        self._pending = OrderedDict()
+        self._active = {}
+        self._busy = {}
+        self._workers = OrderedDict()
+        self.controller = controller
+        self.weight = weight if weight is not None else lambda item: 1
+        self._number = 0
+        self._checked = time()
+        self._waiting = False
+        self._window = [time(), 0, 0, 0.0]
+
+        if controller is not None:
+            threads = controller.concurrency
+        self.concurrency = 0
+        self.resize(threads)
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _dispatch(self):
+        """Collect finished daemons and hand pending files to idle ones"""
+
+        self._collect()
+
+        if time() - self._checked >= self.SUPERVISE_INTERVAL:
+            self._supervise()
+
+        if self.controller is not None \
+                and time() - self._window[0] >= self.controller.WINDOW:
+            self._adapt()
+
+        idle = [i for i in self._workers if i not in self._busy]
+        idle = idle[:max(0, self.concurrency - len(self._busy))]
+
+        # Give each device with a free slot one file per round
+        while idle and self._pending:
+            assigned = False
+            for device in list(self._pending.keys()):
+                if not idle:
+                    break
+                if self._active.get(device, 0) >= self.limit(device):
+                    continue
+                files = self._pending[device]
+                item, attempt = files.popleft()
+                worker = idle.pop()
+                deadline = None
+                if self.deadline is not None:
+                    deadline = time() + self.deadline(item)
+                self._busy[worker] = (device, item, attempt, deadline,
+                                      time())
+                self._active[device] = self._active.get(device, 0) + 1
+                self._workers[worker][1].put(item)
+                assigned = True
+                if not files:
+                    del self._pending[device]
+            if assigned is False:
+                break
+
+    def _adapt(self):
+        """Have controller pick concurrency from last window's throughput"""
+
+        start, size, files, seconds = self._window
+        self._window = [time(), 0, 0, 0.0]
+
+        # Throughput only reflects concurrency if daemons had a backlog
+        if files == 0 or not self._pending:
+            return
+
+        throughput = size / (self._window[0] - start)
+        concurrency = self.controller.observe(throughput)
+        self.logger.debug('{0} daemons read {1:.2e} MB/s with {2:.2e} '
+                          'seconds latency per file'
+                          .format(str(self.concurrency),
+                                  throughput / 1048576.0, seconds / files))
+        if concurrency != self.concurrency:
+            self.logger.info('Adjusting daemons kept busy from {0} to {1}'
+                             .format(str(self.concurrency),
+                                     str(concurrency)))
+            self.resize(concurrency)
+
+    def _collect(self, timeout=0):
+        """Release daemons that have reported, waiting up to timeout"""
+
+        pipes = dict((workers[2], worker)
+                     for worker, workers in self._workers.items())
+        while pipes:
+            ready = select.select(list(pipes.keys()), [], [], timeout)[0]
+            if not ready:
+                break
+            timeout = 0
+            for pipe in ready:
+                try:
+                    self._release(pipe.recv())
+                except EOFError:  # Daemon died, supervise it next dispatch
+                    del pipes[pipe]
+                    self._checked = 0
+
+    def _release(self, message):
+        """Mark daemon as idle, free a slot on its device, and use result"""
+
+        worker, result = message
+
+        # Daemon was replaced after finishing but before being collected
+        if worker not in self._busy:
+            return
+
+        device, item, attempt, deadline, started = self._busy.pop(worker)
+        self._active[device] -= 1
+        self._window[1] += self.weight(item)
+        self._window[2] += 1
+        self._window[3] += time() - started
+        if self.callback is not None:
+            self.callback(result)
+
+    def _start(self):
+        """Start a new daemon with its own inbox"""
+
+        inbox = processes.Queue()
+        receiver, sender = processes.Pipe(duplex=False)
+        process = processes.Process(target=self._target,
+                                    args=(inbox, sender, self._number)
+                                    + self._args)
+        process.daemon = True  # Abandoned hung daemons must not block exit
+        process.start()
+        sender.close()
+        self._workers[self._number] = (process, inbox, receiver)
+        self._number += 1
+
+    def _supervise(self):
+        """Replace dead and hung daemons and requeue their files"""
+
+        self._checked = time()
+
+        for worker in list(self._workers.keys()):
+
+            process = self._workers[worker][0]
+            busy = self._busy.get(worker)
+
+            if process.is_alive() is True:
+                if busy is None or busy[3] is None \
+                        or self._checked < busy[3]:
+                    continue
+                self.logger.error('Daemon exceeded deadline reading: {0}'
+                                  .format(self.label(busy[1])))
+                process.terminate()
+            else:
+                self.logger.error('Daemon exited unexpectedly with code {0}'
+                                  .format(str(process.exitcode)))
+
+            # Terminated daemons stuck in uninterruptible I/O are abandoned
+            # rather than joined so the rest of the audit can proceed, and
+            # only their own pipe is lost if they die mid-report
+            self._workers.pop(worker)[2].close()
+            abandon_process(process)
+
+            if busy is not None:
+                device, item, attempt = self._busy.pop(worker)[:3]
+                self._active[device] -= 1
+                if attempt < self.RETRIES:
+                    self.logger.warning('Requeued: {0}'
+                                        .format(self.label(item)))
+                    if device not in self._pending:
+                        self._pending[device] = deque()
+                    self._pending[device].append((item, attempt + 1))
+                else:
+                    self.logger.error('Giving up on: {0}'
+                                      .format(self.label(item)))
+
+            self._start()
+            self.logger.warning('Started replacement daemon')
+
+    def join(self):
+        """Wait for all pending files to be processed and stop daemons"""
+
+        while self._pending or self._busy:
+            self._dispatch()
+            if self._busy:
+                self._collect(self.SUPERVISE_INTERVAL)
+
+        for process, inbox, receiver in self._workers.values():
+            inbox.put('DONE')
+
+        for process, inbox, receiver in self._workers.values():
+            process.join()
+            receiver.close()
+
+    def limit(self, device):
+        """Return maximum number of concurrent readers for device"""
+
+        return self.limits.get(device, self.default_limit)
+
+    def resize(self, concurrency):
+        """Keep up to concurrency daemons busy, starting more if needed"""
+
+        self.concurrency = concurrency
+        while len(self._workers) < concurrency:
+            self._start()
+
+    def put(self, item, device):
+        """Queue item read from device and dispatch work to idle daemons
+
+        Args:
+            item: object to pass to a daemon
+
+            device (int): st_dev of the device item is read from
+        """
+
+        if device not in self._pending:
+            self._pending[device] = deque()
+        self._pending[device].append((item, 0))
+        self._dispatch()
+
+        if self._waiting is True:
+            return
+        self._waiting = True
+        try:
+            while sum(len(files) for files in self._pending.values()) > \
+                    self.BACKLOG * max(1, self.concurrency):
+                self._collect(self.SUPERVISE_INTERVAL)
+                self._dispatch()
+        finally:
+            self._waiting = False
+
+
+class ThreadCheck(argparse.Action):
+    """Argparse Action that ensures number of threads requested is valid
+
+    Attributes:
+        option_strings (list): list of str giving command line flags that
+                               call this action
+
+        dest (str): Namespace reference to value
+
+        nargs (bool): True if multiple arguments specified
+
+        **kwargs (various): optional arguments to pass to super call
+    """
+
+    def __init__(self, option_strings, dest, nargs=None, **kwargs):
+        """Initialize class and spawn self as Base Class w/o nargs"""
+
+        # Only accept a single value to analyze
+        if nargs is not None:
+            raise ValueError('nargs not allowed for ThreadCheck')
+
+        # Call self again but without nargs
+        super(ThreadCheck, self).__init__(option_strings, dest, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        """Called by Argparse when user specifies multiple threads
+
+        Simply asserts that the number of threads requested is "auto" or
+        greater than 0. More threads than the computer has cores are allowed
+        as audits of network storage are bound by latency rather than CPU.
+
+        Args:
+            parser (ArgumentParser): parser used to generate values
+
+            namespace (Namespace): parse_args() generated namespace
+
+            values (str): actual value specified by user
+
+            option_string (str): argument flag used to call this function
+
+        Raises:
+            TypeError: if threads is not an integer or "auto"
+
+            ValueError: if threads is less than one
+        """
+
+        threads = values  # Renamed for readability
+
+        if threads == 'auto':
+            setattr(namespace, self.dest, threads)
+            return
+
+        try:
+            threads = int(threads)
+        except ValueError:
+            raise TypeError('{0} is not an integer or "auto"'
+                            .format(str(threads)))
+
+        try:
+            assert threads >= 1
+        except AssertionError:
+            raise ValueError('Must use at least one thread')
+
+        setattr(namespace, self.dest, threads)
+
+
+def abandon_process(process):
+    """Stop multiprocessing from joining a process when Python exits
+
+    A daemon stuck in uninterruptible I/O ignores even SIGKILL until the
+    I/O returns, so joining it at exit, as multiprocessing does with all
+    children it started, would hang the audit after it has finished.
+
+    Args:
+        process (Process): terminated process to forget
+    """
+
+    children = getattr(multiprocessing.process, '_children', None)
+    if children is None:  # Python 2 tracks children on the main process
+        children = multiprocessing.current_process()._children
+    children.discard(process)
+
+
+def analyze_checksums(queue, done, number, hasher, logger, read_only):
+    """Compare checksums of directories from queue to their checksum files
+
+    Args:
+         queue (Queue): multiprocessing Queue class containing tuples of
+                        directory path, list of (name, checksum, mtime)
+                        tuples for files in directory and, with --fast,
+                        (fast digest name, dict of fast digests calculated
+                        by file name, mtime to restore checksum file to or
+                        None)
+
+         done (Connection): multiprocessing Pipe to send tuples of number
+                            and None through after each directory
+
+         number (int): number identifying this daemon to DeviceScheduler
+
+         hasher (str): hashing algorithm used to analyze files
+
+         logger (Logger): logging class to log messages
+
+         read_only (bool): if True, does not write checksum file
+    """
+
+    # Loop until queue contains kill message
+    while True:
+
+        d = queue.get()
+
+        # Break on kill message
+        if d == 'DONE':
+            logger.debug('Daemon received kill signal: exiting')
+            break
+
+        dir_path, files = d[:2]
+
+        logger.debug('Daemon received directory: {0}'.format(dir_path))
+
+        try:
+            checksums = analyze_directory(dir_path, files, hasher, logger,
+                                          read_only)
+            if len(d) > 2 and checksums is not None and read_only is False:
+                fast, digests, stamp = d[2]
+                write_fast_sums(dir_path, fast, digests, checksums, logger)
+
+                # Checksums are only due for confirmation by the mtime of
+                # the checksum file if not all were calculated this run
+                if stamp is not None:
+                    try:
+                        os.utime(os.path.join(dir_path, hasher + 'sums'),
+                                 (stamp, stamp))
+                    except OSError:
+                        logger.error('Cannot restore mtime of checksum '
+                                     'file: {0}'.format(dir_path))
+        finally:
+            done.send((number, None))
+
+
+def analyze_directory(dir_path, files, hasher, logger, read_only):
+    """Probes directory for checksum file and compares computed file checksums
+
+    Args:
+         dir_path (str): path of directory to analyze
+
+         files (list): (name, checksum, mtime) tuples for files in directory
+
+         hasher (str): hashing algorithm used to analyze files
+
+         logger (Logger): logging class to log messages
+
+         read_only (bool): if True, does not write checksum file
+
+    Returns:
+        dict: maps file name to checksum stored for it, None if directory
+              was skipped
+    """
+
+    logger.debug('Comparing checksums for files in directory: {0}'
+                 .format(dir_path))
+
+    # Ensure directory still exists
+    try:
+        assert os.path.isdir(dir_path) is True
+    except AssertionError:
+        logger.warning('Directory no longer exists: {0}'
+                       .format(dir_path))
+        logger.warning('Skipping directory: {0}'.format(dir_path))
+        logger.warning('Files checksums in directory cannot be '
+                       'analyzed: {0}'.format(dir_path))
+        return None
+    else:
+        logger.debug('Directory exists: {0}'.format(dir_path))
+
+    logger.debug('Looking for checksum file in directory: {0}'
+                 .format(dir_path))
+
+    checksum_file_path = os.path.join(dir_path, hasher + 'sums')
+    checksums = {}
+
+    if os.path.isfile(checksum_file_path) is True:
+
+        logger.debug('Found checksum file: {0}'
+                     .format(checksum_file_path))
+
+        # Read checksums file into memory
+        checksums = read_checksums(checksum_file_path)
+
+        # Diff stored checksums against those calculated this run
+        checksums, changed, added, unlisted, failed = \
+            reconcile_checksums(checksums, files)
+
+        logger.debug('{0} file checksums match stored checksums: {1}'
+                     .format(str(len(files) - len(changed) - len(added) -
+                                 len(failed)), dir_path))
+
+        # Ensure all files listed in checksum file exist, only files
+        # the walk skipped or didn't find need to be checked
+        for key in unlisted:
+            if not os.path.lexists(os.path.join(dir_path, key)):
+                logger.warning('Checksum file {0} contains checksum '
+                               'for non-existent file: {1}'
+                               .format(checksum_file_path, key))
+
+        for file_name, mtime in changed:
+            file_path = os.path.join(dir_path, file_name)
+            logger.warning('File checksum differs from stored '
+                           'checksum: {0}'.format(file_path))
+            local_time = strftime('%Y-%m-%d %H:%M:%S',
+                                  localtime(mtime))
+            logger.warning('File {0} last modified: {1}'
+                           .format(file_path, local_time))
+            logger.warning('Formatted new checksum for '
+                           'checksum file: {0}'.format(file_path))
+
+        for file_name in added:
+            file_path = os.path.join(dir_path, file_name)
+            logger.info('File checksum not stored in checksum '
+                        'file: {0}'.format(file_path))
+            logger.info('File checksum formatted for checksum '
+                        'file: {0}'.format(file_path))
+
+        # Skip files whose checksums could not be calculated
+        for file_name in failed:
+            file_path = os.path.join(dir_path, file_name)
+            if os.path.isfile(file_path) is False:
+                logger.warning('File no longer exists: {0}'
+                               .format(file_path))
+                logger.warning('Skipping file checksum comparision: '
+                               '{0}'.format(file_path))
+                if checksums.pop(file_name, None) is not None:
+                    logger.warning('Removed file checksum from '
+                                   'memory: {0}'.format(file_path))
+            else:
+                logger.warning('Skipping file checksum comparision: '
+                               '{0}'.format(file_path))
+
+    else:
+
+        logger.debug('Could not find checksum file in directory: {0}'
+                     .format(dir_path))
+
+        if read_only is True:
+            logger.warning('Read-Only Mode active')
+            logger.warning('Skipping directory: {0}'.format(dir_path))
+            return None
+
+        logger.info('Formatting file checksums for directory: {0}'
+                    .format(dir_path))
+
+        checksums, changed, added, unlisted, failed = \
+            reconcile_checksums({}, files)
+
+        for file_name in added:
+            logger.info('File checksum formatted: {0}'
+                        .format(os.path.join(dir_path, file_name)))
+
+        for file_name in failed:
+            logger.warning('Skipping file checksum formatting: {0}'
+                           .format(os.path.join(dir_path, file_name)))
+
+    # Write checksum file
+    if read_only is False:
+        try:
+            replace_listing(checksum_file_path,
+                            [checksums[key] + '  ' + key + os.linesep
+                             for key in sorted(checksums)])
+        except (IOError, OSError):
+            logger.error('Cannot write checksum file: {0}'
+                         .format(checksum_file_path))
+
+        # Drop chunk manifest entries of files no longer checksummed
+        chunk_file_path = os.path.join(dir_path, hasher + 'chunks')
+        try:
+            if os.path.isfile(chunk_file_path) is True and \
+                    set(read_chunks(chunk_file_path)) - set(checksums):
+                update_chunks(chunk_file_path, keep=set(checksums))
+                logger.debug('Pruned chunk manifest: {0}'
+                             .format(chunk_file_path))
+        except (IOError, OSError, ValueError):
+            logger.error('Cannot update chunk manifest: {0}'
+                         .format(chunk_file_path))
+    else:
+        logger.debug('Read-Only Mode active')
+        logger.debug('Skipping writing checksum file: {0}'
+                     .format(dir_path))
+
+    return checksums
+
+
+def bgzf_block_size(data, offset=0):
+    """Return size of the BGZF block whose header starts at offset
+
+    Args:
+        data (bytes): data containing block header
+
+        offset (int): offset of block header in data
+
+    Returns:
+        int: size of block in bytes, 0 if data ends before the header
+             does, None if header is not that of a BGZF block
+
+    Examples:
+        >>> bgzf_block_size(BGZF_EOF)
+        28
+        >>> bgzf_block_size(BGZF_EOF[:14])
+        0
+        >>> bgzf_block_size(b'\\x1f\\x8b\\x08\\x00' + b'\\x00' * 14) is None
+        True
+    """
+
+    if len(data) - offset < 12:
+        return 0
+    id1, id2, method, flags, extra_length = \
+        struct.unpack_from('<BBBB6xH', data, offset)
+    if (id1, id2, method) != (31, 139, 8) or not flags & 4:
+        return None
+
+    # Find the BC subfield holding the block size less one
+    position = offset + 12
+    end = position + extra_length
+    if len(data) < end:
+        return 0
+    while position + 4 <= end:
+        si1, si2, length = struct.unpack_from('<BBH', data, position)
+        if (si1, si2, length) == (66, 67, 2):
+            return struct.unpack_from('<H', data, position + 4)[0] + 1
+        position += 4 + length
+    return None
+
+
+def calculate_checksum(path, size, hasher, hash_from, logger, sample=0,
+                       validator=None, fast=None):
+    """Calculate hexadecimal checksum of file using given hasher
+
+    Args:
+         path (str): path of file to calculate checksum for
+
+         size (int): size of file in bytes
+
+         hasher (function): function from hashlib to compute file checksums
+
+         hash_from (str): 'python' if hasher is a hashlib function and 'linux'
+                          if hasher is a *nix hash command
+
+         logger (Logger): logging class to log messages
+
+         sample (int): if greater than zero, only hash the first and last
+                       sample bytes of files larger than twice sample,
+                       requires hash_from to be 'python'
+
+         validator (ArchiveValidator): if given, also fed the file's data
+                                       while hashing, requires hash_from
+                                       to be 'python' and sample to be 0
+
+         fast (object): if given, hash object of a fast digest also
+                        updated with the file's data, with the same
+                        requirements as validator
+
+    Returns:
+        str: hexadecimal checksum of file, None if it cannot be calculated
+    """
+
+    try:
+        assert os.path.isfile(path) is True
+    except AssertionError:
+        logger.warning('File no longer exists: {0}'.format(path))
+        logger.warning('Skipping checksum calculation: {0}'.format(path))
+        return None
+
+    try:
+        assert os.access(path, os.R_OK) is True
+    except AssertionError:
+        logger.warning('Cannot read file: {0}'.format(path))
+        logger.warning('Skipping checksum calculation: {0}'.format(path))
+        return None
+
+    logger.debug('Calculating checksum: {0}'.format(path))
+
+    checksum = None
+    try:
+        if hash_from == 'linux':
+            # Commands prefix the checksum with a backslash if path is escaped
+            # and the line ends with the path, which may not be ASCII
+            checksum = str(check_output([hasher, path]).split(b' ')[0]
+                           .lstrip(b'\\').decode('ascii'))
+        elif hash_from == 'python':
+            # Process file contents in memory efficient manner
+            with open(path, 'rb') as file_handle:
+                hexsum = hasher()
+                if 0 < sample and 2 * sample < size:
+                    hexsum.update(file_handle.read(sample))
+                    file_handle.seek(-sample, os.SEEK_END)
+                    hexsum.update(file_handle.read(sample))
+                elif validator is None and fast is None and \
+                        hasattr(hashlib, 'file_digest'):
+                    hexsum = hashlib.file_digest(file_handle, hasher)
+                else:
+                    while True:
+                        data = file_handle.read(READ_SIZE)
+                        if not data:
+                            break
+                        hexsum.update(data)
+                        if validator is not None:
+                            validator.update(data)
+                        if fast is not None:
+                            fast.update(data)
+            checksum = hexsum.hexdigest()
+    except (KeyboardInterrupt, SystemExit):  # Exit if asked
+        raise
+    except Exception as error:  # Skip calculation on all other errors
+        logger.error('Suppressed error: {0}'.format(error))
+        checksum = None
+        logger.error('Reset checksum to None: {0}'.format(path))
+        logger.error('Skipping checksum calculation: {0}'.format(path))
+    else:
+        logger.debug('Calculated checksum: {0}'.format(path))
+
+    return checksum
+
+
+def checksum_calculator(queue, done, number, hasher, hash_from, logger,
+                        sample=0, chunk_size=0, algorithm=None,
+                        read_only=False, compressed=False, fast=None):
+    """Calculate checksums of files from queue using given hasher
+
+    Args:
+         queue (Queue): multiprocessing Queue class containing tuples of
+                        file index, path, and size to process, or of file
+                        index, path, size, first chunk and number of chunks
+                        to verify against the file's chunk manifest, or of
+                        file index, path, size and stored (fast digest,
+                        checksum) of the file or None to hash with fast
+
+         done (Connection): multiprocessing Pipe to send tuples of number
+                            and (file index, checksum) through after each
+                            file, or (file index, first chunk, differing
+                            chunks) after verifying chunks, differing
+                            chunks is None if they could not be read, or
+                            (file index, checksum, fast digest, confirmed)
+                            after fast digest items where confirmed is True
+                            if the checksum was calculated
+
+         number (int): number identifying this daemon to DeviceScheduler
+
+         hasher (function): function from hashlib to compute file checksums
+
+         hash_from (str): 'python' if hasher is a hashlib function and 'linux'
+                          if hasher is a *nix hash command
+
+         logger (Logger): logging class to log messages
+
+         sample (int): bytes to hash at each end of files, 0 hashes all
+
+         chunk_size (int): if greater than zero, files larger than
+                           chunk_size bytes are also hashed in chunks of
+                           this size and their chunk manifests updated
+
+         algorithm (str): name of hashlib algorithm to hash chunks with
+
+         read_only (bool): if True, does not update chunk manifests
+
+         compressed (bool): if True, also validate gzip and BGZF files
+                            while hashing them with hashlib algorithm
+
+         fast (str): name of fast digest in FAST_ALGORITHMS to calculate
+                     for fast digest items, whose checksum is only
+                     calculated, with hashlib algorithm, if the fast
+                     digest differs from the stored one
+    """
+
+    cached = [None, None, {}]  # Path, mtime and entries of chunk manifest
+    pool = []  # Threads decompressing BGZF blocks, started when needed
+
+    def stored_chunks(path):
+        """Return entry of file in chunk manifest of its directory"""
+
+        chunk_file_path = os.path.join(os.path.dirname(path),
+                                       algorithm + 'chunks')
+        try:
+            mtime = os.path.getmtime(chunk_file_path)
+            if cached[:2] != [chunk_file_path, mtime]:
+                cached[:] = [chunk_file_path, mtime,
+                             read_chunks(chunk_file_path)]
+        except (IOError, OSError, ValueError):
+            return None
+        return cached[2].get(os.path.basename(path))
+
+    def new_validator(path):
+        """Return ArchiveValidator for path if it is to be validated"""
+
+        if compressed is False or not path.endswith(COMPRESSED_EXTENSIONS):
+            return None
+        if not pool:
+            pool.append(ThreadPool(INFLATE_THREADS))
+        return ArchiveValidator(pool[0])
+
+    def check_archive(validator, path):
+        """Log whether data validator was fed was a valid archive"""
+
+        if validator is None:
+            return
+        error = validator.finish()
+        if error is not None:
+            logger.error('Compressed file is invalid, {0}: {1}'
+                         .format(error, path))
+        else:
+            logger.debug('Compressed file is valid: {0}'.format(path))
+
+    # Loop until queue contains kill message
+    while True:
+
+        f = queue.get()
+
+        # Break on kill message
+        if f == 'DONE':
+            logger.debug('Daemon received kill signal: exiting')
+            break
+
+        # Verify a range of chunks of a file against its chunk manifest
+        if len(f) == 5:
+            index, path, size, first, count = f
+            logger.debug('Daemon received chunks {0} to {1}: {2}'
+                         .format(str(first), str(first + count - 1), path))
+            bad = None
+            try:
+                stored = stored_chunks(path)
+                if stored is not None and stored[0] == size:
+                    chunks = hash_chunks(path, algorithm, stored[1], first,
+                                         count)[1]
+                    bad = [first + n for n, digest in
+                           enumerate(stored[3][first:first + count])
+                           if n >= len(chunks) or chunks[n] != digest]
+            except (IOError, OSError) as error:
+                logger.error('Suppressed error: {0}'.format(error))
+                logger.error('Skipping chunk verification: {0}'
+                             .format(path))
+            finally:
+                done.send((number, (index, first, bad)))
+            continue
+
+        # Fast digests stand in for checksums until they change
+        if len(f) == 4:
+            index, path, size, stored = f
+            logger.debug('Daemon received file for fast digest: {0}'
+                         .format(path))
+            checksum = digest = None
+            confirmed = False
+            try:
+                if stored is not None:
+                    validator = new_validator(path)
+                    digest = calculate_checksum(path, size,
+                                                FAST_ALGORITHMS[fast],
+                                                'python', logger,
+                                                validator=validator)
+                    if digest is not None and digest == stored[0]:
+                        checksum = stored[1]
+                        check_archive(validator, path)
+                    elif digest is not None:
+                        logger.debug('Fast digest changed, confirming '
+                                     'checksum: {0}'.format(path))
+                if stored is None or (digest is not None and
+                                      checksum is None):
+                    validator = new_validator(path)
+                    fast_hash = FAST_ALGORITHMS[fast]()
+                    checksum = calculate_checksum(
+                        path, size, getattr(hashlib, algorithm), 'python',
+                        logger, validator=validator, fast=fast_hash)
+                    digest = fast_hash.hexdigest() \
+                        if checksum is not None else None
+                    confirmed = True
+                    if checksum is not None:
+                        check_archive(validator, path)
+            finally:
+                done.send((number, (index, checksum, digest, confirmed)))
+            continue
+
+        index, path, size = f
+
+        logger.debug('Daemon received file: {0}'.format(path))
+
+        # Decompression shares the read, so hash with hashlib
+        validator = new_validator(path)
+
+        checksum = None
+        try:
+            if 0 < chunk_size < size:
+                checksum = chunk_checksum(path, algorithm, chunk_size,
+                                          stored_chunks(path), logger,
+                                          read_only, validator=validator)
+            elif validator is not None:
+                checksum = calculate_checksum(path, size,
+                                              getattr(hashlib, algorithm),
+                                              'python', logger,
+                                              validator=validator)
+            else:
+                checksum = calculate_checksum(path, size, hasher, hash_from,
+                                              logger, sample=sample)
+            if checksum is not None:
+                check_archive(validator, path)
+        finally:
+            done.send((number, (index, checksum)))
+
+    if pool:
+        pool[0].close()
+
+
+def chunk_checksum(path, algorithm, chunk_size, stored, logger, read_only,
+                   validator=None):
+    """Calculate checksum and chunk digests of file in a single read
+
+    Chunk digests are compared to those stored in the chunk manifest of
+    the file's directory, so files that were only appended to can be told
+    apart from files damaged or modified in place, whose differing byte
+    ranges are reported. The chunk manifest is then updated.
+
+    Args:
+         path (str): path of file to calculate checksum for
+
+         algorithm (str): name of hashlib algorithm to hash with
+
+         chunk_size (int): size of chunks in bytes
+
+         stored (tuple): (size, chunk_size, checksum, digests) entry of
+                         file in chunk manifest, None if not present
+
+         logger (Logger): logging class to log messages
+
+         read_only (bool): if True, does not update chunk manifest
+
+         validator (ArchiveValidator): if given, also fed the file's data
+                                       while hashing
+
+    Returns:
+        str: hexadecimal checksum of file, None if it cannot be calculated
+    """
+
+    # Chunks of a different size cannot be compared
+    if stored is not None and stored[1] != chunk_size:
+        stored = None
+
+    logger.debug('Calculating checksum and chunk digests: {0}'.format(path))
+
+    try:
+        size = os.path.getsize(path)
+        checksum, chunks, partial = hash_chunks(
+            path, algorithm, chunk_size,
+            mark=stored[0] if stored is not None else 0, validator=validator)
+    except (IOError, OSError) as error:
+        logger.error('Suppressed error: {0}'.format(error))
+        logger.error('Skipping checksum calculation: {0}'.format(path))
+        return None
+
+    if stored is not None:
+        bad = compare_chunks(stored, size, chunks, partial)
+        if bad:
+            logger.warning('File differs from its chunk manifest entry in '
+                           'bytes {0}: {1}'
+                           .format(', '.join(['{0}-{1}'.format(start, stop)
+                                              for start, stop in
+                                              chunk_ranges(bad, chunk_size,
+                                                           stored[0])]),
+                                   path))
+        elif size > stored[0]:
+            logger.info('File was appended to, stored chunks still '
+                        'verify: {0}'.format(path))
+
+    if read_only is False and (stored is None or stored[0] != size or
+                               stored[2] != checksum):
+        chunk_file_path = os.path.join(os.path.dirname(path),
+                                       algorithm + 'chunks')
+        try:
+            update_chunks(chunk_file_path,
+                          {os.path.basename(path):
+                           (size, chunk_size, checksum, chunks)})
+        except IOError:
+            logger.error('Cannot write chunk manifest: {0}'
+                         .format(chunk_file_path))
+
+    return checksum
+
+
+def chunk_ranges(bad, chunk_size, size):
+    """Merge numbers of bad chunks into byte ranges
+
+    Args:
+        bad (list): sorted numbers of chunks that failed verification
+
+        chunk_size (int): size of chunks in bytes
+
+        size (int): size of file in bytes
+
+    Returns:
+        list: (start, stop) tuples of byte ranges, stop is exclusive
+
+    Examples:
+        >>> chunk_ranges([0, 1, 4, 5], 100, 550)
+        [(0, 200), (400, 550)]
+    """
+
+    ranges = []
+    for number in bad:
+        start = number * chunk_size
+        stop = min(start + chunk_size, size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], stop)
+        else:
+            ranges.append((start, stop))
+
+    return ranges
+
+
+def compare_chunks(stored, size, chunks, partial=None):
+    """Find chunks of a file that no longer match its chunk manifest entry
+
+    Args:
+        stored (tuple): (size, chunk_size, checksum, digests) entry of file
+                        in chunk manifest
+
+        size (int): current size of file in bytes
+
+        chunks (list): chunk digests of file calculated from its start
+
+        partial (str): digest of the bytes of the chunk containing the
+                       stored size up to the stored size, only needed if
+                       file has grown and stored size is not a multiple of
+                       chunk size
+
+    Returns:
+        list: numbers of chunks within the stored size that differ, those
+              past the current size of a shrunken file count as differing
+
+    Examples:
+        >>> compare_chunks((250, 100, 'x', ['a', 'b', 'c']), 250,
+        ...                ['a', 'B', 'c'])
+        [1]
+        >>> compare_chunks((250, 100, 'x', ['a', 'b', 'c']), 420,
+        ...                ['a', 'b', 'C', 'd', 'e'], partial='c')
+        []
+        >>> compare_chunks((250, 100, 'x', ['a', 'b', 'c']), 150, ['a', 'b'])
+        [1, 2]
+    """
+
+    stored_size, chunk_size, checksum, digests = stored
+    bad = []
+
+    for number, digest in enumerate(digests):
+        if number >= len(chunks) or (number == len(chunks) - 1 and
+                                     size < stored_size):
+            bad.append(number)  # Chunk is missing or was truncated
+        elif size > stored_size and number == len(digests) - 1 and \
+                stored_size % chunk_size != 0:
+            if partial != digest:
+                bad.append(number)  # File was appended to after this chunk
+        elif chunks[number] != digest:
+            bad.append(number)
+
+    return bad
+
+
+def device_limit(limit):
+    """Parse a --device_limit argument
+
+    Args:
+        limit (str): 'N' to limit every device to N concurrent readers or
+                     'PATH=N' to limit the device containing PATH
+
+    Returns:
+        tuple: (str or None, int) path, or None for all devices, and limit
+
+    Raises:
+        ArgumentTypeError: if limit is malformed or less than one
+
+    Examples:
+        >>> device_limit('2')
+        (None, 2)
+        >>> device_limit('/mnt/raid=1')
+        ('/mnt/raid', 1)
+    """
+
+    path, sep, number = limit.rpartition('=')
+    try:
+        number = int(number)
+        assert number >= 1
+    except (AssertionError, ValueError):
+        raise argparse.ArgumentTypeError('{0} is not a valid device limit'
+                                         .format(limit))
+
+    return (path if sep else None), number
+
+
+def directory_totals(records, links=(), unread=()):
+    """Total up files in each recorded directory and its subdirectories
+
+    Args:
+        records (FileRecords): files recorded by a walk, parents recorded
+                               before their subdirectories
+
+        links (iterable): indices of files that are hard links to inodes
+                          already recorded, whose bytes are not counted
+                          again, like du
+
+        unread (iterable): indices of files whose checksums were not
+                           calculated from their data this run
+
+    Returns:
+        list: (path, bytes, files, newest, read) tuple for each directory
+              where bytes (int) and files (int) total its subtree, newest
+              (float) is the latest mtime in it, 0 if it has no files, and
+              read (bool) is True if no file in it is unread
+
+    Examples:
+        >>> records = FileRecords(1)
+        >>> records.add_directory('/data')
+        0
+        >>> records.add_file('a', 10, 5.0, 1, 1)
+        0
+        >>> records.add_directory('/data/run')
+        1
+        >>> records.add_file('b', 20, 9.0, 1, 2)
+        1
+        >>> records.add_file('c', 20, 7.0, 1, 2)
+        2
+        >>> directory_totals(records, [2])
+        [('/data', 30, 3, 9.0, True), ('/data/run', 20, 2, 9.0, True)]
+        >>> directory_totals(records, [2], [1])
+        [('/data', 30, 3, 9.0, False), ('/data/run', 20, 2, 9.0, False)]
+    """
+
+    linked = set(links)
+    skipped = bytearray(len(records))  # 1 for each unread file
+    for index in unread:
+        skipped[index] = 1
+    totals = []
+    parents = {}
+    for directory in range(records.directories()):
+        path = records.directory(directory)
+        size = files = 0
+        newest = 0.0
+        read = True
+        for index in records.files(directory):
+            if index not in linked:
+                size += records.size(index)
+            files += 1
+            newest = max(newest, records.mtime(index))
+            read = read and skipped[index] == 0
+        parents[path] = directory
+        totals.append([path, size, files, newest, read])
+
+    # Children were recorded after their parents so add them up in reverse
+    for directory in reversed(range(len(totals))):
+        path, size, files, newest, read = totals[directory]
+        parent = parents.get(os.path.dirname(path))
+        if parent is not None and parent != directory:
+            totals[parent][1] += size
+            totals[parent][2] += files
+            totals[parent][3] = max(totals[parent][3], newest)
+            totals[parent][4] = totals[parent][4] and read
+
+    return [tuple(total) for total in totals]
+
+
+def dirty_walk(paths, top, path_filter, hidden, checksum_names):
+    """Walk only changed paths, yielding tuples like RsyncRegexes.walk
+
+    Changed files are grouped by directory and changed directories are
+    walked entirely. Paths excluded by path_filter or hidden below top are
+    skipped just as a walk of top would skip them.
+
+    Args:
+        paths (list): absolute paths of changed files and directories
+
+        top (str): absolute path of audited directory
+
+        path_filter (RsyncRegexes): patterns of paths to exclude
+
+        hidden (bool): skip hidden files and directories if False
+
+        checksum_names (list): names of checksum files that are listed
+                               with changed files of a directory if they
+                               exist, so callers can tell they do
+
+    Yields:
+        tuple: directory path, list of directory names, which is empty for
+               directories whose changed files are yielded, and list of
+               file names
+    """
+
+    base = os.path.join(top, '')
+    subtrees = []
+    directories = OrderedDict()
+    for path in paths:
+        if os.path.isdir(path) is True and os.path.islink(path) is False:
+            subtrees.append(path)
+        else:
+            directories.setdefault(os.path.dirname(path), []) \
+                .append(os.path.basename(path))
+
+    def excluded(path, directory):
+        """Return True if a walk of top would not reach path"""
+
+        name = os.path.basename(path)
+        if hidden is False and name[0] == '.':
+            return True
+        if path_filter.exclude(path + (os.path.sep if directory else ''),
+                               base=base) is True:
+            return True
+        parent = os.path.dirname(path)
+        return len(parent) >= len(base) and excluded(parent, True)
+
+    # Subtrees are walked entirely, skip their subtrees and changed files
+    walked = []
+    for subtree in sorted(subtrees):
+        if walked and (subtree + os.path.sep).startswith(
+                os.path.join(walked[-1], '')):
+            continue
+        if subtree != top and excluded(subtree, True):
+            continue
+        walked.append(subtree)
+
+    for root, file_names in directories.items():
+        if any([os.path.join(root, '').startswith(os.path.join(tree, ''))
+                for tree in walked]):
+            continue
+        if root != top and excluded(root, True):
+            continue
+        file_names = [name for name in set(file_names)
+                      if not excluded(os.path.join(root, name), False)]
+        file_names.extend([name for name in checksum_names
+                           if os.path.isfile(os.path.join(root, name))
+                           and name not in file_names])
+        yield root, [], file_names
+
+    for subtree in walked:
+        for entry in path_filter.walk(subtree, hidden=hidden, base=base):
+            yield entry
+
 
-        Args:
-            path (str): path to match against self.regexes
+def find_duplicates(files, known, hash_files, sample, logger):
+    """Find groups of files with identical contents
 
-            base (str): if provided, removes base from beginning of path
-                        so regexes can't match base
+    Only files sharing a size can be identical, so files are first grouped
+    by size. Files in groups that are not entirely covered by known
+    checksums then have their first and last sample bytes hashed and only
+    files whose size and sample both collide are fully hashed.
 
-        Returns:
-            bool: True if path is to be included, else False
-                  This function will return the boolean appropriate for the
-                  instance's mode (self.mode).
+    Args:
+        files (list): (key, size, st_dev) tuple for each inode, where key
+                      identifies the file to hash_files
 
-        Examples:
-            >>> r = RsyncRegexes('exclude', 'hello?world.py')
-            >>> r.include('hello_world.py')
-            False
-            >>> r.include('bye_world.py')
-            True
-            >>> r = RsyncRegexes('include', 'hello?world.py')
-            >>> r.include('hello_world.py')
-            True
-            >>> r.include('bye_world.py')
-            False
-        """
+        known (dict): maps key to a checksum known to match file contents
 
-        return not self.exclude(path, base=base)
+        hash_files (function): hash_files(files, sample) calculates
+                               checksums of a list of tuples like files,
+                               hashing only the first and last sample bytes
+                               of each file if sample is greater than zero,
+                               and returns a dict mapping key to checksum
 
-    def walk(self, path, hidden=False, **kwargs):
-        """Mimic os.walk but excludes dirs and files as per instance regexes
+        sample (int): bytes hashed at each end of files when prefiltering
 
-        Args:
-            path (str): top directory to walk down from
+        logger (Logger): logging class to log messages
 
-            hidden (bool): skip hidden files and directories if False, include
-                           them if True
+    Returns:
+        list: (size, keys) tuple for each group of identical files, where
+              size (int) is the size of each file in bytes and keys is a
+              list of file keys. Largest reclaimable groups come first.
+    """
 
-            **kwargs: arbitrary keyword arguments to pass to os.walk
+    checksums = dict(known)
+
+    # Group files by size, empty files are not worth reporting
+    sizes = {}
+    for entry in files:
+        if entry[1] > 0:
+            sizes.setdefault(entry[1], []).append(entry)
+    groups = [group for group in sizes.values() if len(group) > 1]
+
+    logger.info('{0} files share their size with another file'
+                .format(str(sum([len(group) for group in groups]))))
+
+    # Hash ends of files in groups lacking checksums for some files
+    to_sample = []
+    for group in groups:
+        if any([entry[0] not in checksums for entry in group]):
+            to_sample.extend(group)
+    samples = hash_files(to_sample, sample)
+
+    logger.info('Hashed ends of {0} files'.format(str(len(to_sample))))
+
+    # Files no larger than both ends were hashed entirely
+    for key, size, device in to_sample:
+        if size <= 2 * sample and samples.get(key) is not None:
+            checksums[key] = samples[key]
+
+    # Split groups by sample and fully hash files that still collide
+    collisions = []
+    to_hash = []
+    for group in groups:
+        if all([entry[0] in checksums for entry in group]):
+            collisions.append(group)
+            continue
+        by_sample = {}
+        for entry in group:
+            if samples.get(entry[0]) is not None:
+                by_sample.setdefault(samples[entry[0]], []).append(entry)
+        for collision in by_sample.values():
+            if len(collision) > 1:
+                collisions.append(collision)
+                to_hash.extend([entry for entry in collision
+                                if entry[0] not in checksums])
+    checksums.update(hash_files(to_hash, 0))
+
+    logger.info('Fully hashed {0} files'.format(str(len(to_hash))))
+
+    # Group colliding files by full checksum
+    duplicates = []
+    for collision in collisions:
+        by_checksum = {}
+        for entry in collision:
+            if checksums.get(entry[0]) is not None:
+                by_checksum.setdefault(checksums[entry[0]], []) \
+                    .append(entry[0])
+        for keys in by_checksum.values():
+            if len(keys) > 1:
+                duplicates.append((collision[0][1], keys))
+
+    duplicates.sort(key=lambda d: d[0] * (len(d[1]) - 1), reverse=True)
+
+    return duplicates
+
+
+def hash_chunks(path, algorithm, chunk_size, first=0, count=None, mark=0,
+                validator=None):
+    """Hash file in fixed-size chunks
 
-        Yields:
-            tuple: os.walk tuple mimic. Namely, first item is a str of
-                   root directory for current iteration, second item is a list
-                   of directories in root, and third item is a list of files
-                   is root. Only directory and file names not to be excluded
-                   are yielded. Un-yielded directories will not be further
-                   transversed.
+    Args:
+        path (str): path of file to hash
 
-        Example:
-            >>> r = RsyncRegexes('include', 'hello?world.py')
-            >>> for root,  dirs, files in r.walk('/path/to/test/dir/'):
-            ...     print(root, dirs, files)
-            ('/', ['dir1', 'dir2'], ['file1', 'file2'])
-        """
+        algorithm (str): name of hashlib algorithm to hash with
 
-        # Ensure path ends with path.sep so base can be passed to exclude
-        if path[-1] != os.path.sep:
-            path += os.path.sep
+        chunk_size (int): size of chunks in bytes
 
-        for root, dir_names, file_names in os.walk(path, topdown=True,
-                                                   **kwargs):
+        first (int): number of first chunk to hash
 
-            # Remove excluded directories
-            remove_dir = []
-            for _dir in dir_names:
-                m_dir = os.path.join(root, _dir) + os.path.sep
-                if self.exclude(m_dir, base=path) is True:
-                    remove_dir.append(_dir)
-                elif hidden is False and _dir[0] == '.':
-                    remove_dir.append(_dir)
-            dir_names[:] = list(set(dir_names) - set(remove_dir))
+        count (int): number of chunks to hash, None hashes to end of file
 
-            # Remove excluded files
-            remove_files = []
-            for _file in file_names:
-                m_file = os.path.join(root, _file)
-                if self.exclude(m_file, base=path) is True:
-                    remove_files.append(_file)
-                elif hidden is False and _file[0] == '.':
-                    remove_files.append(_file)
-            file_names[:] = list(set(file_names) - set(remove_files))
+        mark (int): offset of byte to also report digest of its chunk up
+                    to, 0 for none
 
-            yield root, dir_names, file_names
+        validator (ArchiveValidator): if given, also fed the file's data
+                                      when the whole file is hashed
 
+    Returns:
+        tuple: (checksum, chunks, partial) where checksum (str) is the
+               hexadecimal checksum of the whole file or None if only some
+               chunks were hashed, chunks (list) holds hexadecimal digests
+               of each chunk hashed, and partial (str) is the digest of
+               the chunk containing mark up to mark or None
 
-class ThreadCheck(argparse.Action):
-    """Argparse Action that ensures number of threads requested is valid
+    Raises:
+        IOError: if file cannot be read
+    """
 
-    Attributes:
-        option_strings (list): list of str giving command line flags that
-                               call this action
+    whole = hashlib.new(algorithm) if first == 0 and count is None else None
+    chunks = []
+    partial = None
+
+    with open(path, 'rb') as file_handle:
+        offset = first * chunk_size
+        file_handle.seek(offset)
+        while count is None or len(chunks) < count:
+            chunk = hashlib.new(algorithm)
+            start = offset
+            stop = start + chunk_size
+            while offset < stop:
+                length = min(READ_SIZE, stop - offset)
+                if offset < mark < offset + length:
+                    length = mark - offset
+                data = file_handle.read(length)
+                if not data:
+                    break
+                chunk.update(data)
+                if whole is not None:
+                    whole.update(data)
+                    if validator is not None:
+                        validator.update(data)
+                offset += len(data)
+                if offset == mark and mark % chunk_size != 0:
+                    partial = chunk.hexdigest()
+            if offset == start:
+                break
+            chunks.append(chunk.hexdigest())
+            if offset < stop:
+                break
+
+    checksum = whole.hexdigest() if whole is not None else None
+
+    return checksum, chunks, partial
+
+
+def inflate_block(block):
+    """Decompress a BGZF block and check its CRC32 and length
 
-        dest (str): Namespace reference to value
+    Args:
+        block (bytes): complete BGZF block
 
-        nargs (bool): True if multiple arguments specified
+    Returns:
+        str: description of problem with block, None if it is valid
 
-        **kwargs (various): optional arguments to pass to super call
+    Examples:
+        >>> inflate_block(BGZF_EOF) is None
+        True
+        >>> inflate_block(BGZF_EOF[:-8] + b'\\x01' + BGZF_EOF[-7:])
+        'incorrect data check'
     """
 
-    def __init__(self, option_strings, dest, nargs=None, **kwargs):
-        """Initialize class and spawn self as Base Class w/o nargs"""
+    extra_length = struct.unpack_from('<H', block, 10)[0]
+    crc, length = struct.unpack_from('<II', block, len(block) - 8)
+    try:
+        data = zlib.decompress(block[12 + extra_length:-8], -zlib.MAX_WBITS)
+    except zlib.error as error:
+        return str(error)
+    if zlib.crc32(data) & 0xffffffff != crc:
+        return 'incorrect data check'
+    if len(data) != length:
+        return 'incorrect length check'
+    return None
 
-        # Only accept a single value to analyze
-        if nargs is not None:
-            raise ValueError('nargs not allowed for ThreadCheck')
 
-        # Call self again but without nargs
-        super(ThreadCheck, self).__init__(option_strings, dest, **kwargs)
+def open_listing(path, mode='r'):
+    """Open checksum file, fast digest file or chunk manifest as text
 
-    def __call__(self, parser, namespace, values, option_string=None):
-        """Called by Argparse when user specifies multiple threads
+    File names are kept as the bytes the filesystem holds, including names
+    that are not valid in its encoding, which Python 3 gives as strings
+    with surrogate escapes.
 
-        Simply asserts that the number of threads requested is greater than 0
-        but not greater than the maximum number of threads the computer
-        can support.
+    Args:
+        path (str): path of file to open
 
-        Args:
-            parser (ArgumentParser): parser used to generate values
+        mode (str): mode to open file in
 
-            namespace (Namespace): parse_args() generated namespace
+    Returns:
+        file: open file
+    """
 
-            values (int): actual value specified by user
+    if sys.version_info[0] < 3:
+        return open(path, mode)
+    return io.open(path, mode, encoding=sys.getfilesystemencoding(),
+                   errors='surrogateescape')
 
-            option_string (str): argument flag used to call this function
 
-        Raises:
-            TypeError: if threads is not an integer
+def reconcile_checksums(stored, files):
+    """Merge checksums calculated for a directory into its stored checksums
 
-            ValueError: if threads is less than one or greater than number of
-                        threads available on computer
-        """
+    Every step is a dict lookup or set membership test, so reconciling
+    is linear in the number of files rather than quadratic.
 
-        threads = values  # Renamed for readability
+    Args:
+        stored (dict): maps file name to checksum read from checksum file
+
+        files (list): (name, checksum, mtime) tuple for each file the walk
+                      recorded in the directory, checksum is None if it
+                      could not be calculated
+
+    Returns:
+        tuple: (checksums, changed, added, unlisted, failed) where
+               checksums (dict) maps file name to checksum to store,
+               changed (list) holds (name, mtime) tuples of files whose
+               checksum differs from the stored one, added (list) holds
+               names of files without a stored checksum, unlisted (list)
+               holds stored names the walk did not record, and failed
+               (list) holds names of files without a calculated checksum.
+               Stored checksums are kept for unlisted and failed files.
+
+    Examples:
+        >>> checksums, changed, added, unlisted, failed = \\
+        ...     reconcile_checksums({'a': '01', 'b': '02', 'gone': '03'},
+        ...                         [('a', '01', 0.0), ('b', 'ff', 1.0),
+        ...                          ('c', '04', 2.0), ('d', None, 3.0)])
+        >>> sorted(checksums.items())
+        [('a', '01'), ('b', 'ff'), ('c', '04'), ('gone', '03')]
+        >>> changed, added, unlisted, failed
+        ([('b', 1.0)], ['c'], ['gone'], ['d'])
+    """
 
-        # This try/except should already be taken care of by Argparse
-        try:
-            assert type(threads) is int
-        except AssertionError:
-            raise TypeError('{0} is not an integer'.format(str(threads)))
+    checksums = dict(stored)
+    changed = []
+    added = []
+    failed = []
+    found = set()
 
-        try:
-            assert threads >= 1
-        except AssertionError:
-            raise ValueError('Must use at least one thread')
+    for name, checksum, mtime in files:
+        found.add(name)
+        if checksum is None:
+            failed.append(name)
+        elif name not in stored:
+            added.append(name)
+            checksums[name] = checksum
+        elif stored[name] != checksum:
+            changed.append((name, mtime))
+            checksums[name] = checksum
 
-        try:
-            assert threads <= cpu_count()
-        except AssertionError:
-            raise ValueError('Cannot use more threads than available: {0}'
-                             .format(str(cpu_count())))
+    unlisted = [name for name in stored if name not in found]
 
-        setattr(namespace, self.dest, threads)
+    return checksums, changed, added, unlisted, failed
 
 
-def analyze_checksums(queue, hasher, logger, read_only):
-    """Probes directory for checksum file and compares computed file checksums
+def read_checksums(checksum_file_path):
+    """Read checksum file into memory
 
     Args:
-         queue (Queue): multiprocessing Queue class containing Directory
-                        classes to process
+        checksum_file_path (str): path to checksum file to read
 
-         hasher (str): hashing algorithm used to analyze files
+    Returns:
+        dict: maps file name to checksum
+    """
 
-         logger (Logger): logging class to log messages
+    checksums = {}
+    with open_listing(checksum_file_path) as file_handle:
+        for line in file_handle:
+            line = line.strip().split()
+            checksums[line[-1]] = line[0]
 
-         read_only (bool): if True, does not write checksum file
-    """
+    return checksums
 
-    # Loop until queue contains kill message
-    while True:
 
-        d = queue.get()
+def read_chunks(chunk_file_path):
+    """Read chunk manifest into memory
 
-        # Break on kill message
-        if d == 'DONE':
-            logger.debug('Daemon received kill signal: exiting')
-            break
+    Chunk manifests hold one tab-separated line per file of its size,
+    chunk size, hexadecimal checksum, comma-separated chunk digests, and
+    name.
 
-        logger.debug('Daemon received directory: {0}'.format(d.path()))
+    Args:
+        chunk_file_path (str): path to chunk manifest to read
 
-        logger.debug('Comparing checksums for files in directory: {0}'
-                     .format(d.path()))
+    Returns:
+        dict: maps file name to (size, chunk_size, checksum, digests) tuple
+    """
 
-        # Ensure directory still exists
-        try:
-            assert os.path.isdir(d.path()) is True
-        except AssertionError:
-            logger.warning('Directory no longer exists: {0}'
-                           .format(d.path()))
-            logger.warning('Skipping directory: {0}'.format(d.path()))
-            logger.warning('Files checksums in directory cannot be '
-                           'analyzed: {0}'.format(d.path()))
-            return None
-        else:
-            logger.debug('Directory exists: {0}'.format(d.path()))
+    entries = {}
+    with open_listing(chunk_file_path) as file_handle:
+        for line in file_handle:
+            line = line.rstrip('\r\n').split('\t', 4)
+            if len(line) < 5:
+                continue
+            entries[line[4]] = (int(line[0]), int(line[1]), line[2],
+                                line[3].split(','))
 
-        logger.debug('Looking for checksum file in directory: {0}'
-                     .format(d.path()))
+    return entries
 
-        checksum_file_path = os.path.join(d.path(), hasher + 'sums')
-        checksums = {}
 
-        if os.path.isfile(checksum_file_path) is True:
+def read_manifest(manifest_path):
+    """Generate files listed in a checksum file or combined manifest
 
-            logger.debug('Found checksum file: {0}'
-                         .format(checksum_file_path))
+    Manifests contain one "checksum  path" line per file, as written by
+    this program or *sum programs. Relative paths are resolved against
+    the directory containing the manifest, so a <algo>sums file lists
+    files beside it while a combined manifest can list a whole tree.
 
-            # Read checksums file into memory
-            with open(checksum_file_path, 'r') as file_handle:
-                for line in file_handle:
-                    line = line.strip().split()
-                    checksums[line[-1]] = line[0]
+    Args:
+        manifest_path (str): path to checksum file or manifest to read
 
-            # Ensure all files listed in checksum file exist
-            files = [os.path.basename(path) for path in iglob(d.path() + '/*')]
-            for key, value in checksums.items():
-                if key not in files:
-                    logger.warning('Checksum file {0} contains checksum '
-                                   'for non-existent file: {1}'
-                                   .format(checksum_file_path, key))
+    Yields:
+        tuple: absolute path (str) and stored checksum (str) of each file
+    """
 
-            # Analyze checksums
-            for f in d.files():
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open_listing(manifest_path) as file_handle:
+        for line in file_handle:
+            line = line.rstrip('\r\n').split(None, 1)
+            if len(line) < 2:
+                continue
+            checksum, path = line
+            if path[0] == '*':  # Binary mode marker of *sum programs
+                path = path[1:]
+            yield os.path.normpath(os.path.join(base, path)), checksum
 
-                file_name = os.path.basename(f.path())
 
-                # Skip non-existent files
-                try:
-                    assert os.path.isfile(f.path()) is True
-                except AssertionError:
-                    logger.warning('File no longer exists: {0}'
-                                   .format(f.path()))
-                    logger.warning('Skipping file checksum comparision: '
-                                   '{0}'.format(f.path()))
-                    del checksums[file_name]
-                    logger.warning('Removed file checksum from memory: {0}'
-                                   .format(f.path()))
-                    continue
+def replace_listing(path, lines):
+    """Replace checksum file, fast digest file or chunk manifest
 
-                if file_name in checksums.keys():
-                    logger.debug('File checksum stored in checksums file: '
-                                 '{0}'.format(f.path()))
-                    if f.checksum() == checksums[file_name]:
-                        logger.debug('File checksum matches stored '
-                                     'checksum: {0}'.format(f.path()))
-                        pass
-                    else:
-                        logger.warning('File checksum differs from stored '
-                                       'checksum: {0}'.format(f.path()))
-                        local_time = strftime('%Y-%m-%d %H:%M:%S',
-                                              localtime(f.mtime()))
-                        logger.warning('File {0} last modified: {1}'
-                                       .format(f.path(), local_time))
-                        checksums[file_name] = f.checksum()
-                        logger.warning('Formatted new checksum for '
-                                       'checksum file: {0}'.format(f.path()))
-                else:
-                    logger.info('File checksum not stored in checksum '
-                                'file: {0}'.format(f.path()))
-                    checksums[file_name] = f.checksum()
-                    logger.info('File checksum formatted for checksum '
-                                'file: {0}'.format(f.path()))
+    Lines are written to a hidden temporary file in the same directory
+    that is renamed over the file, so a daemon terminated or failing while
+    writing leaves the previous file whole.
 
-        else:
+    Args:
+        path (str): path of file to replace
 
-            logger.debug('Could not find checksum file in directory: {0}'
-                         .format(d.path()))
+        lines (list): lines of new file, with line endings
 
-            if read_only is True:
-                logger.warning('Read-Only Mode active')
-                logger.warning('Skipping directory: {0}'.format(d.path()))
-                continue
+    Raises:
+        IOError: if temporary file cannot be written
+
+        OSError: if temporary file cannot be created or renamed
+    """
 
-            logger.info('Formatting file checksums for directory: {0}'
-                        .format(d.path()))
+    fd, temp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.',
+                                dir=os.path.dirname(path) or os.curdir)
+    os.close(fd)
+    try:
+        with open_listing(temp, 'w') as file_handle:
+            file_handle.writelines(lines)
+        if os.path.isfile(path) is True:
+            shutil.copymode(path, temp)
+        else:
+            os.chmod(temp, 0o666 & ~UMASK)
+        os.rename(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
 
-            for f in d.files():
 
-                file_name = os.path.basename(f.path())
+def update_chunks(chunk_file_path, entries=None, keep=None):
+    """Replace chunk manifest with an updated one under an exclusive lock
 
-                # Skip non-existent files
-                try:
-                    assert os.path.isfile(f.path()) is True
-                except AssertionError:
-                    logger.warning('File no longer exists: {0}'
-                                   .format(f.path()))
-                    logger.warning('Skipping file checksum formatting: {0}'
-                                   .format(f.path()))
-                    continue
+    Daemons update chunk manifests as they hash files, so the manifest's
+    directory is locked while the manifest is read, updated and replaced.
 
-                checksums[file_name] = f.checksum()
+    Args:
+        chunk_file_path (str): path to chunk manifest to update
 
-                logger.info('File checksum formatted: {0}'.format(f.path()))
+        entries (dict): maps file name to (size, chunk_size, checksum,
+                        digests) tuple to store
 
-        # Write checksum file
-        if read_only is False:
-            try:
-                with open(checksum_file_path, 'w') as checksum_handle:
-                    for key, value in checksums.items():
-                        output = value + '  ' + key + os.linesep
-                        checksum_handle.write(output)
-            except IOError:
-                logger.error('Cannot write checksum file: {0}'
-                             .format(checksum_file_path))
-                pass
-        else:
-            logger.debug('Read-Only Mode active')
-            logger.debug('Skipping writing checksum file: {0}'
-                         .format(d.path()))
+        keep (set): if given, names of files whose entries are kept, the
+                    entries of all other files are removed
 
+    Raises:
+        IOError: if chunk manifest cannot be written
 
-def checksum_calculator(queue, hasher, hash_from, logger):
-    """Calculate hexadecimal checksum of file from queue using given hasher
+        OSError: if chunk manifest cannot be replaced
+    """
+
+    lock = os.open(os.path.dirname(chunk_file_path) or os.curdir, os.O_RDONLY)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stored = {}
+        if os.path.isfile(chunk_file_path) is True:
+            with open_listing(chunk_file_path) as file_handle:
+                for line in file_handle:
+                    name = line.rstrip('\r\n').split('\t', 4)[-1]
+                    stored[name] = line.rstrip('\r\n')
+        for name, entry in (entries or {}).items():
+            stored[name] = '\t'.join([str(entry[0]), str(entry[1]),
+                                      entry[2], ','.join(entry[3]), name])
+        if keep is not None:
+            stored = dict((name, line) for name, line in stored.items()
+                          if name in keep)
+        replace_listing(chunk_file_path, [stored[name] + os.linesep
+                                          for name in sorted(stored)])
+    finally:
+        os.close(lock)  # Releases lock
+
+
+def verify_manifests(manifests, scheduler, logger):
+    """Verify files listed in manifests without walking any directories
+
+    Listed files are stat'd and streamed straight to daemons as each
+    manifest is read, so verification starts immediately. Nothing is
+    written, every result is compared to the checksum in the manifest.
 
     Args:
-         queue (Queue): multiprocessing Queue class containing File classes to
-                        process
+        manifests (list): paths of checksum files or combined manifests
 
-         hasher (function): function from hashlib to compute file checksums
+        scheduler (DeviceScheduler): scheduler of checksum_calculator
+                                     daemons, its callback is replaced
 
-         hash_from (str): 'python' if hasher is a hashlib function and 'linux'
-                          if hasher is a *nix hash command
+        logger (Logger): logging class to log messages
 
-         logger (Logger): logging class to log messages
+    Returns:
+        tuple: numbers of files matching, differing from, missing from,
+               and failing to hash against their stored checksums, and
+               total size of files hashed in bytes
     """
 
-    # Loop until queue contains kill message
-    while True:
+    expected = {}  # file index: (path, stored checksum) until hashed
+    counts = [0, 0, 0, 0, 0]
+
+    def compare(result):
+        """Compare (file index, checksum) result to stored checksum"""
+
+        index, checksum = result
+        path, stored = expected.pop(index)
+        if checksum is None:
+            logger.warning('Skipping file checksum comparision: {0}'
+                           .format(path))
+            counts[3] += 1
+        elif checksum == stored:
+            logger.debug('File checksum matches stored checksum: {0}'
+                         .format(path))
+            counts[0] += 1
+        else:
+            logger.warning('File checksum differs from stored checksum: '
+                           '{0}'.format(path))
+            try:
+                local_time = strftime('%Y-%m-%d %H:%M:%S',
+                                      localtime(os.path.getmtime(path)))
+                logger.warning('File {0} last modified: {1}'
+                               .format(path, local_time))
+            except OSError:
+                pass
+            counts[1] += 1
 
-        f = queue.get()
+    scheduler.callback = compare
 
-        # Break on kill message
-        if f == 'DONE':
-            logger.debug('Daemon received kill signal: exiting')
-            break
+    index = 0
+    for manifest in manifests:
 
-        logger.debug('Daemon received file: {0}'.format(f.path()))
+        logger.info('Verifying files listed in manifest: {0}'
+                    .format(manifest))
 
         try:
-            assert os.path.isfile(f.path()) is True
-        except AssertionError:
-            logger.warning('File no longer exists: {0}'.format(f.path()))
-            logger.warning('Skipping checksum calculation: {0}'
-                           .format(f.path()))
-            continue
+            for path, stored in read_manifest(manifest):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    logger.warning('Manifest {0} contains checksum for '
+                                   'non-existent file: {1}'
+                                   .format(manifest, path))
+                    counts[2] += 1
+                    continue
+                expected[index] = (path, stored)
+                counts[4] += stat.st_size
+                scheduler.put((index, path, stat.st_size), stat.st_dev)
+                index += 1
+        except IOError:
+            logger.error('Cannot read manifest: {0}'.format(manifest))
 
-        try:
-            assert os.access(f.path(), os.R_OK) is True
-        except AssertionError:
-            logger.warning('Cannot read file: {0}'.format(f.path()))
-            logger.warning('Skipping checksum calculation: {0}'.
-                           format(f.path()))
-            continue
+    scheduler.join()
+
+    # Files whose daemons were given up on report no result
+    for path, stored in expected.values():
+        logger.warning('Skipping file checksum comparision: {0}'
+                       .format(path))
+        counts[3] += 1
+
+    return tuple(counts)
+
+
+def write_fast_sums(dir_path, fast, digests, checksums, logger):
+    """Write fast digest file of a directory beside its checksum file
 
-        logger.debug('Calculating checksum: {0}'.format(f.path()))
+    Fast digests not calculated this run, e.g. of files whose checksums
+    came from the inode cache, are kept from the existing file.
 
+    Args:
+        dir_path (str): path of directory
+
+        fast (str): name of fast digest in FAST_ALGORITHMS
+
+        digests (dict): maps file name to fast digest calculated this run
+
+        checksums (dict): maps file name to checksum in checksum file,
+                          only files listed are written
+
+        logger (Logger): logging class to log messages
+    """
+
+    fast_file_path = os.path.join(dir_path, fast + 'sums')
+    stored = {}
+    if os.path.isfile(fast_file_path) is True:
         try:
-            if hash_from == 'linux':
-                f.set_checksum(check_output([hasher, f.path()]).split(' ')[0])
-            elif hash_from == 'python':
-                # Process file contents in memory efficient manner
-                with open(f.path(), 'rb') as file_handle:
-                    hexsum = hasher()
-                    while True:
-                        data = file_handle.read(hasher.block_size)
-                        if not data:
-                            break
-                        hexsum.update(data)
-                f.set_checksum(hexsum.hexdigest())
-        except (KeyboardInterrupt, SystemExit):  # Exit if asked
-            raise
-        except Exception as error:  # Skip calculation on all other errors
-            logger.error('Suppressed error: {0}'.format(error))
-            f.set_checksum(None)
-            logger.error('Reset checksum to None: {0}'.format(f.path()))
-            logger.error('Skipping checksum calculation: {0}'.
-                         format(f.path()))
-        else:
-            logger.debug('Calculated checksum: {0}'.format(f.path()))
+            stored = read_checksums(fast_file_path)
+        except (IOError, IndexError):
+            logger.warning('Cannot read fast digest file: {0}'
+                           .format(fast_file_path))
+    stored.update(digests)
+
+    try:
+        replace_listing(fast_file_path, [stored[key] + '  ' + key + os.linesep
+                                         for key in sorted(checksums)
+                                         if key in stored])
+    except (IOError, OSError):
+        logger.error('Cannot write fast digest file: {0}'
+                     .format(fast_file_path))
 
 
 # This method is literally just the Python 3.5.1 which function from the
 # shutil library in order to permit this functionality in Python 2.
 # Minor changes to style were made to account for indentation.
-def which(cmd, mode=os.F_OK | os.X_OK, path=None):
+def _which(cmd, mode=os.F_OK | os.X_OK, path=None):
     """Given a command, mode, and a PATH string, return the path which
     conforms to the given mode on the PATH, or None if there is no such
     file.
@@ -778,6 +3174,12 @@ def which(cmd, mode=os.F_OK | os.X_OK, path=None):
     return None
 
 
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    which = _which
+
+
 def main(args):
     """Control program flow
 
@@ -801,7 +3203,12 @@ def main(args):
         formatter = logging.Formatter(
             '%(name)s - %(levelname)s: %(message)s')
     else:
-        handler = logging.FileHandler(filename=args.log)
+        # Log paths with undecodable names escaped rather than not at all
+        try:
+            handler = logging.FileHandler(filename=args.log,
+                                          errors='backslashreplace')
+        except TypeError:  # Python 3.8 and older
+            handler = logging.FileHandler(filename=args.log)
         formatter = logging.Formatter(
             '%(asctime)s %(name)s - %(levelname)s: %(message)s')
     handler.setFormatter(formatter)
@@ -812,20 +3219,32 @@ def main(args):
     # Log startup information
     logger.info('Starting integrity_audit')
     logger.info('Command: {0}'.format(' '.join(sys.argv)))
-    logger.info('Top Directory: {0}'.format(os.path.abspath(args.directory)))
+    if args.manifest is not None:
+        logger.info('Manifests: {0}'.format(' '.join(args.manifest)))
+    else:
+        logger.info('Top Directory: {0}'
+                    .format(os.path.abspath(args.directory)))
     logger.info('Log Location: {0}'.format(os.path.abspath(args.log)))
     logger.info('Threads: {0}'.format(str(args.threads)))
     logger.info('Read-Only Mode: {0}'.format(str(args.read_only)))
+    if args.cache is not None:
+        logger.info('Inode Cache: {0}'.format(os.path.abspath(args.cache)))
+    if args.duplicates is not None:
+        logger.info('Duplicate Report: {0}'
+                    .format(os.path.abspath(args.duplicates)))
+    if args.chunk_size > 0 and args.manifest is None:
+        logger.info('Chunk Size: {0} MB'.format(str(args.chunk_size)))
+    if args.compressed is True:
+        logger.info('Validating Compressed Files: {0}'
+                    .format(' '.join(COMPRESSED_EXTENSIONS)))
+    if args.fast is not None and args.duplicates is None \
+            and args.manifest is None:
+        logger.info('Fast Digest: {0}, confirming checksums every {1} days'
+                    .format(args.fast, str(args.confirm)))
 
     # Relate hashing algorithm arg to function for downstream use
-    hash_functions = {
-        'md5': hashlib.md5,
-        'sha1': hashlib.sha1,
-        'sha224': hashlib.sha224,
-        'sha256': hashlib.sha256,
-        'sha384': hashlib.sha384,
-        'sha512': hashlib.sha512
-    }
+    hash_functions = dict((algorithm, getattr(hashlib, algorithm))
+                          for algorithm in ALGORITHMS)
 
     logger.info('Checking for GNU program: {0}'.format(args.algorithm +
                                                        'sum'))
@@ -836,6 +3255,11 @@ def main(args):
     sum_cmd = which(args.algorithm + 'sum')
     use_sum = True if sum_cmd is not None else False  # Mostly for readability
     algo = args.algorithm + 'sums'
+    algo_chunks = args.algorithm + 'chunks'
+    chunk_size = args.chunk_size * 1048576 if args.manifest is None else 0
+    fast = args.fast if args.duplicates is None and args.manifest is None \
+        else None
+    algo_fast = fast + 'sums' if fast is not None else None
 
     if use_sum is True:
         logger.info('Found GNU program: {0}'.format(sum_cmd))
@@ -861,12 +3285,69 @@ def main(args):
     else:
         path_filter = RsyncRegexes('exclude', [])
 
-    # Create multiprocess manager to handle classes
-    BaseManager.register('Directory', Directory)
-    BaseManager.register('File', File)
-    manager = BaseManager()
-    manager.start()
-    queue = Queue(args.threads)  # Max queue prevents race condition
+    # Store data on files compactly for the whole run
+    records = FileRecords(hash_functions[args.algorithm]().digest_size,
+                          FAST_ALGORITHMS[fast]().digest_size
+                          if fast is not None else 0)
+
+    def store_checksum(result):
+        """Store (file index, checksum) result of a daemon in records"""
+
+        index, checksum = result
+        try:
+            records.set_checksum(index, checksum)
+        except (TypeError, ValueError):
+            logger.error('Invalid checksum {0}: {1}'
+                         .format(checksum, records.path(index)))
+            records.set_checksum(index, None)
+
+    # Chunks of files verified in parallel: file index to list of number of
+    # chunk ranges left to verify, differing chunks or None if chunks could
+    # not be read, and checksum stored with chunks
+    verifying = {}
+
+    # Files whose checksums were trusted and confirmed with --fast
+    confirmations = {False: 0, True: 0}
+
+    def store_result(result):
+        """Store result of a daemon hashing a file or verifying chunks"""
+
+        if len(result) == 2:
+            store_checksum(result)
+            return
+
+        if len(result) == 4:
+            index, checksum, digest, confirmed = result
+            records.set_fast(index, digest)
+            store_checksum((index, checksum))
+            if checksum is not None:
+                confirmations[confirmed] += 1
+            return
+
+        index, first, bad = result
+        state = verifying[index]
+        state[0] -= 1
+        if bad is None:
+            state[1] = None
+        elif state[1] is not None:
+            state[1].extend(bad)
+        if state[0] > 0:
+            return
+
+        # All chunks verifying means the stored checksum is still valid
+        del verifying[index]
+        if state[1] is None:
+            logger.warning('Skipping file checksum calculation: {0}'
+                           .format(records.path(index)))
+        elif not state[1]:
+            logger.debug('All chunks verified: {0}'
+                         .format(records.path(index)))
+            store_checksum((index, state[2]))
+        else:
+            logger.debug('Chunks differ, rehashing file: {0}'
+                         .format(records.path(index)))
+            scheduler.put((index, records.path(index), records.size(index)),
+                          records.device(index))
 
     # Variables for use with processing threads
     if use_sum is True:
@@ -876,17 +3357,75 @@ def main(args):
         hasher = hash_functions[args.algorithm]
         hash_from = 'python'
 
+    # Adjust number of busy daemons during run if requested
+    threads = args.threads
+    controller = None
+    if args.threads == 'auto':
+        threads = cpu_count()
+        controller = ConcurrencyController(1, AUTO_THREADS, threads)
+        logger.info('Adjusting threads between 1 and {0} based on '
+                    'throughput'.format(str(AUTO_THREADS)))
+
+    # Relate paths given in --device_limit to devices
+    default_limit = AUTO_THREADS if controller is not None else threads
+    device_limits = {}
+    for path, limit in args.device_limit:
+        if path is None:
+            default_limit = limit
+            logger.info('Max Concurrent Readers per Device: {0}'
+                        .format(str(limit)))
+            continue
+        try:
+            device = os.stat(path).st_dev
+        except OSError:
+            logger.warning('Cannot determine device of path: {0}'
+                           .format(path))
+            logger.warning('Ignoring device limit: {0}'.format(path))
+            continue
+        device_limits[device] = limit
+        logger.info('Max Concurrent Readers for Device of {0}: {1}'
+                    .format(path, str(limit)))
+
     logger.debug('Initializing daemon subprocesses')
 
-    # Initialize daemons to process files
-    processes = []
-    for i in range(args.threads):
-        processes.append(Process(target=checksum_calculator,
-                                 args=(queue, hasher, hash_from, logger,)))
-        processes[i].daemonize = True
-        processes[i].start()
+    # Give daemons args.timeout seconds per GB of a file, at least one GB
+    deadline = None
+    if args.timeout > 0:
+        deadline = lambda item: args.timeout * max(1.0,
+                                                   item[2] / 1073741824.0)
+        logger.info('Daemon Timeout: {0} seconds per GB'
+                    .format(str(args.timeout)))
 
-    logger.debug('Initialized {0} daemons'.format(str(len(processes))))
+    # Initialize daemons to process files
+    scheduler = DeviceScheduler(checksum_calculator,
+                                (hasher, hash_from, logger, 0, chunk_size,
+                                 args.algorithm, args.read_only,
+                                 args.compressed, fast),
+                                threads, default_limit, device_limits,
+                                callback=store_result, deadline=deadline,
+                                label=lambda item: item[1], logger=logger,
+                                controller=controller,
+                                weight=lambda item: item[4] * chunk_size
+                                if len(item) == 5 else item[2])
+
+    logger.debug('Initialized {0} daemons'.format(str(len(scheduler))))
+
+    # Verify files listed in manifests instead of walking a directory
+    if args.manifest is not None:
+        matched, changed, missing, failed, total_size = \
+            verify_manifests(args.manifest, scheduler, logger)
+
+        logger.info('{0} files matched stored checksums, {1} differed, {2} '
+                    'no longer exist, and {3} could not be checked'
+                    .format(str(matched), str(changed), str(missing),
+                            str(failed)))
+
+        logger.info('Analyzed {0:.2e} GB of data in {1:.2e} minutes'
+                    .format(total_size / 1073741824.0,
+                            (time() - start) / 60.0))
+
+        logger.info('Exiting integrity_audit')
+        return
 
     abs_dir = os.path.abspath(args.directory)
 
@@ -900,10 +3439,61 @@ def main(args):
         max_depth = args.max_depth + abs_dir.count(os.path.sep)
         logger.info('Max Absolute Directory Depth: {0}'.format(str(max_depth)))
 
+    # Open cache of checksums from previous runs
+    cache = None
+    if args.cache is not None:
+        try:
+            cache = InodeCache(args.cache, args.algorithm)
+        except sqlite3.Error as error:
+            logger.error('Cannot open inode cache {0}: {1}'
+                         .format(args.cache, error))
+            logger.error('Calculating checksums without inode cache')
+
+    # Only walk paths changed since the last audit unless a full walk is due
+    walk = path_filter.walk(abs_dir, hidden=args.hidden)
+    dirty = None
+    full_walk = args.recursive is True and max_depth == -1
+    if args.cache is not None and args.duplicates is None:
+        try:
+            dirty = DirtyList(args.cache)
+            last_walk = dirty.last_walk(abs_dir)
+            if args.dirty is True and \
+                    start - last_walk < args.full_walk * 86400:
+                paths = dirty.paths(abs_dir)
+                if args.recursive is False:
+                    paths = [path for path in paths if path == abs_dir or
+                             (os.path.dirname(path) == abs_dir and
+                              os.path.isdir(path) is False)]
+                logger.info('Auditing {0} paths changed since last audit, '
+                            'last full walk: {1}'
+                            .format(str(len(paths)),
+                                    strftime('%Y-%m-%d %H:%M:%S',
+                                             localtime(last_walk))))
+                walk = dirty_walk(paths, abs_dir, path_filter, args.hidden,
+                                  [name for name in
+                                   [algo, algo_chunks, algo_fast]
+                                   if name is not None])
+                full_walk = False
+            elif args.dirty is True:
+                logger.info('No full walk in last {0} days: walking entire '
+                            'tree'.format(str(args.full_walk)))
+        except sqlite3.Error as error:
+            logger.error('Cannot open dirty list {0}: {1}'
+                         .format(args.cache, error))
+            dirty = None
+
+    # Names of checksum files and chunk manifests, which are not audited
+    listings = set([key + 'sums' for key in hash_functions.keys()]
+                   + [key + 'chunks' for key in hash_functions.keys()]
+                   + [key + 'sums' for key in FAST_ALGORITHMS.keys()])
+
     # Obtain directory structure and data, populate queue for above daemons
-    dirs = []
-    for root, dir_names, file_names in path_filter.walk(abs_dir,
-                                                        hidden=args.hidden):
+    stamps = {}  # directory path: mtime of checksum file not yet due
+    inodes = {}  # (st_dev, st_ino): index of first hard link to inode
+    links = []  # (index of first hard link to inode, index of link)
+    candidates = array('l')  # index of each file to deduplicate
+    unread = array('l')  # index of each file not hashed from its data
+    for root, dir_names, file_names in walk:
 
         norm_root = os.path.abspath(os.path.normpath(root))
 
@@ -953,8 +3543,53 @@ def main(args):
         else:
             logger.debug('Can write to directory: {0}'.format(norm_root))
 
+        # Checksums of files unmodified since the checksum file was written
+        # are still valid and save hashing files when finding duplicates
+        dir_checksums = {}
+        sums_mtime = 0
+        if args.duplicates is not None and algo in file_names:
+            checksum_file_path = os.path.join(norm_root, algo)
+            try:
+                sums_mtime = os.path.getmtime(checksum_file_path)
+                dir_checksums = read_checksums(checksum_file_path)
+            except (IOError, OSError, IndexError):
+                logger.warning('Cannot read checksum file: {0}'
+                               .format(checksum_file_path))
+
+        # Chunks of files whose size is unchanged can be verified in parallel
+        dir_chunks = {}
+        if chunk_size > 0 and args.duplicates is None \
+                and algo_chunks in file_names:
+            chunk_file_path = os.path.join(norm_root, algo_chunks)
+            try:
+                dir_chunks = read_chunks(chunk_file_path)
+            except (IOError, ValueError):
+                logger.warning('Cannot read chunk manifest: {0}'
+                               .format(chunk_file_path))
+
+        # Unchanged fast digests vouch for stored checksums until the
+        # checksum file is older than args.confirm days
+        dir_fast = {}
+        if fast is not None and algo in file_names \
+                and algo_fast in file_names:
+            checksum_file_path = os.path.join(norm_root, algo)
+            fast_file_path = os.path.join(norm_root, algo_fast)
+            try:
+                sums_mtime = os.path.getmtime(checksum_file_path)
+                if start - sums_mtime < args.confirm * 86400:
+                    dir_checksums = read_checksums(checksum_file_path)
+                    dir_fast = read_checksums(fast_file_path)
+                    stamps[norm_root] = sums_mtime
+                else:
+                    logger.debug('Confirming checksums of directory: {0}'
+                                 .format(norm_root))
+            except (IOError, OSError, IndexError):
+                logger.warning('Cannot read checksum or fast digest file: '
+                               '{0}'.format(norm_root))
+
+        records.add_directory(norm_root)
+
         # Analyze each file in the given directory
-        file_classes = []
         for file_name in file_names:
 
             file_path = os.path.join(norm_root, file_name)
@@ -997,30 +3632,91 @@ def main(args):
                 logger.debug('{0} is hidden: skipping'.format(file_path))
                 continue
 
-            # Skip checksum files
-            if file_name in ([key + 'sums' for key in hash_functions.keys()]):
+            # Skip checksum files and chunk manifests, and the temporary
+            # files replace_listing leaves if its daemon is terminated
+            if file_name in listings or (file_name[0] == '.' and
+                                         file_name[1:].rsplit('.', 1)[0]
+                                         in listings):
                 logger.debug('Checksum file found: {0}'.format(file_path))
                 logger.debug('Skipping checksum file: {0}'.format(file_path))
                 continue
 
-            # Initiate File class and store attributes
-            mtime = os.path.getmtime(file_path)
-            size = os.path.getsize(file_path)
-            file_class = manager.File(file_path, mtime, size)
-            file_classes.append(file_class)
+            # Record file attributes
+            stat = os.stat(file_path)
+            index = records.add_file(file_name, stat.st_size, stat.st_mtime,
+                                     stat.st_dev, stat.st_ino)
+
+            logger.debug('Recorded file: {0}'.format(file_path))
+
+            # Hard links share the checksum of the first path to their inode
+            if stat.st_nlink > 1:
+                inode = (stat.st_dev, stat.st_ino)
+                if inode in inodes:
+                    links.append((inodes[inode], index))
+                    logger.debug('File is a hard link to {0}: {1}'
+                                 .format(records.path(inodes[inode]),
+                                         file_path))
+                    continue
+                inodes[inode] = index
+
+            # Skip reading inodes unchanged since their checksum was cached
+            checksum = None
+            if cache is not None:
+                checksum = cache.get(stat.st_dev, stat.st_ino, stat.st_size,
+                                     stat.st_mtime)
+                if checksum is not None:
+                    store_checksum((index, checksum))
+                    unread.append(index)
+                    logger.debug('Using cached checksum: {0}'
+                                 .format(file_path))
+
+            # Defer hashing to find_duplicates when reporting duplicates
+            if args.duplicates is not None:
+                if checksum is None and file_name in dir_checksums \
+                        and stat.st_mtime <= sums_mtime:
+                    store_checksum((index, dir_checksums[file_name]))
+                    logger.debug('Using checksum from checksum file: {0}'
+                                 .format(file_path))
+                candidates.append(index)
+                continue
+
+            if checksum is not None:
+                continue
+
+            if fast is not None:
+                stored = None
+                if file_name in dir_fast and file_name in dir_checksums:
+                    stored = (dir_fast[file_name], dir_checksums[file_name])
+                scheduler.put((index, file_path, stat.st_size, stored),
+                              stat.st_dev)
+                logger.debug('File placed in processing queue for fast '
+                             'digest: {0}'.format(file_path))
+                continue
 
-            logger.debug('Initialized class for file: {0}'.format(file_path))
+            # Validating compressed files needs them read in full
+            stored = dir_chunks.get(file_name)
+            if args.compressed is True and \
+                    file_name.endswith(COMPRESSED_EXTENSIONS):
+                stored = None
+            if stored is not None and stored[0] == stat.st_size > chunk_size \
+                    and stored[1] == chunk_size:
+                count = len(stored[3])
+                ranges = range(0, count, VERIFY_CHUNKS)
+                verifying[index] = [len(ranges), [], stored[2]]
+                for first in ranges:
+                    scheduler.put((index, file_path, stat.st_size, first,
+                                   min(VERIFY_CHUNKS, count - first)),
+                                  stat.st_dev)
+                logger.debug('File chunks placed in processing queue: {0}'
+                             .format(file_path))
+                continue
 
-            queue.put(file_class)
+            scheduler.put((index, file_path, stat.st_size), stat.st_dev)
 
             logger.debug('File placed in processing queue: {0}'
                          .format(file_path))
 
-        # Initialize Directory and pass File handles
-        directory = manager.Directory(norm_root, file_classes)
-        dirs.append(directory)
-
-        logger.debug('Initialized class for directory: {0}'.format(norm_root))
+        logger.debug('Recorded directory: {0}'.format(norm_root))
 
         # Break loop on first iteration if not recursive
         if args.recursive is False:
@@ -1029,64 +3725,204 @@ def main(args):
 
     logger.info('File structure analysis complete')
 
-    logger.debug('Populating end of queue with kill messages')
-
-    # Send a kill message to each thread via queue
-    for i in processes:
-        queue.put('DONE')
-
     logger.debug('Waiting for daemons to complete')
 
-    # Wait for each process to complete before continuing
-    for process in processes:
-        process.join()
-        logger.debug('A daemon has exited')
+    # Wait for queued files to be processed and daemons to exit
+    scheduler.join()
 
     logger.debug('All daemons have exited')
 
-    logger.info('All file checksums calculated')
+    if fast is not None:
+        logger.info('Trusted {0} checksums with unchanged fast digests, '
+                    'calculated {1}'.format(str(confirmations[False]),
+                                            str(confirmations[True])))
 
-    logger.info('Comparing file checksums to stored checksums')
+    if controller is not None:
+        logger.info('Settled on {0} threads, reuse with "-t {0}"'
+                    .format(str(controller.best)))
 
-    logger.debug('Initializing daemon subprocesses')
+    # Hash only the files needed to find duplicates
+    if args.duplicates is not None:
 
-    # Initialize daemons to compare checksums
-    queue2 = Queue(args.threads)  # Max queue prevents race condition
-    processes2 = []
-    for i in range(args.threads):
-        processes2.append(Process(target=analyze_checksums,
-                                  args=(queue2, args.algorithm, logger,
-                                        args.read_only)))
-        processes2[i].daemonize = True
-        processes2[i].start()
+        logger.info('Searching for duplicates among {0} files'
+                    .format(str(len(candidates))))
 
-    logger.debug('Initialized {0} daemons'.format(str(len(processes2))))
+        def hash_files(entries, sample):
+            """Hash files for find_duplicates with a new DeviceScheduler"""
 
-    for d in dirs:
-        queue2.put(d)
-        logger.debug('Directory placed in processing queue: {0}'
-                     .format(d.path()))
+            if sample > 0:
+                target_args = (hash_functions[args.algorithm], 'python',
+                               logger, sample)
+            else:
+                target_args = (hasher, hash_from, logger)
+            checksums = {}
+            hash_controller = None
+            if controller is not None:
+                hash_controller = ConcurrencyController(1, AUTO_THREADS,
+                                                        controller.best)
+            hash_scheduler = DeviceScheduler(checksum_calculator,
+                                             target_args, threads,
+                                             default_limit, device_limits,
+                                             callback=lambda result:
+                                             checksums.update([result]),
+                                             deadline=deadline,
+                                             label=lambda item: item[1],
+                                             logger=logger,
+                                             controller=hash_controller,
+                                             weight=lambda item: item[2])
+            for index, size, device in entries:
+                hash_scheduler.put((index, records.path(index), size),
+                                   device)
+            hash_scheduler.join()
+            if sample == 0:  # Keep full checksums for inode cache
+                for result in checksums.items():
+                    store_checksum(result)
+            return checksums
+
+        known = {}
+        for index in candidates:
+            if records.checksum(index) is not None:
+                known[index] = records.checksum(index)
+        duplicates = find_duplicates([(index, records.size(index),
+                                       records.device(index))
+                                      for index in candidates],
+                                     known, hash_files, DUPLICATE_SAMPLE,
+                                     logger)
+
+    # Share checksums of inodes with all their hard links
+    for first, link in links:
+        records.set_checksum(link, records.checksum(first))
+        if fast is not None:
+            records.set_fast(link, records.fast(first))
+
+    logger.debug('Copied checksums to {0} hard links'.format(str(len(links))))
+
+    # Store calculated checksums for future runs
+    if cache is not None:
+        try:
+            for index in range(len(records)):
+                checksum = records.checksum(index)
+                if checksum is not None:
+                    cache.set(records.device(index), records.inode(index),
+                              records.size(index), records.mtime(index),
+                              checksum)
+            cache.close()
+        except sqlite3.Error as error:
+            logger.error('Cannot write inode cache {0}: {1}'
+                         .format(args.cache, error))
+        else:
+            logger.info('Updated inode cache: {0}'.format(args.cache))
+
+    # Write duplicate report instead of comparing checksums
+    if args.duplicates is not None:
+        reclaimable = 0
+        try:
+            with open(args.duplicates, 'w') as report_handle:
+                for size, indices in duplicates:
+                    paths = sorted([records.path(i) for i in indices])
+                    reclaimable += size * (len(paths) - 1)
+                    report_handle.write('# {0} files of {1} bytes, {2} bytes '
+                                        'reclaimable{3}'
+                                        .format(str(len(paths)), str(size),
+                                                str(size * (len(paths) - 1)),
+                                                os.linesep))
+                    for path in paths:
+                        report_handle.write(path + os.linesep)
+                    report_handle.write(os.linesep)
+        except IOError:
+            logger.error('Cannot write duplicate report: {0}'
+                         .format(args.duplicates))
+        else:
+            logger.info('Found {0} groups of duplicate files with {1:.2e} GB '
+                        'reclaimable'.format(str(len(duplicates)),
+                                             reclaimable / 1073741824.0))
+            logger.info('Wrote duplicate report: {0}'
+                        .format(args.duplicates))
+
+        logger.info('Exiting integrity_audit')
+        return
+
+    logger.info('All file checksums calculated')
+
+    logger.info('Comparing file checksums to stored checksums')
 
-    logger.debug('Populating end of queue with kill messages')
+    logger.debug('Initializing daemon subprocesses')
 
-    # Send a kill message to each thread via queue
-    for i in processes2:
-        queue2.put('DONE')
+    # Give daemons args.timeout seconds per directory
+    if deadline is not None:
+        deadline = lambda item: args.timeout
+
+    # Initialize daemons to compare checksums, checksum files are small so
+    # directories are not limited per device
+    analyzer = DeviceScheduler(analyze_checksums,
+                               (args.algorithm, logger, args.read_only),
+                               threads, threads,
+                               deadline=deadline,
+                               label=lambda item: item[0], logger=logger)
+
+    logger.debug('Initialized {0} daemons'.format(str(len(analyzer))))
+
+    for d in range(records.directories()):
+        item = (records.directory(d),
+                [(records.name(i), records.checksum(i), records.mtime(i))
+                 for i in records.files(d)])
+        if fast is not None:
+            item += ((fast, dict([(records.name(i), records.fast(i))
+                                  for i in records.files(d)
+                                  if records.fast(i) is not None]),
+                      stamps.get(records.directory(d))),)
+        analyzer.put(item, None)
+        logger.debug('Directory placed in processing queue: {0}'
+                     .format(records.directory(d)))
 
     logger.debug('Waiting for daemons to complete')
 
-    # Wait for each process to complete before continuing
-    for process in processes2:
-        process.join()
-        logger.debug('A daemon has exited')
+    # Wait for queued directories to be processed and daemons to exit
+    analyzer.join()
 
     logger.debug('All daemons have exited')
 
     logger.info('Checksum comparisons complete')
 
+    # Store space used by directories for audit_report.py, read-only audits
+    # skip directories without checksum files so cannot total the tree
+    if args.cache is not None and full_walk is True \
+            and args.read_only is False:
+        # Links to cached inodes were not read either, nor were files that
+        # could not be hashed
+        cached = set(unread) if links else ()
+        unread.extend(link for first, link in links if first in cached)
+        unread.extend(index for index in range(len(records))
+                      if records.checksum(index) is None)
+        try:
+            stats = DirectoryStats(args.cache)
+            stats.update(abs_dir,
+                         directory_totals(records,
+                                          [link for first, link in links],
+                                          unread),
+                         start)
+            stats.close()
+        except sqlite3.Error as error:
+            logger.error('Cannot update directory statistics {0}: {1}'
+                         .format(args.cache, error))
+        else:
+            logger.info('Updated directory statistics: {0}'
+                        .format(args.cache))
+
+    # Paths changed before this audit started have now been audited
+    if dirty is not None and args.read_only is False:
+        try:
+            dirty.clear(abs_dir, start)
+            if full_walk is True:
+                dirty.walked(abs_dir, start)
+            dirty.close()
+        except sqlite3.Error as error:
+            logger.error('Cannot update dirty list {0}: {1}'
+                         .format(args.cache, error))
+
     # Calculate and log end of program run
     end = time()
-    total_size = float(sum([d.size() for d in dirs])) / 1073741824.0
+    total_size = float(records.total_size()) / 1073741824.0
     total_time = (end - start) / 60.0
 
     logger.info('Analyzed {0:.2e} GB of data in {1:.2e} minutes'
@@ -1099,19 +3935,92 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__,
                                      formatter_class=argparse.
                                      RawDescriptionHelpFormatter)
-    parser.add_argument('directory', metavar='dir',
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('directory', metavar='dir',
                         type=str,
+                        nargs='?',
+                        default=None,
                         help='directory containing files to check')
+    source.add_argument('-M', '--manifest',
+                        type=str,
+                        default=None,
+                        nargs='+',
+                        metavar='FILE',
+                        help='verify only files listed in checksum files or '
+                             'combined manifests, paths relative to each '
+                             'manifest\'s directory, without walking any '
+                             'directory or writing checksum files')
     parser.add_argument('-a', '--algorithm',
                         type=str,
                         default='sha512',
-                        choices=['md5',
-                                 'sha1',
-                                 'sha224',
-                                 'sha256',
-                                 'sha384',
-                                 'sha512'],
+                        choices=ALGORITHMS,
                         help='algorithm used to perform checksums')
+    parser.add_argument('-D', '--device_limit',
+                        type=device_limit,
+                        default=[],
+                        action='append',
+                        metavar='[PATH=]N',
+                        help='max number of files to read concurrently from '
+                             'one device, e.g. 1 for spinning disks; '
+                             '"PATH=N" sets the limit for the device '
+                             'containing PATH only; repeat to set several, '
+                             'e.g. "-D 4 -D /mnt/disk=1" [default: no '
+                             'limit]')
+    parser.add_argument('-c', '--cache',
+                        type=str,
+                        default=None,
+                        metavar='FILE',
+                        help='SQLite file caching checksums by inode across '
+                             'runs; files whose inode, size and mtime are '
+                             'unchanged since cached are not re-read')
+    parser.add_argument('-k', '--chunk_size',
+                        type=int,
+                        default=0,
+                        metavar='MB',
+                        help='also store digests of MB-sized chunks of '
+                             'larger files in <algorithm>chunks files to '
+                             'locate damaged byte ranges, tell appended '
+                             'files from modified ones, and verify '
+                             'unchanged files in parallel [default: 0, no '
+                             'chunk digests]')
+    parser.add_argument('-z', '--compressed',
+                        action='store_true',
+                        help='also decompress gzip and BGZF files ({0}) '
+                             'while hashing them to check their CRCs and '
+                             'BGZF EOF blocks, hashing them with Python '
+                             'instead of GNU programs'
+                             .format(', '.join(COMPRESSED_EXTENSIONS)))
+    parser.add_argument('-f', '--fast',
+                        type=str,
+                        default=None,
+                        choices=sorted([name for name in FAST_ALGORITHMS
+                                        if FAST_ALGORITHMS[name]
+                                        is not None]),
+                        help='also store a fast digest of each file in '
+                             '<fast>sums files and only recalculate '
+                             'checksums of files whose fast digest changed, '
+                             'hashing with Python, chunk manifests are not '
+                             'updated [default: None, always calculate '
+                             'checksums]')
+    parser.add_argument('-F', '--confirm',
+                        type=float,
+                        default=30,
+                        metavar='DAYS',
+                        help='with --fast, still recalculate all checksums '
+                             'of a directory if its checksum file is over '
+                             'DAYS old [default: 30]')
+    parser.add_argument('-w', '--dirty',
+                        action='store_true',
+                        help='only audit paths audit_watch.py recorded as '
+                             'changed in the --cache file since the last '
+                             'audit, requires --cache')
+    parser.add_argument('-W', '--full_walk',
+                        type=float,
+                        default=7,
+                        metavar='DAYS',
+                        help='with --dirty, walk the entire tree anyway if '
+                             'it was last walked more than DAYS ago '
+                             '[default: 7]')
     parser.add_argument('-d', '--hidden',
                         action='store_true',
                         help='check files in hidden directories and hidden '
@@ -1132,6 +4041,13 @@ if __name__ == '__main__':
                         type=str,
                         default='syslog',
                         help='log file to write output')
+    parser.add_argument('-u', '--duplicates',
+                        type=str,
+                        default=None,
+                        metavar='REPORT',
+                        help='write groups of duplicate files to REPORT '
+                             'instead of auditing checksums, only hashing '
+                             'files whose size and ends collide')
     parser.add_argument('-r', '--recursive',
                         action='store_true',
                         help='check files in all subdirectories')
@@ -1157,11 +4073,25 @@ if __name__ == '__main__':
                         help='minimum level to log messages')
     parser.add_argument('-t', '--threads',
                         action=ThreadCheck,
-                        type=int,
+                        type=str,
                         default=1,
-                        help='number of threads to run check with')
+                        help='number of threads to run check with, or '
+                             '"auto" to adjust the number during the run '
+                             'based on throughput')
+    parser.add_argument('-T', '--timeout',
+                        type=float,
+                        default=0,
+                        metavar='SECONDS',
+                        help='seconds a daemon may spend per GB of a file, '
+                             'or on a directory, before it is considered '
+                             'hung, restarted, and the file retried once; '
+                             'files under 1 GB get the full allowance '
+                             '[default: 0, no timeout]')
     args = parser.parse_args()
 
+    if args.dirty is True and args.cache is None:
+        parser.error('argument -w/--dirty: requires -c/--cache')
+
     main(args)
 
-sys.exit(0)
+    sys.exit(0)
@@ -10,9 +10,10 @@ from __future__ import print_function
 
 __author__ = 'Christopher Thornton, Alex Hyer'
 __date__ = '2015-03-30'
-__version__ = '2.1.3'
+__version__ = '2.2.0'
 
 import argparse
+import hashlib
 import sys
 import os
 import locale
@@ -21,6 +22,8 @@ import multiprocessing
 from datetime import datetime
 from subprocess import Popen,PIPE
 
+ENCODING = locale.getpreferredencoding()
+
 def output_stream(message, log_file=None):
     if log_file:
         prog = os.path.basename(__file__)
@@ -28,7 +31,7 @@ def output_stream(message, log_file=None):
         hostname = platform.node().split('.')[0]
         output = "{} {} {}: {}".format(date, hostname, prog, message)
         with open(log_file, 'a')  as out_handle:
-	    out_handle.write('{}\n'.format(output))
+            out_handle.write('{}\n'.format(output))
     else:
         print(message)
 
@@ -39,7 +42,7 @@ def file_check(in_file):
         fh = open(in_file)
         fh.close()
     except IOError as e:
-	output_stream(e, log_file)
+        output_stream(e, log_file)
         file_pass = False
     return file_pass
 
@@ -47,75 +50,107 @@ def core_number_check(core_number):
     #Ensure that the number of cores specified is legitimate
     coreNumber = int(core_number)
     if coreNumber < 1:
-	output_stream('Minimum of one core required.')
-	sys.exit(1)
+        output_stream('Minimum of one core required.')
+        sys.exit(1)
     maxCoreNumber = multiprocessing.cpu_count()
     if coreNumber > maxCoreNumber:
-	output_stream('Cannot exceed maximum number of cores: {}'
+        output_stream('Cannot exceed maximum number of cores: {}'
                       .format(maxCoreNumber))
-	sys.exit(1)
+        sys.exit(1)
     return coreNumber
 
-def worker(file_list, commands):
+def worker(file_list, commands, log_file=None):
+    #log_file is passed in as spawned workers don't share module globals
     for file in file_list:
-	sum_check(file, commands)
+        sum_check(file, commands, log_file)
+
+def file_sums(in_file):
+    """compute the md5 and sha256 checksums of a file in a single read"""
+    sums = {'md5': hashlib.md5(), 'sha256': hashlib.sha256()}
+    with open(in_file, 'rb') as in_handle:
+        for block in iter(lambda: in_handle.read(1048576), b''):
+            for value in sums.values():
+                value.update(block)
+    return dict((name, value.hexdigest()) for name, value in sums.items())
+
+def get_xattr(in_file, xattr_name, commands):
+    """return value of extended attribute, empty if it does not exist"""
+    if hasattr(os, 'getxattr'): #Python 3 reads attributes without getfattr
+        try:
+            return os.getxattr(in_file, xattr_name).decode(ENCODING)
+        except OSError:
+            return ''
+    value_stored, get_err = Popen([commands['getfattr'], '-n', \
+        xattr_name, '--only-values', '--absolute-names', in_file], \
+        stdout=PIPE, stderr=PIPE).communicate()
+    return value_stored.decode(ENCODING)
 
-def sum_check(in_file, commands):
+def set_xattr(in_file, xattr_name, value, commands, log_file=None):
+    """store value as extended attribute, logging any error"""
+    if hasattr(os, 'setxattr'):
+        try:
+            os.setxattr(in_file, xattr_name, value.encode(ENCODING))
+        except OSError as e:
+            output_stream(e, log_file)
+        return
+    store_err = Popen([commands['setfattr'], '-n', xattr_name, '-v', \
+        value, in_file], stderr=PIPE).communicate()[1]
+    if store_err:
+        output_stream(store_err.decode(ENCODING), log_file)
+
+def sum_check(in_file, commands, log_file=None):
     """
     Check file for checksums. If values for the md5 and sha256 algorithms do 
     not already exist, compute them and store them with the file
     """
-    algorithms = ['md5sum', 'sha256sum']
-    for algorithm in algorithms:
-        xattr_name = 'user.checksum.{}'.format(algorithm.replace('sum', ''))
-        value_computed, compute_err = Popen([commands[algorithm], in_file], \
-            stdout=PIPE, stderr=PIPE).communicate()
-        value_computed = value_computed.decode(locale.getdefaultlocale()[1]).\
-            split(' ')[0]
-        value_stored, get_err = Popen([commands['getfattr'], '-n', \
-            xattr_name, '--only-values', '--absolute-names', in_file], \
-            stdout=PIPE, stderr=PIPE).communicate()
-        value_stored = value_stored.decode(locale.getdefaultlocale()[1])
+    try:
+        sums = file_sums(in_file)
+    except IOError as e:
+        output_stream(e, log_file)
+        return
+    for algorithm in ['md5', 'sha256']:
+        xattr_name = 'user.checksum.{}'.format(algorithm)
+        value_computed = sums[algorithm]
+        value_stored = get_xattr(in_file, xattr_name, commands)
         if not value_stored: #log and store if checksum doesn't already exist
-            store_err = Popen([commands['setfattr'], '-n', xattr_name, '-v', \
-                value_computed, in_file], stderr=PIPE).communicate()[1]
-            if store_err:
-                output = store_err.decode(locale.getdefaultlocale()[1])
-		output_stream(output, log_file)
+            set_xattr(in_file, xattr_name, value_computed, commands,
+                      log_file)
         elif value_computed != value_stored: #compare the values
-	    output = "{}: {}: checksums do not match".format(os.path.basename(in_file), xattr_name)
-	    output_stream(output, log_file)
+            output = "{}: {}: checksums do not match".format(os.path.basename(in_file), xattr_name)
+            output_stream(output, log_file)
 
 def main():
     output_stream("Data check started", log_file)
-    commands = {'md5sum': '', 'sha256sum': '', 'setfattr': '', 'getfattr': ''}
+    commands = {}
+    if not hasattr(os, 'getxattr'): #Python 2 needs attr tools for xattrs
+        commands = {'setfattr': '', 'getfattr': ''}
     #verify that the system has the proper tools installed
     for command in commands.keys():
         proc, proc_err = Popen(['which', command], stdout=PIPE, stderr=PIPE).\
             communicate()
-        if proc_err:
+        if proc_err or not proc.strip():
             output = "Cannot find {} in system path".format(command)
-	    output_stream(output, log_file)
+            output_stream(output, log_file)
             sys.exit(1)
-        commands[command] = proc.decode(locale.getdefaultlocale()[1]).strip()
+        commands[command] = proc.decode(ENCODING).strip()
 
     #obtain all of the shared data files and calculate their cumulative size
     all_files = []
     total_file_size = 0
     for root, dirs, file_names in os.walk(args.directory):
         for file_name in file_names:
-	    hidden = False
-	    file_path = root + '/' + file_name
-	    split_path = file_path.split('/')
-	    for segment in split_path:
-		if segment != '..':
-		    if segment.startswith('.'):
-			hidden = True
-	    if not hidden:
-		file_status = file_check(file_path)
-		if file_status:
-		    all_files.append(file_path)
-		    total_file_size += os.path.getsize(file_path)
+            hidden = False
+            file_path = root + '/' + file_name
+            split_path = file_path.split('/')
+            for segment in split_path:
+                if segment != '..':
+                    if segment.startswith('.'):
+                        hidden = True
+            if not hidden:
+                file_status = file_check(file_path)
+                if file_status:
+                    all_files.append(file_path)
+                    total_file_size += os.path.getsize(file_path)
     output_stream('Checking {} bytes of data with {} core(s)'
                   .format(str(total_file_size), str(args.cores)), log_file)
 
@@ -125,28 +160,28 @@ def main():
     all_files.sort(key = os.path.getsize, reverse = True)
     count = 0
     for file in all_files:
-	processorList = files_per_processor[count:] + files_per_processor[:count]
-	for processor in processorList:
-	    if processor[0] <= average_file_size:
-		processor.append(file)
-		file_size = os.path.getsize(file)
-		processor[0] += file_size
-		count = files_per_processor.index(processor) 
-		break
-	count += 1
-	if count == args.cores:
-	    count = 0
+        processorList = files_per_processor[count:] + files_per_processor[:count]
+        for processor in processorList:
+            if processor[0] <= average_file_size:
+                processor.append(file)
+                file_size = os.path.getsize(file)
+                processor[0] += file_size
+                count = files_per_processor.index(processor) 
+                break
+        count += 1
+        if count == args.cores:
+            count = 0
 
     #send a list to each core and initiates the process
     jobs = []
     for processor in files_per_processor:
-	if len(processor) > 1: #don't intialize jobs with no data to work on
-	    partial = processor[1:]
-	    p = multiprocessing.Process(target = worker, args = (partial,commands,))
-	    jobs.append(p)
-	    p.start()
+        if len(processor) > 1: #don't intialize jobs with no data to work on
+            partial = processor[1:]
+            p = multiprocessing.Process(target = worker, args = (partial,commands,log_file,))
+            jobs.append(p)
+            p.start()
     for p in jobs: #wait for each process to finish before exiting the program
-	p.join()
+        p.join()
     output_stream('Data check completed', log_file)
     
 if __name__ == '__main__':
@@ -154,18 +189,18 @@ if __name__ == '__main__':
                                      "each file in a given directory and "
                                      "compares it to the existing value")
     parser.add_argument('directory', metavar='DIR',
-			type = str,
-			help = "directory containing files to check")
+                        type = str,
+                        help = "directory containing files to check")
     parser.add_argument('-l', '--log', metavar='LOG',
-			type = str,
-			help = "output to log file")
+                        type = str,
+                        help = "output to log file")
     parser.add_argument('-c', '--cores',
-			type = core_number_check,
-			default = 1,
-			nargs = '?',
-			help = "number of cores to utilize")
+                        type = core_number_check,
+                        default = 1,
+                        nargs = '?',
+                        help = "number of cores to utilize")
     args = parser.parse_args()
     log_file = args.log
     main()
 
-sys.exit(0)
+    sys.exit(0)
@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+
+"""Compare checksums of two trees without reading their files
+
+Each side is either a directory tree containing <algo>sums files, as
+written by integrity_audit.py, or a combined manifest of "checksum  path"
+lines. Entries of both sides are streamed in path order and merge-joined,
+reporting files missing from the backup, extra files only in the backup,
+and files whose checksums differ. Directory trees are read one directory
+at a time in sorted order and manifests are sorted externally in runs, so
+memory use is bounded regardless of the number of files.
+
+Output is one "status  path" line per difference where status is one of
+"missing", "extra" or "differs". Exits with status 1 if any differences
+are found.
+
+Copyright:
+
+    manifest_diff.py Compare checksum manifests of two trees
+    Copyright (C) 2016  William Brazelton, Alex Hyer, Christopher Thornton
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+
+import argparse
+import heapq
+import os
+import sys
+import tempfile
+
+from integrity_audit import read_manifest
+
+__author__ = 'Alex Hyer'
+__email__ = 'theonehyer@gmail.com'
+__license__ = 'GPLv3'
+__maintainer__ = 'Alex Hyer'
+__status__ = 'Production'
+__version__ = '0.1.0'
+
+# Manifest entries sorted in memory at once before spilling to disk
+RUN_SIZE = 1000000
+
+
+def diff_entries(source, backup):
+    """Merge-join two sorted streams of manifest entries
+
+    Args:
+        source (iterable): (key, checksum) tuples sorted by key, where key
+                           is a tuple of path components
+
+        backup (iterable): (key, checksum) tuples sorted by key
+
+    Yields:
+        tuple: status (str) and key (tuple) of each differing entry, where
+               status is 'missing' if key is only in source, 'extra' if
+               key is only in backup, and 'differs' if checksums differ
+
+    Examples:
+        >>> source = [(('a',), '1'), (('b', 'c'), '2'), (('d',), '3')]
+        >>> backup = [(('a',), '1'), (('b', 'c'), '9'), (('e',), '4')]
+        >>> list(diff_entries(source, backup))
+        [('differs', ('b', 'c')), ('missing', ('d',)), ('extra', ('e',))]
+    """
+
+    source = iter(source)
+    backup = iter(backup)
+    s = next(source, None)
+    b = next(backup, None)
+
+    while s is not None or b is not None:
+        if b is None or (s is not None and s[0] < b[0]):
+            yield 'missing', s[0]
+            s = next(source, None)
+        elif s is None or b[0] < s[0]:
+            yield 'extra', b[0]
+            b = next(backup, None)
+        else:
+            if s[1] != b[1]:
+                yield 'differs', s[0]
+            s = next(source, None)
+            b = next(backup, None)
+
+
+def manifest_entries(manifest_path):
+    """Generate entries of a manifest sorted by path
+
+    Manifests are sorted RUN_SIZE entries at a time, with sorted runs
+    written to temporary files and merged if more than one is needed.
+
+    Args:
+        manifest_path (str): path to combined manifest
+
+    Yields:
+        tuple: key (tuple) of path components relative to the manifest's
+               directory and checksum (str) of each file
+    """
+
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    runs = []
+    run = []
+
+    try:
+        for path, checksum in read_manifest(manifest_path):
+            run.append((path_key(os.path.relpath(path, base)), checksum))
+            if len(run) >= RUN_SIZE:
+                runs.append(write_run(run))
+                run = []
+
+        if not runs:
+            run.sort()
+            for entry in run:
+                yield entry
+            return
+
+        runs.append(write_run(run))
+        for entry in heapq.merge(*[read_run(handle) for handle in runs]):
+            yield entry
+    finally:
+        for handle in runs:
+            handle.close()
+
+
+def path_key(path):
+    """Return tuple of components of path so paths sort like a tree walk
+
+    Args:
+        path (str): relative path of a file
+
+    Returns:
+        tuple: components of path
+
+    Examples:
+        >>> path_key('./a/b.txt')
+        ('a', 'b.txt')
+        >>> sorted(['a.b/c', 'a/c'], key=path_key)
+        ['a/c', 'a.b/c']
+    """
+
+    return tuple(part for part in path.split(os.path.sep)
+                 if part not in ('', '.'))
+
+
+def read_run(handle):
+    """Generate (key, checksum) entries of a run written by write_run"""
+
+    handle.seek(0)
+    for line in handle:
+        checksum, path = line.rstrip('\n').split('  ', 1)
+        yield path_key(path), checksum
+
+
+def tree_entries(top, algorithm, key=()):
+    """Generate entries of the <algo>sums files of a tree sorted by path
+
+    Only one directory's checksum file and listing are held in memory at
+    a time.
+
+    Args:
+        top (str): path to directory to read checksum files from
+
+        algorithm (str): hashing algorithm named in checksum files
+
+        key (tuple): path components of top relative to root of tree
+
+    Yields:
+        tuple: key (tuple) of path components relative to root of tree
+               and checksum (str) of each file
+    """
+
+    checksums = {}
+    checksum_file_path = os.path.join(top, algorithm + 'sums')
+    if os.path.isfile(checksum_file_path):
+        for path, checksum in read_manifest(checksum_file_path):
+            checksums[os.path.basename(path)] = checksum
+
+    try:
+        names = os.listdir(top)
+    except OSError:
+        print('Cannot read directory: {0}'.format(top), file=sys.stderr)
+        names = []
+
+    directories = set(name for name in names
+                      if os.path.isdir(os.path.join(top, name))
+                      and not os.path.islink(os.path.join(top, name)))
+
+    # A name can be both listed in the checksum file and a directory, e.g.
+    # when a file was replaced by a directory since the last audit; its
+    # entry sorts before the entries beneath it, so yield it first
+    for name in sorted(directories.union(checksums)):
+        if name in checksums:
+            yield key + (name,), checksums[name]
+        if name in directories:
+            for entry in tree_entries(os.path.join(top, name), algorithm,
+                                      key + (name,)):
+                yield entry
+
+
+def write_run(run):
+    """Sort entries and write them to a temporary file
+
+    Args:
+        run (list): (key, checksum) tuples to sort and write
+
+    Returns:
+        file: open temporary file containing sorted run
+    """
+
+    run.sort()
+    handle = tempfile.TemporaryFile(mode='w+')
+    for key, checksum in run:
+        handle.write(checksum + '  ' + os.path.sep.join(key) + '\n')
+    return handle
+
+
+def main(args):
+    """Control program flow
+
+    Arguments:
+        args (ArgumentParser): args to control program options
+    """
+
+    sides = []
+    for path in (args.source, args.backup):
+        if os.path.isdir(path):
+            sides.append(tree_entries(path, args.algorithm))
+        else:
+            sides.append(manifest_entries(path))
+
+    counts = {'missing': 0, 'extra': 0, 'differs': 0}
+    for status, key in diff_entries(*sides):
+        counts[status] += 1
+        args.output.write(status + '  ' + os.path.sep.join(key) + os.linesep)
+
+    print('{0} missing, {1} extra, {2} differing files'
+          .format(str(counts['missing']), str(counts['extra']),
+                  str(counts['differs'])), file=sys.stderr)
+
+    return 1 if sum(counts.values()) > 0 else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('source',
+                        type=str,
+                        help='directory tree with checksum files or '
+                             'manifest of primary copy')
+    parser.add_argument('backup',
+                        type=str,
+                        help='directory tree with checksum files or '
+                             'manifest of backup copy')
+    parser.add_argument('-a', '--algorithm',
+                        type=str,
+                        default='sha512',
+                        choices=['md5',
+                                 'sha1',
+                                 'sha224',
+                                 'sha256',
+                                 'sha384',
+                                 'sha512'],
+                        help='algorithm named in checksum files of trees')
+    parser.add_argument('-o', '--output',
+                        type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='file to write differences to [default: '
+                             'stdout]')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
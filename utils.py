@@ -6,6 +6,10 @@ Users can specify a program (or database) of interest as an argument and
 receive additional detail about it, including previous versions, dependencies,
 and a list of possible commands supplied by the program. Utils also includes
 functionality for editing the database.
+
+Editing needs write access to the directory holding the database as well as
+to the database itself, as edits are locked, journaled, and compacted in
+files next to it.
 """
 
 from __future__ import print_function
@@ -14,12 +18,82 @@ __author__ = "Christopher Thornton, Alex Hyer"
 __date__ = "2015-11-03"
 
 import sys
+import os
+import bisect
+import contextlib
+import csv
+import fcntl
+import heapq
 import json
+import math
+import marshal
+import shutil
+import tempfile
 import textwrap
 import argparse
+import array
 import re
+import signal
+import socket
+import subprocess
+import threading
+import time
+
+try:
+    raw_input
+except NameError:
+    raw_input = input
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+# bump when the layout of the compiled cache changes
+CACHE_VERSION = 3
+
+# most "did you mean" suggestions to offer for an unknown name
+SUGGESTIONS = 5
+
+# most trigram postings to count when looking for suggestions
+POSTING_BUDGET = 2000
+
+# bytes of edits the journal holds before they are written to the database
+JOURNAL_COMPACT = 256 * 1024
+
+# most bytes of --version output read from a program when scanning
+PROBE_OUTPUT = 4096
+
+# subcommands a running daemon answers, seconds to wait for its answer, and
+# most bytes of a query
+DAEMON_COMMANDS = ('sub_list', 'sub_display', 'sub_search', 'sub_deps',
+                   'sub_rdeps')
+DAEMON_TIMEOUT = 10
+DAEMON_REQUEST = 65536
+
+# derived indexes already loaded by this process, by database and suffix
+DERIVED = {}
 
-def argument_parser():
+# weight of a search term by the field it is found in, weights of all the
+# fields must add up to less than SEARCH_SHIFT
+SEARCH_SHIFT = 32
+SEARCH_WEIGHTS = {
+    'name': 8,
+    'commands': 4,
+    'categories': 3,
+    'description': 1,
+    'version': 1,
+    'previous versions': 1
+    }
+
+def argument_parser(database_type=None):
+    # the daemon parses queries with database_type=str, as relative paths are
+    # the client's and the client sends the database's absolute path as well
     parser = argparse.ArgumentParser(description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parent_parser = argparse.ArgumentParser(add_help=False)
@@ -29,7 +103,7 @@ def argument_parser():
     db_parser = argparse.ArgumentParser(add_help=False)
     db_parser.add_argument('-b', '--database', metavar="DB",
         default="/usr/local/etc/utils.json",
-        type=io_check,
+        type=database_type or io_check,
         help="use a custom JSON-formatted database file [default: "
             "/usr/local/etc/utils.json]")
     subparsers = parser.add_subparsers(title="subcommands", 
@@ -97,7 +171,109 @@ def argument_parser():
     exclusive_group.add_argument('-r', '--remove',
         action='store_true',
         help="remove existing entry from database")
+    edit_parser.add_argument('-y', '--yes',
+        action='store_true',
+        help="remove without asking for confirmation, which needs the "
+            "program's full name")
     edit_parser.set_defaults(func=sub_edit)
+    # batch-specific arguments
+    batch_parser = subparsers.add_parser('batch',
+        parents=[db_parser],
+        help="append, edit, and remove many entries at once")
+    batch_parser.add_argument('operations',
+        metavar='FILE',
+        type=argparse.FileType('r'),
+        help="JSON Lines or CSV file of operations, one per line, each with "
+            "an action (append, edit or remove), a program, and the fields "
+            "to set, named as in the database. In CSV files, list fields are "
+            "comma-separated. \"-\" reads from standard input")
+    batch_parser.add_argument('-f', '--format',
+        choices=['jsonl', 'csv'],
+        help="format of FILE [default: csv if FILE ends in .csv, otherwise "
+            "jsonl]")
+    batch_parser.add_argument('-n', '--dry_run',
+        action='store_true',
+        help="validate operations without applying them")
+    batch_parser.add_argument('-y', '--yes',
+        action='store_true',
+        help="apply removals without asking for confirmation, needed to "
+            "remove entries when FILE is \"-\"")
+    batch_parser.set_defaults(func=sub_batch)
+    # scan-specific arguments
+    scan_parser = subparsers.add_parser('scan',
+        parents=[db_parser],
+        help="find installed programs and propose updates to their versions")
+    scan_parser.add_argument('-m', '--modules',
+        metavar='DIR [,DIR,...]',
+        type=parse_multiple_args,
+        default=[],
+        help="comma-separated list of software trees, e.g. of a module "
+            "system, whose bin directories are searched after PATH")
+    scan_parser.add_argument('-j', '--jobs',
+        metavar='N',
+        type=int,
+        default=16,
+        help="programs to probe at once [default: 16]")
+    scan_parser.add_argument('-w', '--timeout',
+        metavar='SECONDS',
+        type=float,
+        default=2.0,
+        help="seconds to wait for a program to print its version "
+            "[default: 2]")
+    scan_parser.add_argument('-a', '--apply',
+        action='store_true',
+        help="update the database instead of only proposing updates")
+    scan_parser.set_defaults(func=sub_scan)
+    # dependency query arguments
+    deps_parser = subparsers.add_parser('deps',
+        parents=[parent_parser, db_parser],
+        help="list what a program needs, directly or through the programs it "
+            "needs")
+    deps_parser.add_argument('-r', '--direct',
+        action='store_true',
+        help="only list direct dependencies")
+    deps_parser.set_defaults(func=sub_deps)
+    rdeps_parser = subparsers.add_parser('rdeps',
+        parents=[parent_parser, db_parser],
+        help="list the programs that need a program or library, directly or "
+            "through other programs")
+    rdeps_parser.add_argument('-r', '--direct',
+        action='store_true',
+        help="only list programs that need it directly")
+    rdeps_parser.set_defaults(func=sub_rdeps)
+    # search-specific arguments
+    search_parser = subparsers.add_parser('search',
+        parents=[db_parser],
+        help="find entries by words in their names, commands, categories, "
+            "descriptions, or versions")
+    search_parser.add_argument('query',
+        metavar='WORD',
+        nargs='+',
+        help="words to search for, words of three or more letters also match "
+            "longer words they begin")
+    search_parser.add_argument('-n', '--number',
+        metavar='N',
+        type=int,
+        default=20,
+        help="most entries to display [default: 20]")
+    search_parser.set_defaults(func=sub_search)
+    # daemon-specific arguments
+    daemon_parser = subparsers.add_parser('daemon',
+        parents=[db_parser],
+        help="keep the database loaded and answer list, show, search, deps, "
+            "and rdeps for other utils processes, which use it when it is "
+            "running")
+    daemon_parser.add_argument('-s', '--socket',
+        metavar='PATH',
+        help="Unix socket to listen on [default: $UTILS_SOCKET, or the "
+            "database's path with .sock appended]")
+    daemon_parser.add_argument('-m', '--mode',
+        metavar='MODE',
+        type=socket_mode,
+        default=0o666,
+        help="octal permissions of the socket, e.g. 660 to answer only the "
+            "database's group [default: 666]")
+    daemon_parser.set_defaults(func=sub_daemon)
     # display-specific arguments
     display_parser = subparsers.add_parser('show',
         parents=[parent_parser, db_parser],
@@ -130,7 +306,7 @@ def parse_multiple_args(arguments):
     arguments = arguments.split(',')
     return arguments
 
-def io_check(infile, mode='rU'):
+def io_check(infile, mode='r'):
     try:
         fh = open(infile, mode)
     except IOError as e:
@@ -140,17 +316,635 @@ def io_check(infile, mode='rU'):
         fh.close()
     return infile
 
-def autocomplete(user_prog, data):
-    match = False
-    matches = []
+def build_index(data):
+    # lookup tables stored in the compiled cache with the catalog: names by
+    # case-folded name, (folded name, name) pairs sorted for prefix search,
+    # and positions in the sorted pairs of names containing each trigram
+    index = {'folded': {}, 'sorted': [], 'grams': {}}
+    index.update(category_index(data))
     for program in data:
-        user_prog_lower = user_prog.lower()
-        data_prog_lower = program.lower()
-        if user_prog_lower == data_prog_lower:
-            match = program
+        index['folded'][program.lower()] = program
+    index['sorted'] = sorted((program.lower(), program) for program in data)
+    for position, pair in enumerate(index['sorted']):
+        for gram in set(trigrams(pair[0])):
+            index['grams'].setdefault(gram, []).append(position)
+    return index
+
+def category_index(data):
+    # sorted programs in each category, and categories in the order they are
+    # first seen going through the programs in sorted order
+    index = {'categories': {}, 'category_order': []}
+    for program in sorted(data):
+        for category in data[program].get('categories') or []:
+            programs = index['categories'].get(category)
+            if programs is None:
+                programs = index['categories'][category] = []
+                index['category_order'].append(category)
+            if not programs or programs[-1] != program:
+                programs.append(program)
+    return index
+
+def dependency_name(dependency):
+    # drop version requirements, e.g. "Python(>=2.7)"
+    return re.sub(r'\(.*\)\s*$', '', dependency).strip()
+
+def strongly_connected(graph):
+    # Tarjan's algorithm without recursion, so long chains of dependencies
+    # cannot overflow the stack; components come out after every component
+    # they depend on
+    order = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for start in sorted(graph):
+        if start in order:
+            continue
+        order[start] = low[start] = len(order)
+        stack.append(start)
+        on_stack.add(start)
+        work = [(start, iter(graph[start]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in order:
+                    order[child] = low[child] = len(order)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph[child])))
+                    break
+                elif child in on_stack:
+                    low[node] = min(low[node], order[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+def dependency_index(data):
+    # direct and transitive dependencies of each program, and the inverse of
+    # both; dependencies in the catalog go by their catalog name, others by
+    # the first spelling seen, and each member of a cycle needs all the others
+    names = dict((program.lower(), program) for program in data)
+    external = {}
+    graph = {}
+    for program in sorted(data):
+        graph[program] = []
+        for dependency in data[program].get('dependencies') or []:
+            name = dependency_name(dependency)
+            if not name:
+                continue
+            if name.lower() in names:
+                name = names[name.lower()]
+            else:
+                name = external.setdefault(name.lower(), name)
+            if name not in graph[program]:
+                graph[program].append(name)
+    for name in external.values():
+        graph[name] = []
+
+    reach = {}
+    cycles = []
+    for component in strongly_connected(graph):
+        members = set(component)
+        needs = set()
+        for node in component:
+            for dependency in graph[node]:
+                if dependency not in members:
+                    needs.add(dependency)
+                    needs.update(reach[dependency])
+        if len(component) > 1 or component[0] in graph[component[0]]:
+            cycles.append(sorted(component))
+            needs.update(members)
+        for node in component:
+            reach[node] = needs
+
+    index = {'external': external, 'cycles': cycles, 'depends': {},
+             'needed_by': {}, 'requires': {}, 'required_by': {}}
+    for node in sorted(graph):
+        if graph[node]:
+            index['depends'][node] = sorted(graph[node])
+        for dependency in graph[node]:
+            index['needed_by'].setdefault(dependency, []).append(node)
+        requires = sorted(reach[node] - set([node]))
+        if requires:
+            index['requires'][node] = requires
+        for dependency in requires:
+            index['required_by'].setdefault(dependency, []).append(node)
+    return index
+
+def trigrams(name):
+    padded = '  ' + name + ' '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def edit_distance(first, second, bound=None):
+    # Levenshtein distance, one row at a time, of what is left after the
+    # prefix and suffix the names share, which for typos is most of them;
+    # gives up with bound + 1 once every distance in a row is past bound
+    shared = min(len(first), len(second))
+    start = 0
+    while start < shared and first[start] == second[start]:
+        start += 1
+    end = 0
+    while end < shared - start and first[-1 - end] == second[-1 - end]:
+        end += 1
+    first = first[start:len(first) - end]
+    second = second[start:len(second) - end]
+    previous = list(range(len(second) + 1))
+    for i, char_one in enumerate(first, 1):
+        current = [i]
+        for j, char_two in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_one != char_two)))
+        if bound is not None and min(current) > bound:
+            return bound + 1
+        previous = current
+    return previous[-1]
+
+def prefix_matches(user_prog, index):
+    # binary search for the first name with the prefix, then read forward
+    prefix = user_prog.lower()
+    names = index['sorted']
+    matches = []
+    for folded, program in names[bisect.bisect_left(names, (prefix,)):]:
+        if not folded.startswith(prefix):
+            break
+        matches.append(program)
+    return matches
+
+def suggest(user_prog, index, limit=SUGGESTIONS):
+    # names sharing the most trigrams with user_prog, ranked by edit distance
+    # rare trigrams are counted first and common ones, which say little and
+    # cost the most to count, only while under the posting budget
+    folded = user_prog.lower()
+    postings = sorted((index['grams'].get(gram, [])
+                       for gram in set(trigrams(folded))), key=len)
+    shared = {}
+    counted = 0
+    for positions in postings:
+        if counted and counted + len(positions) > POSTING_BUDGET:
+            break
+        counted += len(positions)
+        for position in positions:
+            shared[position] = shared.get(position, 0) + 1
+    candidates = heapq.nlargest(limit * 2, shared, key=shared.get)
+    cutoff = max(2, len(folded) // 2)
+    ranked = sorted((edit_distance(folded, index['sorted'][position][0],
+                                   cutoff),
+                     index['sorted'][position][1])
+                    for position in candidates)
+    return [program for distance, program in ranked[:limit]
+            if distance <= cutoff]
+
+def user_cache_dir():
+    user_cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(user_cache, 'utils')
+
+def search_terms(text):
+    # words, and the parts of words like "bowtie2-build" or "spades.py"
+    found = []
+    for word in search_words(text):
+        found.append(word)
+        parts = re.findall(r'[^\W_]+', word)
+        if len(parts) > 1:
+            found.extend(parts)
+    return found
+
+def search_words(text):
+    words = [word.strip('.+-') for word in re.findall(r'[\w.+-]+',
+                                                      text.lower())]
+    return [word for word in words if word]
+
+def search_index(data):
+    # terms sorted for binary and prefix search, and for each the entries
+    # containing it with the weights of the fields it is in, packed into
+    # unsigned ints as position * SEARCH_SHIFT + weight so the index loads
+    # as a few large strings rather than millions of small objects
+    programs = sorted(data)
+    postings = {}
+    for position, program in enumerate(programs):
+        weights = {}
+        fields = [(program, SEARCH_WEIGHTS['name'])]
+        for field in SEARCH_WEIGHTS:
+            value = data[program].get(field)
+            if type(value) == type(list()):
+                value = ' '.join(value)
+            if value:
+                fields.append((value, SEARCH_WEIGHTS[field]))
+        for text, weight in fields:
+            for term in set(search_terms(text)):
+                weights[term] = weights.get(term, 0) + weight
+        for term in weights:
+            postings.setdefault(term, []).append(position * SEARCH_SHIFT +
+                                                 weights[term])
+    terms = sorted(postings)
+    packed = []
+    for term in terms:
+        values = array.array('I', postings[term])
+        packed.append(values.tobytes() if hasattr(values, 'tobytes')
+                      else values.tostring())
+    return {'programs': programs, 'terms': terms, 'postings': packed}
+
+def term_scores(word, index):
+    # field weight times inverse document frequency of word for each entry
+    # containing it; words of three or more letters also match longer terms
+    # they begin, at half weight
+    terms = index['terms']
+    start = bisect.bisect_left(terms, word)
+    matches = []
+    for position in range(start, len(terms)):
+        if terms[position] == word:
+            matches.append((position, 1.0))
+        elif len(word) >= 3 and terms[position].startswith(word):
+            matches.append((position, 0.5))
+        else:
             break
-        elif data_prog_lower.startswith(user_prog_lower):
-            matches.append(program)
+    scores = {}
+    for position, factor in matches:
+        values = array.array('I')
+        if hasattr(values, 'frombytes'):
+            values.frombytes(index['postings'][position])
+        else:
+            values.fromstring(index['postings'][position])
+        rarity = math.log(1.0 + float(len(index['programs'])) / len(values))
+        for value in values:
+            entry, weight = divmod(value, SEARCH_SHIFT)
+            score = weight * rarity * factor
+            if score > scores.get(entry, 0):
+                scores[entry] = score
+    return scores
+
+def search(query, index, limit):
+    # entries matching the most query words, ranked by the sum of their
+    # scores; a word like "bowtie2-build" matches entries containing it whole,
+    # or at most half weight, entries containing some of its parts
+    scores = {}
+    matched = {}
+    for word in set(search_words(query)):
+        best = term_scores(word, index)
+        parts = re.findall(r'[^\W_]+', word)
+        if len(parts) > 1:
+            part_scores = [term_scores(part, index) for part in parts]
+            for entry in set(part_scores[0]).union(*part_scores[1:]):
+                score = sum(found.get(entry, 0) for found in part_scores) / \
+                    (2.0 * len(parts))
+                if score > best.get(entry, 0):
+                    best[entry] = score
+        for entry in best:
+            scores[entry] = scores.get(entry, 0) + best[entry]
+            matched[entry] = matched.get(entry, 0) + 1
+    most = max(matched.values()) if matched else 0
+    programs = index['programs']
+    ranked = sorted((entry for entry in scores if matched[entry] == most),
+                    key=lambda entry: (-scores[entry],
+                                       programs[entry].lower()))
+    return [programs[entry] for entry in ranked[:limit]]
+
+def cache_paths(database, suffix='.cache'):
+    # caches live next to the database, or in the user's cache directory
+    # when the database's directory is not writable
+    name = os.path.abspath(database).replace(os.sep, '%') + suffix
+    return [database + suffix, os.path.join(user_cache_dir(), name)]
+
+def read_cache(database, suffix, key):
+    # contents of the first cache built from the database as it is now
+    for path in cache_paths(database, suffix):
+        try:
+            with open(path, 'rb') as in_h:
+                cached = marshal.loads(in_h.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            continue
+        if cached[0] == key:
+            return cached[1:]
+    return None
+
+def write_cache(database, suffix, key, *contents):
+    write_cache_file(database, suffix, marshal.dumps((key,) + contents))
+
+def write_names(database, data):
+    # "folded name<tab>name" lines sorted by folded name, read by
+    # utils_complete.py for shell completion without loading this module
+    lines = sorted('{0}\t{1}\n'.format(program.lower(), program)
+                   for program in data)
+    write_cache_file(database, '.names', ''.join(lines).encode('utf-8'))
+
+def write_cache_file(database, suffix, contents):
+    # write to the first writable cache path
+    for path in cache_paths(database, suffix):
+        directory = os.path.dirname(os.path.abspath(path))
+        temp = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, temp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as out_h:
+                out_h.write(contents)
+            os.chmod(temp, 0o644)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            if temp and os.path.exists(temp):
+                os.remove(temp)
+            continue
+        break
+
+def journal_path(database):
+    return database + '.journal'
+
+def database_stamp(database):
+    stat = os.stat(database)
+    return [stat.st_mtime, stat.st_size]
+
+def journal_matches(database, line):
+    # whether the first line of a journal stamps the database as it is now,
+    # so the journal's edits were made to it and not to an older copy
+    try:
+        return json.loads(line).get('database') == database_stamp(database)
+    except (ValueError, AttributeError):
+        return False
+
+def database_key(database):
+    # the journal is only appended to between compactions, so its size is
+    # enough to tell whether it changed
+    stat = os.stat(database)
+    try:
+        journal = os.stat(journal_path(database)).st_size
+    except OSError:
+        journal = 0
+    return (CACHE_VERSION, sys.version_info[0], stat.st_mtime, stat.st_size,
+            journal)
+
+def lock_path(database):
+    return database + '.lock'
+
+@contextlib.contextmanager
+def database_lock(database, operation=fcntl.LOCK_SH):
+    # readers share a lock on a file beside the database, edits take it
+    # exclusively; the database itself is replaced when compacted, so it
+    # cannot hold the lock. A reader that cannot create the lock file reads
+    # unlocked, the database is only ever replaced whole
+    try:
+        fd = os.open(lock_path(database), os.O_RDONLY | os.O_CREAT, 0o644)
+    except OSError as e:
+        if operation == fcntl.LOCK_EX:
+            print_out('Can not lock {0}: {1}. Editing needs write access to '
+                      'the directory holding the database'.format(database, e))
+            sys.exit(1)
+        yield
+        return
+    try:
+        fcntl.flock(fd, operation)
+        yield
+    finally:
+        os.close(fd)
+
+def read_journal(database, data):
+    # apply the edited entries appended since the last compaction, a null
+    # entry is a removal; each line is one edit or batch, and a line cut
+    # short by a crash is skipped as a whole. The first line stamps the
+    # database the journal was started on: if the database was changed by
+    # other than utils since, e.g. edited by hand, the journal is ignored
+    # and the next edit starts it anew
+    try:
+        in_h = open(journal_path(database), 'r')
+    except (IOError, OSError):
+        return data
+    with in_h:
+        first = in_h.readline()
+        if first and not journal_matches(database, first):
+            print('{0} was changed outside of utils after the edits in {1} '
+                  'were made. Ignoring them, the next edit discards them'
+                  .format(database, journal_path(database)), file=sys.stderr)
+            return data
+        for line in in_h:
+            try:
+                edit = json.loads(line)
+            except ValueError:
+                continue
+            for program, entry in edit['entries'].items():
+                if entry is None:
+                    data.pop(program, None)
+                else:
+                    data[program] = entry
+    return data
+
+def append_journal(database, data, programs):
+    # record the whole entry of each edited program, so replaying the journal
+    # twice gives the same catalog, and return the journal's size. A journal
+    # that is empty, or was ignored as the database changed since it was
+    # started, is started anew with the database's stamp
+    journal = journal_path(database)
+    with open(journal, 'ab+') as out_h:
+        out_h.seek(0)
+        if not journal_matches(database, out_h.readline().decode('utf-8')):
+            out_h.truncate(0)
+            out_h.seek(0)
+            shutil.copymode(database, journal)
+            out_h.write((json.dumps({'database': database_stamp(database)})
+                         + '\n').encode('ascii'))
+        else:
+            out_h.seek(-1, os.SEEK_END)
+            if out_h.read(1) != b'\n':
+                out_h.write(b'\n')
+        edit = {'entries': dict((program, data.get(program))
+                                for program in programs)}
+        out_h.write((json.dumps(edit, sort_keys=True) + '\n')
+                    .encode('ascii'))
+        out_h.flush()
+        os.fsync(out_h.fileno())
+        return out_h.tell()
+
+def compact_database(database, data):
+    # write the catalog to a new file and rename it over the database, so a
+    # crash or full disk leaves the old database and journal whole, then empty
+    # the journal; replaying it over the new database would change nothing
+    target = os.path.realpath(database)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(target))
+    try:
+        with os.fdopen(fd, 'w') as out_h:
+            out_h.write(json.dumps(data, sort_keys=True))
+            out_h.flush()
+            os.fsync(out_h.fileno())
+        shutil.copymode(target, temp)
+        os.rename(temp, target)
+    except BaseException:
+        os.remove(temp)
+        raise
+    # the rename must be on disk before the journal is emptied
+    directory = os.open(os.path.dirname(target), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    if os.path.exists(journal_path(database)):
+        open(journal_path(database), 'w').close()
+
+def write_edits(database, data, programs, index=None):
+    # the caller holds the exclusive lock; the database is only rewritten when
+    # the journal has grown past JOURNAL_COMPACT or cannot be written, and a
+    # failed compaction of an edit already journaled is retried next edit
+    try:
+        size = append_journal(database, data, programs)
+        journaled = True
+    except (IOError, OSError):
+        size = JOURNAL_COMPACT
+        journaled = False
+    if size >= JOURNAL_COMPACT:
+        try:
+            compact_database(database, data)
+        except (IOError, OSError) as e:
+            if not journaled:
+                print_out('Can not write next to {0}: {1}. Editing needs '
+                          'write access to the directory holding the database'
+                          .format(database, e))
+                sys.exit(1)
+    compile_database(database, data, index)
+
+def compile_database(database, data, index=None):
+    # write the catalog and its indexes to the first writable cache path,
+    # keyed on the state of the database and its journal
+    if index is None:
+        index = build_index(data)
+    write_cache(database, '.cache', database_key(database), data, index)
+    write_names(database, data)
+    return index
+
+def read_database(database):
+    # use the compiled cache if it was built from the database and journal as
+    # they are now, otherwise parse the JSON, replay the journal and rebuild
+    # the cache; the caller holds the lock
+    cached = read_cache(database, '.cache', database_key(database))
+    if cached:
+        return cached
+    with open(database, 'r') as in_h:
+        data = json.load(in_h)
+    read_journal(database, data)
+    return data, compile_database(database, data)
+
+def load_database(database):
+    with database_lock(database):
+        return read_database(database)
+
+def load_derived(database, suffix, build):
+    # indexes only a few commands need, like the dependency closure, have
+    # caches of their own, built the first time one runs after the database
+    # changes, so they do not slow down loading the catalog
+    with database_lock(database):
+        key = database_key(database)
+        loaded = DERIVED.get((database, suffix))
+        if loaded and loaded[0] == key:
+            return loaded[1]
+        cached = read_cache(database, suffix, key)
+        if cached:
+            derived = cached[0]
+        else:
+            derived = build(read_database(database)[0])
+            write_cache(database, suffix, key, derived)
+        DERIVED[(database, suffix)] = (key, derived)
+        return derived
+
+def socket_mode(mode):
+    return int(mode, 8)
+
+def socket_path(database):
+    return os.environ.get('UTILS_SOCKET') or database + '.sock'
+
+def query_daemon(args, argv):
+    # the daemon's answer to the command line argv, or None if no daemon is
+    # running for the database, so the caller loads it itself
+    path = socket_path(args.database)
+    if not os.path.exists(path):
+        return None
+    request = {'argv': argv, 'database': os.path.abspath(args.database)}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(DAEMON_TIMEOUT)
+        client.connect(path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        reply = json.loads(b''.join(chunks).decode('utf-8'))
+    except (IOError, OSError, socket.error, ValueError):
+        return None
+    finally:
+        client.close()
+    return reply if reply.get('served') else None
+
+def answer_query(request, database, loaded):
+    # parse a query from query_daemon as the command line would be, run it
+    # against the loaded catalog, reloading it first if the database or its
+    # journal changed, and return its output; queries the daemon does not
+    # answer, or that do not parse, are left to the client. The caller holds
+    # loaded['lock'], as output is captured by replacing sys.stdout
+    if request.get('database') != database:
+        return {'served': False}
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO()
+    try:
+        args = argument_parser(str).parse_args(
+            [argument if isinstance(argument, str) else
+             argument.encode('utf-8') for argument in request['argv']])
+    except SystemExit:
+        return {'served': False}
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    if getattr(args, 'func', None) is None or \
+        args.func.__name__ not in DAEMON_COMMANDS:
+        return {'served': False}
+    args.database = database
+    with database_lock(database):
+        key = database_key(database)
+        if loaded.get('key') != key:
+            loaded['data'], loaded['index'] = read_database(database)
+            loaded['key'] = key
+    sys.stdout = StringIO()
+    status = 0
+    try:
+        args.func(args, loaded['data'], loaded['index'])
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return {'served': True, 'status': status, 'output': output}
+
+def serve_query(connection, database, loaded):
+    # answer one client, on a thread of its own so a slow client delays no
+    # other; a query that fails is left to the client. Failures are logged
+    # to the daemon's own stderr, as sys.stderr is replaced while another
+    # thread answers
+    try:
+        connection.settimeout(DAEMON_TIMEOUT)
+        line = connection.makefile('rb').readline(DAEMON_REQUEST)
+        request = json.loads(line.decode('utf-8'))
+        with loaded['lock']:
+            reply = answer_query(request, database, loaded)
+        connection.sendall(json.dumps(reply).encode('utf-8'))
+    except Exception as e:
+        print('Failed to answer a query: {0}'.format(e),
+              file=loaded['stderr'])
+    finally:
+        connection.close()
+
+def autocomplete(user_prog, data, index):
+    match = index['folded'].get(user_prog.lower(), False)
+    matches = []
+    if not match:
+        matches = prefix_matches(user_prog, index)
     if not match and len(matches) == 1:
         print_out('Assuming "{0}" meant "{1}"'.format(user_prog, matches[0]))
         print()
@@ -164,6 +958,10 @@ def autocomplete(user_prog, data):
     elif not match and len(matches) == 0:
         print('"{0}" did not match anything in the database.'
               .format(user_prog))
+        suggestions = suggest(user_prog, index)
+        if suggestions:
+            print('Did you mean one of the following:\n{0}'
+                  .format('\n'.join(suggestions)))
         sys.exit(0)
     return match
 
@@ -192,48 +990,291 @@ def relevant_values(all_args, name, data):
             given_args.append(arg)
     return given_args
 
-def sub_list(args, data):
-    if args.categories:
-        categories = []
-        for program in sorted(data):
+def new_entry():
+    return {"description": "", "version": "", "previous versions": [],
+            "commands": [], "installation method": "", "dependencies": [],
+            "categories": []}
+
+def update_entry(entry, values):
+    # a list starting with "+" extends the field, a list starting with "-" or
+    # a "-" string clears it
+    for field in values:
+        value = values[field]
+        if type(value) == type(list()) and value[:1] == ['+']:
+            entry.setdefault(field, []).extend(value[1:])
+        elif type(value) == type(list()) and value[:1] == ['-']:
+            entry[field] = []
+        elif value == '-':
+            entry[field] = ""
+        elif type(value) == type(list()):
+            entry[field] = list(value)
+        else:
+            entry[field] = value
+
+def read_operations(in_h, format):
+    # (line number, operation) pairs, and (line number, error) pairs for the
+    # lines that could not be parsed
+    operations = []
+    errors = []
+    if format == 'csv':
+        reader = csv.DictReader(in_h)
+        for row in reader:
+            operation = {}
+            for field in row:
+                value = row[field]
+                if field is None or value is None or value == '':
+                    continue
+                if type(new_entry().get(field)) == type(list()):
+                    value = parse_multiple_args(value)
+                operation[field] = value
+            operations.append((reader.line_num, operation))
+    else:
+        for number, line in enumerate(in_h, 1):
+            if not line.strip():
+                continue
             try:
-                prog_cat = data[program]["categories"]
-                for cat in prog_cat:
-                    if not cat in categories:
-                        categories.append(cat)
-            except KeyError:
-                pass
-        print('\n'.join(categories))
+                operation = json.loads(line)
+            except ValueError as e:
+                errors.append((number, str(e)))
+                continue
+            if type(operation) != type(dict()):
+                errors.append((number, 'not a JSON object'))
+                continue
+            operations.append((number, operation))
+    return operations, errors
+
+def validate_operations(data, operations):
+    # check every operation against the catalog as the ones before it in the
+    # batch leave it, return (line number, error) pairs
+    errors = []
+    fields = new_entry()
+    exists = {}
+    for number, operation in operations:
+        action = operation.get('action')
+        program = operation.get('program')
+        problems = []
+        if action not in ('append', 'edit', 'remove'):
+            problems.append('unknown action "{0}"'.format(action))
+        if not program or not isinstance(program, string_types):
+            problems.append('no program given')
+            program = None
+        for field in sorted(operation):
+            if field in ('action', 'program'):
+                continue
+            value = operation[field]
+            if field not in fields:
+                problems.append('unknown field "{0}"'.format(field))
+            elif action == 'remove':
+                problems.append('removals take no fields')
+                break
+            elif type(fields[field]) == type(list()) and \
+                (type(value) != type(list()) or
+                 not all(isinstance(item, string_types) for item in value)):
+                problems.append('"{0}" must be a list'.format(field))
+            elif type(fields[field]) != type(list()) and \
+                not isinstance(value, string_types):
+                problems.append('"{0}" must be a string'.format(field))
+        if program is not None and action in ('append', 'edit', 'remove'):
+            present = exists.get(program, program in data)
+            if action == 'append' and present:
+                problems.append('"{0}" already exists'.format(program))
+            elif action != 'append' and not present:
+                problems.append('"{0}" does not exist'.format(program))
+            else:
+                exists[program] = action != 'remove'
+        for problem in problems:
+            errors.append((number, problem))
+    return errors
+
+def apply_operations(data, operations):
+    # apply validated operations, return the programs they changed
+    changed = []
+    for number, operation in operations:
+        program = operation['program']
+        values = dict((field, operation[field]) for field in operation
+                      if field not in ('action', 'program'))
+        if operation['action'] == 'remove':
+            del data[program]
+        else:
+            if operation['action'] == 'append':
+                data[program] = new_entry()
+            update_entry(data[program], values)
+        if program not in changed:
+            changed.append(program)
+    return changed
+
+def commit_operations(database, operations):
+    # validate operations against the catalog as it is once locked, then
+    # write every change at once, if there are any; return the errors if
+    # there were any
+    io_check(database, 'a')
+    with database_lock(database, fcntl.LOCK_EX):
+        data = read_database(database)[0]
+        errors = validate_operations(data, operations)
+        if not errors:
+            changed = apply_operations(data, operations)
+            if changed:
+                write_edits(database, data, changed)
+    return errors
+
+def version_key(version):
+    return tuple(int(number) for number in re.findall(r'\d+', version))
+
+def executables(directory):
+    # (name, path) of the executable files in a directory
+    found = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return found
+    for name in names:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            found.append((name, path))
+    return found
+
+def bin_directories(top):
+    found = []
+    for root, dirs, files in os.walk(top):
+        dirs.sort()
+        if os.path.basename(root) == 'bin':
+            found.append(root)
+            dirs[:] = []
+    return found
+
+def probe_version(path, timeout):
+    # version-like strings printed by "path --version", killing the program
+    # and anything it started if it takes longer than timeout
+    try:
+        with open(os.devnull, 'r') as null:
+            process = subprocess.Popen([path, '--version'], stdin=null,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       preexec_fn=os.setsid)
+    except OSError:
+        return []
+    def kill():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output = process.stdout.read(PROBE_OUTPUT)
+        process.stdout.close()
+        process.wait()
+    finally:
+        timer.cancel()
+    output = output.decode('ascii', 'replace')
+    return re.findall(r'(?<![\w.])v?(\d+(?:\.\d+)+[a-z]?)(?![\w.])', output)
+
+def read_scan_cache(path):
+    try:
+        with open(path, 'rb') as in_h:
+            cached = marshal.loads(in_h.read())
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return {}
+    if cached[0] != (CACHE_VERSION, sys.version_info[0]):
+        return {}
+    return cached[1]
+
+def write_scan_cache(path, probes):
+    directory = os.path.dirname(path)
+    temp = None
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as out_h:
+            out_h.write(marshal.dumps(((CACHE_VERSION, sys.version_info[0]),
+                                       probes)))
+        os.rename(temp, path)
+    except (IOError, OSError):
+        if temp and os.path.exists(temp):
+            os.remove(temp)
+
+def scan_versions(data, directories, modules, jobs, timeout):
+    # newest version found for each program whose commands, or name if it
+    # lists none, match an executable, with the path it was found at; versions
+    # are cached by path, mtime and size so only new or changed executables
+    # are run; the pool is imported here as it is slow to import and only scan
+    # needs it
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(jobs)
+    try:
+        for found in pool.map(bin_directories, modules):
+            directories = directories + found
+        candidates = {}
+        for program in data:
+            names = data[program].get('commands') or [program.lower()]
+            for name in names:
+                candidates.setdefault(name, set()).add(program)
+        paths = []
+        for found in pool.map(executables, directories):
+            for name, path in found:
+                if name in candidates:
+                    paths.append((name, os.path.realpath(path)))
+
+        cache_path = os.path.join(user_cache_dir(), 'scan.cache')
+        cached = read_scan_cache(cache_path)
+        probes = {}
+        stale = []
+        for path in set(path for name, path in paths):
+            stat = os.stat(path)
+            key = (stat.st_mtime, stat.st_size)
+            if path in cached and cached[path][:2] == key:
+                probes[path] = cached[path]
+            else:
+                probes[path] = key + ([],)
+                stale.append(path)
+        for path, versions in zip(stale, pool.map(
+                lambda path: probe_version(path, timeout), stale)):
+            probes[path] = probes[path][:2] + (versions,)
+        write_scan_cache(cache_path, probes)
+    finally:
+        pool.close()
+        pool.join()
+
+    found = {}
+    for name, path in paths:
+        for program in candidates[name]:
+            known = data[program].get('version') or ''
+            versions = probes[path][2]
+            if known in versions:
+                version = known
+            elif versions:
+                version = versions[0]
+            else:
+                continue
+            if program not in found or \
+                version_key(version) > version_key(found[program][0]):
+                found[program] = (version, path)
+    return found
+
+def sub_list(args, data, index):
+    if args.categories:
+        print('\n'.join(index['category_order']))
     elif args.category:
         for category in args.category:
             print()
             print( '-' * len(category))
             print('{0}'.format(category))
             print('-' * len(category))
-            exists = False
-            for program in sorted(data):
-                try:
-                    prog_cat = data[program]["categories"]
-                    if category in prog_cat:
-                        print(program)
-                        exists = True
-                except KeyError:
-                    pass
-            if not exists:
+            programs = index['categories'].get(category)
+            if programs:
+                print('\n'.join(programs))
+            else:
                 print('No such category: {0}'.format(category))
                 print('Type use --categories to view possible categories')
     else:            
-        for entry in sorted(data):
-            try:
-                category = data[entry]["categories"]
-            except KeyError:
-                category = ''
-            if args.ref_dbs:
-                if "db" not in category:
-                    continue
-            else:
-                if "db" in category:
-                    continue
+        ref_dbs = index['categories'].get("db", [])
+        if args.ref_dbs:
+            entries = ref_dbs
+        else:
+            ref_dbs = set(ref_dbs)
+            entries = [entry for entry in sorted(data) if entry not in ref_dbs]
+        for entry in entries:
             version = data[entry]["version"]
             if version:
                 col_one = "{}({}): ".format(entry, version)
@@ -242,9 +1283,9 @@ def sub_list(args, data):
             col_two = data[entry]["description"]
             display_info(col_one, col_two)
 
-def sub_display(args, data):
+def sub_display(args, data, index):
     all_args = vars(args)
-    program = autocomplete(args.program, data)
+    program = autocomplete(args.program, data, index)
     if program:
         version = data[program]["version"]
         if version:
@@ -276,63 +1317,235 @@ def sub_display(args, data):
         print_out(output)
         sys.exit(1)
 
-def sub_edit(args, data):
+def sub_edit(args, data, index):
     all_args = vars(args)
-    if not args.append:
-        match = autocomplete(args.program, data)
-    else:
+    io_check(args.database, 'a')
+    if args.append:
         match = False
+    elif args.remove and args.yes:
+        # never guess at what to remove without asking
+        match = index['folded'].get(args.program.lower(), False)
+    else:
+        match = autocomplete(args.program, data, index)
     if args.remove:
-        if match:
+        if match and not args.yes:
             answer = raw_input("Delete \"{}\" [y, n]? ".format(match))
-            if answer.lower() == 'y':
-                del data[match]
-            elif answer.lower() == 'n':
+            if answer.lower() == 'n':
                 sys.exit(0)
-            else:
+            elif answer.lower() != 'y':
                 print("\"{}\" is not a valid option".format(answer))
                 sys.exit(1)
-        else:
+        elif not match and args.yes:
+            print_out("\"{}\" does not exists in the database of available "
+                      "programs. Removing with -y needs the program's full "
+                      "name. Nothing done.".format(args.program))
+            sys.exit(1)
+        elif not match:
             print_out("\"{}\" does not exists in the database of available "
                       "programs. Nothing done.".format(args.program))
             sys.exit(1)
-    elif args.edit:
-        if match:
-            categories = relevant_values(all_args, match, data)
-            for category in categories:
-                if type(all_args[category]) == type(list()) and \
-                    all_args[category][0] == '+':
-                    all_args[category].remove('+')
-                    data[match][category].extend(all_args[category])
-                elif type(all_args[category]) == type(list()) and \
-                    all_args[category][0] == '-':
-                    data[match][category] = []
-                elif type(all_args[category]) == type(str()) and \
-                    all_args[category] == '-':
-                    data[match][category] = ""  
-                else:
-                    data[match][category] = all_args[category]
+
+    # apply the edit to the catalog as it is once locked, which may include
+    # edits made since it was read above
+    with database_lock(args.database, fcntl.LOCK_EX):
+        data, index = read_database(args.database)
+        if match and match not in data:
+            print_out("\"{}\" was removed from the database by another edit. "
+                      "Nothing done.".format(match))
+            sys.exit(1)
+        if args.remove:
+            del data[match]
+        elif args.edit:
+            if match:
+                categories = relevant_values(all_args, match, data)
+                update_entry(data[match], dict((category, all_args[category])
+                                               for category in categories))
+                # names are unchanged, only the categories need reindexing
+                index.update(category_index(data))
+            else:
+                print_out("\"{}\" does not exists in database. Nothing to "
+                          "edit.".format(args.program))
+                sys.exit(0)
+        elif args.append:
+            if args.program not in data:
+                data[args.program] = new_entry()
+                categories = relevant_values(all_args, args.program, data)
+                for category in categories:
+                    data[args.program][category] += all_args[category]
+                match = args.program
+            else:
+                print_out("\"{}\" already exists in database. Use \"utils "
+                          "edit -e <program>\" to modify an entry"
+                          .format(args.program))
+                sys.exit(1)
+        if not args.edit:
+            index = None
+        write_edits(args.database, data, [match], index)
+
+def sub_batch(args, data, index):
+    format = args.format
+    if not format:
+        format = 'csv' if args.operations.name.endswith('.csv') else 'jsonl'
+    operations, errors = read_operations(args.operations, format)
+    errors += validate_operations(data, operations)
+    if errors:
+        for number, error in sorted(errors):
+            print('line {0}: {1}'.format(number, error))
+        print('{0} errors in {1}. Nothing done.'
+              .format(len(errors), args.operations.name))
+        sys.exit(1)
+    counts = [len([operation for number, operation in operations
+                   if operation['action'] == action])
+              for action in ('append', 'edit', 'remove')]
+    summary = '{0} appends, {1} edits and {2} removals'.format(*counts)
+    if args.dry_run:
+        print('Validated {0}'.format(summary))
+        return
+    if counts[2] and not args.yes and args.operations is sys.stdin:
+        print_out('Removals read from standard input can not be confirmed. '
+                  'Use -y to apply them. Nothing done.')
+        sys.exit(1)
+    elif counts[2] and not args.yes:
+        answer = raw_input("Apply {} [y, n]? ".format(summary))
+        if answer.lower() == 'n':
+            sys.exit(0)
+        elif answer.lower() != 'y':
+            print("\"{}\" is not a valid option".format(answer))
+            sys.exit(1)
+    errors = commit_operations(args.database, operations)
+    if errors:
+        for number, error in errors:
+            print('line {0}: {1}'.format(number, error))
+        print('The database was changed by another edit. Nothing done.')
+        sys.exit(1)
+    print('Applied {0}'.format(summary))
+
+def sub_scan(args, data, index):
+    directories = [directory for directory in
+                   os.environ.get('PATH', '').split(os.pathsep) if directory]
+    found = scan_versions(data, directories, args.modules, args.jobs,
+                          args.timeout)
+    operations = []
+    today = time.strftime('%Y-%m-%d')
+    for program in sorted(found):
+        version, path = found[program]
+        known = data[program].get('version') or ''
+        if version == known:
+            continue
+        display_info('{0}: '.format(program),
+                     '{0} -> {1} ({2})'.format(known or 'NA', version, path))
+        operation = {'action': 'edit', 'program': program,
+                     'version': version}
+        if known and known != 'null':
+            operation['previous versions'] = ['+', '{0}({1})'
+                                              .format(known, today)]
+        operations.append((len(operations) + 1, operation))
+    if not operations:
+        print('Found {0} programs, all up to date'.format(len(found)))
+    elif not args.apply:
+        print('Found {0} programs, {1} with new versions. Use -a to update '
+              'the database'.format(len(found), len(operations)))
+    else:
+        errors = commit_operations(args.database, operations)
+        if errors:
+            print('The database was changed by another edit. Nothing done.')
+            sys.exit(1)
+        print('Updated {0} programs'.format(len(operations)))
+
+def dependency_query(args, data, index, direct, transitive):
+    dependencies = load_derived(args.database, '.deps', dependency_index)
+    name = dependency_name(args.program)
+    if name.lower() in index['folded']:
+        name = index['folded'][name.lower()]
+    elif name.lower() in dependencies['external']:
+        name = dependencies['external'][name.lower()]
+    else:
+        name = autocomplete(args.program, data, index)
+    for cycle in dependencies['cycles']:
+        if name in cycle:
+            print_out('Warning: "{0}" is in a dependency cycle with: {1}'
+                      .format(name, ', '.join(member for member in cycle
+                                              if member != name)
+                              or name))
+    if args.direct:
+        table = dependencies[direct]
+    else:
+        table = dependencies[transitive]
+    for program in table.get(name, []):
+        if program in data:
+            print(program)
         else:
-            print_out("\"{}\" does not exists in database. Nothing to edit."
-                      .format(args.program))
-    elif args.append:
-        if not match:
-            data[args.program] = {"description": "", "version": "", 
-                                  "previous versions": [], "commands": [], 
-                                  "installation method": "", "dependencies": [],
-                                  "categories": []
-                                 }
-            categories = relevant_values(all_args, args.program, data)
-            for category in categories:
-                data[args.program][category] += all_args[category]
+            print('{0} (not in database)'.format(program))
+    return name in table
+
+def sub_deps(args, data, index):
+    if not dependency_query(args, data, index, 'depends', 'requires'):
+        print('"{0}" has no dependencies'.format(args.program))
+
+def sub_rdeps(args, data, index):
+    if not dependency_query(args, data, index, 'needed_by', 'required_by'):
+        print('Nothing in the database needs "{0}"'.format(args.program))
+
+def sub_search(args, data, index):
+    query = ' '.join(args.query)
+    results = search(query, load_derived(args.database, '.search',
+                                         search_index), args.number)
+    if not results:
+        print('"{0}" did not match anything in the database.'.format(query))
+    for program in results:
+        version = data[program]["version"]
+        if version:
+            col_one = "{}({}): ".format(program, version)
+        else:
+            col_one = program
+        display_info(col_one, data[program]["description"])
+
+def sub_daemon(args, data, index):
+    database = os.path.abspath(args.database)
+    path = args.socket or socket_path(args.database)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.remove(path)
         else:
-            print_out("\"{}\" already exists in database. Use \"utils edit -e "
-                      "<program>\" to modify an entry".format(args.program))
+            print('A daemon is already listening on {0}'.format(path))
             sys.exit(1)
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+    except socket.error as e:
+        print('Can not listen on {0}: {1}. Use -s to choose another socket'
+              .format(path, e))
+        sys.exit(1)
+    # any user who can read the database may query it, unless -m says
+    # otherwise
+    os.chmod(path, args.mode)
+    server.listen(64)
 
-    utils = io_check(args.database, 'w')
-    with open(utils, 'w') as out_h:
-        out_h.write(json.dumps(data, sort_keys=True))
+    # stop cleanly, removing the socket, when asked to
+    def stop(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+
+    print('Serving {0} on {1}'.format(database, path))
+    sys.stdout.flush()
+    loaded = {'lock': threading.Lock(), 'stderr': sys.stderr}
+    try:
+        while True:
+            connection = server.accept()[0]
+            thread = threading.Thread(target=serve_query,
+                                      args=(connection, database, loaded))
+            thread.daemon = True
+            thread.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(path)
 
 def print_out(line, width=79, initial='', subsequent=''):
     output = textwrap.fill(line, width, initial_indent=initial, 
@@ -341,10 +1554,16 @@ def print_out(line, width=79, initial='', subsequent=''):
 
 def main():
     args = argument_parser().parse_args()
-    utils = args.database
-    with open(utils, 'rU') as in_h:
-        json_data = json.load(in_h)
-    args.func(args, json_data)
+    if args.func.__name__ in DAEMON_COMMANDS:
+        reply = query_daemon(args, sys.argv[1:])
+        if reply is not None:
+            output = reply['output']
+            if sys.version_info[0] < 3:
+                output = output.encode('utf-8')
+            sys.stdout.write(output)
+            sys.exit(reply['status'])
+    json_data, index = load_database(args.database)
+    args.func(args, json_data, index)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+"""
+Prints the names of entries in the utils database that begin with a prefix,
+ignoring case, for shell tab completion. Names are read from the sorted list
+utils.py writes next to its compiled cache; utils.py itself is only loaded
+to rebuild the list when it is missing or older than the database.
+
+Usage: utils_complete.py [-b DB] [--] PREFIX
+"""
+
+__author__ = "Christopher Thornton, Alex Hyer"
+__date__ = "2015-11-03"
+
+import sys
+import os
+import bisect
+
+# keep in step with the default of utils.py --database
+DATABASE = "/usr/local/etc/utils.json"
+
+def name_paths(database):
+    # same places as utils.cache_paths(database, '.names')
+    user_cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    name = os.path.abspath(database).replace(os.sep, '%') + '.names'
+    return [database + '.names', os.path.join(user_cache, 'utils', name)]
+
+def read_names(database):
+    # the first name list at least as new as the database and its journal
+    changed = os.stat(database).st_mtime
+    try:
+        changed = max(changed, os.stat(database + '.journal').st_mtime)
+    except OSError:
+        pass
+    for path in name_paths(database):
+        try:
+            if os.stat(path).st_mtime < changed:
+                continue
+            with open(path, 'rb') as in_h:
+                return in_h.read().decode('utf-8').splitlines()
+        except (IOError, OSError):
+            continue
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import utils
+    data = utils.load_database(database)[0]
+    utils.write_names(database, data)
+    return sorted(u'{0}\t{1}'.format(program.lower(), program)
+                  for program in data)
+
+def complete(prefix, lines):
+    # lines start with the folded name, so the matches are together
+    prefix = prefix.lower()
+    matches = []
+    for line in lines[bisect.bisect_left(lines, prefix):]:
+        if not line.startswith(prefix):
+            break
+        matches.append(line.split(u'\t', 1)[1])
+    return matches
+
+def main():
+    args = sys.argv[1:]
+    database = DATABASE
+    if args[:1] in (['-b'], ['--database']) and len(args) > 1:
+        database = args[1]
+        args = args[2:]
+    if args[:1] == ['--']:
+        args = args[1:]
+    prefix = args[0] if args else ''
+    if sys.version_info[0] < 3:
+        prefix = prefix.decode('utf-8')
+    try:
+        matches = complete(prefix, read_names(database))
+    except (IOError, OSError, ValueError):
+        sys.exit(1)
+    out = u'\n'.join(matches)
+    if matches:
+        out += u'\n'
+    if sys.version_info[0] < 3:
+        sys.stdout.write(out.encode('utf-8'))
+    else:
+        sys.stdout.write(out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env bash
+# Tab completion of subcommands and entry names for utils.py
+#
+# Source from ~/.bashrc or copy to /etc/bash_completion.d. Entry names come
+# from utils_complete.py, which must be on PATH next to utils.py.
+
+_utils() {
+    local cur=${COMP_WORDS[COMP_CWORD]}
+    local prev=${COMP_WORDS[COMP_CWORD-1]}
+    local database=() i
+    COMPREPLY=()
+
+    if [ $COMP_CWORD -eq 1 ]; then
+        COMPREPLY=( $(compgen -W "list edit show batch scan deps rdeps \
+search daemon" -- "$cur") )
+        return
+    fi
+
+    for (( i=2; i < COMP_CWORD; i++ )); do
+        case ${COMP_WORDS[i]} in
+            -b|--database) database=(-b "${COMP_WORDS[i+1]}");;
+        esac
+    done
+
+    case $prev in
+        -b|--database)
+            COMPREPLY=( $(compgen -f -- "$cur") )
+            return;;
+    esac
+
+    case ${COMP_WORDS[1]} in
+        show|edit|deps|rdeps)
+            if [[ $cur != -* ]]; then
+                local IFS=$'\n'
+                COMPREPLY=( $(utils_complete.py "${database[@]}" -- "$cur" \
+                    2>/dev/null) )
+            fi;;
+        batch)
+            COMPREPLY=( $(compgen -f -- "$cur") );;
+        daemon)
+            case $prev in
+                -s|--socket)
+                    COMPREPLY=( $(compgen -f -- "$cur") );;
+            esac;;
+    esac
+}
+
+complete -F _utils utils utils.py